@@ -0,0 +1,105 @@
+"""Downscale and recompress images to the size they are placed at on a slide.
+
+Pexels "landscape"/"original" photos are far larger than a 3.5" picture needs.
+prepare_image() resizes to width_in * dpi pixels, re-encodes as JPEG at the
+given quality and caches the variant on disk, keyed by the source file and the
+settings, so the work happens once per image. prune_variants() keeps that
+cache under a byte budget, together with the empty ".orig" markers that
+remember sources not worth recompressing.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from PIL import Image
+
+# What an empty keep marker is charged against the budget (a filesystem block)
+MARKER_BYTES = 4096
+# Temp files of writes that died mid-way are removed once this old (seconds)
+STALE_PART_SECONDS = 3600
+
+
+def variant_key(src_path, width_px, quality) -> str:
+    info = os.stat(src_path)
+    raw = f"{os.path.abspath(src_path)}:{info.st_size}:{info.st_mtime_ns}:{width_px}:{quality}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Returns the path of a downscaled JPEG for src_path (or src_path itself when
+# processing would not make it smaller).
+def prepare_image(src_path, out_dir, width_in=3.5, dpi=150, quality=80):
+    width_px = int(width_in * dpi)
+    key = variant_key(src_path, width_px, quality)
+    out_path = os.path.join(out_dir, key + ".jpg")
+    # Marker left when an earlier run found the source already small enough
+    keep_marker = os.path.join(out_dir, key + ".orig")
+    if os.path.exists(out_path):
+        # mtime doubles as last use for prune_variants
+        os.utime(out_path)
+        return out_path
+    if os.path.exists(keep_marker):
+        os.utime(keep_marker)
+        return src_path
+
+    with Image.open(src_path) as img:
+        img.load()
+        if img.width > width_px:
+            height_px = max(1, round(img.height * width_px / img.width))
+            img = img.resize((width_px, height_px), Image.LANCZOS)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        os.makedirs(out_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, "JPEG", quality=quality, optimize=True, progressive=True)
+            if os.path.getsize(tmp_path) >= os.path.getsize(src_path):
+                open(keep_marker, "wb").close()
+                return src_path
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return out_path
+
+
+# Removes the least recently used variants (files ending in `suffix`) and keep
+# markers until out_dir holds at most max_bytes, and temp files left behind by
+# crashed writes. Returns the number of bytes freed.
+def prune_variants(out_dir, max_bytes, suffix=".jpg"):
+    try:
+        entries = [e for e in os.scandir(out_dir) if e.is_file()]
+    except FileNotFoundError:
+        return 0
+    files = []
+    for e in entries:
+        info = e.stat()
+        if e.name.endswith(".part"):
+            if info.st_mtime < time.time() - STALE_PART_SECONDS:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+        elif e.name.endswith(suffix):
+            files.append((info.st_mtime, info.st_size, e.path))
+        elif e.name.endswith(".orig"):
+            files.append((info.st_mtime, max(info.st_size, MARKER_BYTES), e.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    freed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        freed += size
+    return freed
@@ -0,0 +1,209 @@
+"""Shared, content-addressed store for downloaded images.
+
+Blobs live at <root>/blobs/<sha[:2]>/<sha><ext> and are indexed in SQLite by
+keyword -> URL -> content hash, so a keyword or URL seen before (by any
+session or process) resolves to a file on disk without network traffic.
+Each keyword also keeps the full page of search results it was searched
+with (URLs, thumbnail URLs, size and photographer), so a different photo can
+be picked later without searching again.
+Downloads stream to a temp file while hashing and are published with an
+atomic rename, which makes concurrent writers of the same image safe. The
+store keeps itself under a byte budget by evicting least-recently-used blobs.
+Only real uses (a keyword's image, a fetch) count as access, and those
+touches are written in batches at most every touch_interval seconds; looking
+up where a URL is stored (picker thumbnails, prefetch checks) never writes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def normalize_keyword(keyword) -> str:
+    return " ".join(keyword.lower().split())
+
+
+class ImageStore:
+    def __init__(self, root, max_bytes=500 * 1024 * 1024, touch_interval=60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}   # hash -> last access not yet written to blobs
+        self._touches_flushed = time.time()
+        self._tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(root, "index.sqlite3"), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS keywords (keyword TEXT PRIMARY KEY, url TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, path TEXT NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs(accessed)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS candidates (keyword TEXT NOT NULL, rank INTEGER NOT NULL,"
+            " data TEXT NOT NULL, searched REAL NOT NULL, PRIMARY KEY (keyword, rank))"
+        )
+
+    def _blob_path(self, digest, ext):
+        return os.path.join(self.root, "blobs", digest[:2], digest + ext)
+
+    # Caller holds the lock. {url: (hash, blob path)} for the urls whose blob is still on disk.
+    def _lookup_urls(self, urls):
+        urls = list(dict.fromkeys(urls))
+        found = {}
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            rows = self._conn.execute(
+                "SELECT u.url, b.hash, b.path FROM urls u JOIN blobs b ON b.hash = u.hash"
+                f" WHERE u.url IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((url, (digest, path)) for url, digest, path in rows if os.path.exists(path))
+        return found
+
+    # Caller holds the lock. Records a use of the blob; written with the next flush.
+    def _touch(self, digest):
+        now = time.time()
+        self._touched[digest] = now
+        if now - self._touches_flushed >= self.touch_interval:
+            self._flush_touches()
+
+    def _flush_touches(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE blobs SET accessed = MAX(accessed, ?) WHERE hash = ?",
+                [(accessed, digest) for digest, accessed in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touches_flushed = time.time()
+
+    # Caller holds the lock. Blob path for url if it is still on disk, counted as a use.
+    def _resolve_url(self, url):
+        entry = self._lookup_urls([url]).get(url)
+        if entry is None:
+            return None
+        self._touch(entry[0])
+        return entry[1]
+
+    def path_for_keyword(self, keyword):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url FROM keywords WHERE keyword = ?", (normalize_keyword(keyword),)
+            ).fetchone()
+            path = self._resolve_url(row[0]) if row else None
+            if path:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return path
+
+    def remember_keyword(self, keyword, url):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO keywords (keyword, url) VALUES (?, ?)", (normalize_keyword(keyword), url)
+            )
+
+    # Stored file for url if it has been downloaded before, without downloading
+    # it. A lookup only: it does not count as a use of the blob.
+    def path_for_url(self, url):
+        return self.paths_for_urls([url]).get(url)
+
+    # {url: stored file} for those of urls downloaded before, in one query
+    def paths_for_urls(self, urls):
+        with self._lock:
+            return {url: path for url, (_, path) in self._lookup_urls(urls).items()}
+
+    # Replaces the keyword's candidate photos (dicts, best match first)
+    def remember_candidates(self, keyword, candidates):
+        keyword, now = normalize_keyword(keyword), time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM candidates WHERE keyword = ?", (keyword,))
+            self._conn.executemany(
+                "INSERT INTO candidates (keyword, rank, data, searched) VALUES (?, ?, ?, ?)",
+                [(keyword, rank, json.dumps(c), now) for rank, c in enumerate(candidates)],
+            )
+            self._conn.execute("COMMIT")
+
+    def candidates_for(self, keyword):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM candidates WHERE keyword = ? ORDER BY rank", (normalize_keyword(keyword),)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # Returns a local path for url, downloading it through `session` only if no
+    # stored blob is known for that URL.
+    def fetch(self, url, session, keyword=None, timeout=15):
+        if keyword:
+            self.remember_keyword(keyword, url)
+        with self._lock:
+            path = self._resolve_url(url)
+            if path:
+                self.hits += 1
+                return path
+            self.misses += 1
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f, session.get(url, timeout=timeout, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    digest.update(chunk)
+                    f.write(chunk)
+            ext = os.path.splitext(urlparse(url).path)[1].lower()
+            path = self._blob_path(digest.hexdigest(), ext if ext in IMAGE_EXTENSIONS else ".jpg")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Identical content from a concurrent writer is fine to overwrite atomically
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (hash, path, size, accessed) VALUES (?, ?, ?, ?)",
+                (digest.hexdigest(), path, os.path.getsize(path), time.time()),
+            )
+            self._conn.execute("INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)", (url, digest.hexdigest()))
+            self._evict()
+        return path
+
+    def _evict(self):
+        self._flush_touches()
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for digest, path, size in self._conn.execute("SELECT hash, path, size FROM blobs ORDER BY accessed ASC"):
+            if total <= self.max_bytes:
+                break
+            victims.append((digest, path))
+            total -= size
+        for digest, path in victims:
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            self._conn.execute("DELETE FROM urls WHERE hash = ?", (digest,))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            keywords = self._conn.execute("SELECT COUNT(DISTINCT keyword) FROM candidates").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total, "indexed_keywords": keywords}
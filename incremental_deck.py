@@ -0,0 +1,352 @@
+"""Incremental PPTX rebuilds: re-export a deck by patching only changed slides.
+
+IncrementalDeck keeps the last package it produced plus a fingerprint per slide.
+When the slide count is unchanged, a rebuild renders only the changed slides
+and splices their slide XML, notes XML and pictures into the previous zip.
+With the fast engine they come from ooxml_writer's fragments, exactly as a
+full build writes them; with the python-pptx engine they are rendered through
+add_deck_slide into a scratch presentation and transplanted. Every other
+part is copied across still compressed, without being read. Which pictures
+the deck holds (by hash) and which parts point at them is indexed once per
+package and kept up to date by each patch, so a patch costs the changed
+slides plus one pass over the zip directory rather than a pass over the whole
+deck. Anything structural (slide added/removed, first build) falls back to a
+full build.
+"""
+import io
+import os
+import re
+import json
+import struct
+import hashlib
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+from ppt_core import (
+    log, deck_slide_specs, add_deck_slide, assemble_deck, image_stats, span, get_metrics, PPTX_ENGINE,
+)
+
+RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_TYPE_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+PRES_NS = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": REL_TYPE_NS.rstrip("/"),
+}
+ET.register_namespace("", RELS_NS)
+
+
+def slide_fingerprint(kind, payload, attach_images):
+    if kind == "content":
+        img = payload.get("image_local_path") if attach_images else None
+        img_sig = [img, os.path.getsize(img), os.path.getmtime(img)] if img and os.path.exists(img) else None
+        data = [kind, payload.get("slide_title", "")[:80], payload.get("bullets", []), payload.get("notes", ""), img_sig]
+    else:
+        data = [kind, payload]
+    return hashlib.sha1(json.dumps(data, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _rels_name(partname):
+    folder, name = posixpath.split(partname)
+    return posixpath.join(folder, "_rels", name + ".rels")
+
+
+def _resolve(source_part, target):
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def _relative(source_part, dest_part):
+    return posixpath.relpath(dest_part, posixpath.dirname(source_part))
+
+
+def _relationships(zf, partname):
+    name = _rels_name(partname)
+    if name not in zf.namelist():
+        return None
+    return ET.fromstring(zf.read(name))
+
+
+def _related(zf, partname, rel_type):
+    rels = _relationships(zf, partname)
+    for rel in rels if rels is not None else []:
+        if rel.get("Type") == REL_TYPE_NS + rel_type:
+            return _resolve(partname, rel.get("Target"))
+    return None
+
+
+# Slide part names in presentation order
+def _slide_parts(zf):
+    pres = ET.fromstring(zf.read("ppt/presentation.xml"))
+    rels = {rel.get("Id"): rel.get("Target") for rel in ET.fromstring(zf.read("ppt/_rels/presentation.xml.rels"))}
+    r_id = "{%s}id" % PRES_NS["r"]
+    return [_resolve("ppt/presentation.xml", rels[s.get(r_id)]) for s in pres.iterfind("p:sldIdLst/p:sldId", PRES_NS)]
+
+
+# N of a part named <prefix>N.xml
+def _part_number(partname, prefix):
+    m = re.fullmatch(re.escape(prefix) + r"(\d+)\.xml", partname)
+    if m is None:
+        raise ValueError(f"unexpected part name {partname}")
+    return int(m.group(1))
+
+
+def _serialize(rels):
+    return b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n" + ET.tostring(rels)
+
+
+# Pictures (ppt/media parts) a .rels part points at
+def _media_targets(rels_name, rels):
+    owner = posixpath.join(posixpath.dirname(posixpath.dirname(rels_name)), posixpath.basename(rels_name)[:-5])
+    targets = {
+        _resolve(owner, rel.get("Target")) for rel in rels if rel.get("TargetMode") != "External"
+    }
+    return sorted(t for t in targets if t.startswith("ppt/media/"))
+
+
+# Copies member `info` of src into the writer dst as stored, without
+# decompressing and compressing it again. zipfile has no API for this, so the
+# entry is appended the way ZipFile.writestr does it.
+def _copy_raw(src, dst, info):
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    src.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_len + extra_len)
+    data = src.fp.read(info.compress_size)
+
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.CRC, zinfo.compress_size, zinfo.file_size = info.CRC, info.compress_size, info.file_size
+    # Sizes go in the local header, so no data descriptor follows the data
+    zinfo.flag_bits = info.flag_bits & ~0x08
+    dst.fp.seek(dst.start_dir)
+    zinfo.header_offset = dst.fp.tell()
+    dst.fp.write(zinfo.FileHeader())
+    dst.fp.write(data)
+    dst.start_dir = dst.fp.tell()
+    dst.filelist.append(zinfo)
+    dst.NameToInfo[zinfo.filename] = zinfo
+
+
+class IncrementalDeck:
+    # With `artifacts` (a session_artifacts.SessionArtifacts) the last package is
+    # kept there, under the session's memory budget, instead of on this object.
+    # If it gets evicted the next build is simply a full one. `engine` is the
+    # PPTX engine for full builds and patches (default ppt_core.PPTX_ENGINE).
+    def __init__(self, artifacts=None, engine=None):
+        self.artifacts = artifacts
+        self.engine = engine
+        self._package = None
+        self.fingerprints = None
+        self.images = None
+        # {"by_hash": {sha1: media part}, "refs": {rels part: [media parts]}} for
+        # the current package; None until the first patch needs it
+        self.media_index = None
+
+    @property
+    def package(self):
+        return self.artifacts.get("deck.pptx") if self.artifacts is not None else self._package
+
+    @package.setter
+    def package(self, data):
+        if self.artifacts is not None:
+            self.artifacts.put("deck.pptx", data)
+        else:
+            self._package = data
+
+    # Rebuilds a builder from an earlier build's package and its recorded
+    # fingerprints/images/media_index (e.g. a deck produced by another worker
+    # process).
+    @classmethod
+    def from_state(cls, package, fingerprints, images, media_index=None):
+        deck = cls()
+        deck.package = package
+        deck.fingerprints = list(fingerprints)
+        deck.images = [tuple(im) if im else None for im in images]
+        deck.media_index = media_index
+        return deck
+
+    # Same contract as ppt_core.create_pptx_bytes; stats additionally gets
+    # build_mode ("full", "patch" or "reuse") and patched_slides.
+    def build(self, ppt_title, slide_contents, attach_images=False, stats=None):
+        with span("pptx_build") as fields:
+            package = self._build(ppt_title, slide_contents, attach_images, stats, fields)
+        get_metrics().count("deck_bytes_total", len(package))
+        return io.BytesIO(package)
+
+    def _build(self, ppt_title, slide_contents, attach_images, stats, fields):
+        specs = deck_slide_specs(ppt_title, slide_contents)
+        fingerprints = [slide_fingerprint(kind, payload, attach_images) for kind, payload in specs]
+        mode, changed = "full", list(range(len(specs)))
+        package = self.package
+        if package is not None and self.fingerprints is not None and len(fingerprints) == len(self.fingerprints):
+            changed = [i for i, (new, old) in enumerate(zip(fingerprints, self.fingerprints)) if new != old]
+            mode = "patch" if changed else "reuse"
+
+        if mode == "patch":
+            try:
+                package = self._patch(package, specs, changed, attach_images)
+            except Exception as e:
+                log.warning("Incremental PPTX rebuild failed, doing a full build: %s", e)
+                mode, changed = "full", list(range(len(specs)))
+        if mode == "full":
+            package = self._full_build(specs, attach_images)
+        if mode != "reuse":
+            self.package = package
+        self.fingerprints = fingerprints
+        fields.update(mode=mode, slides=len(changed) if mode != "reuse" else 0)
+
+        if stats is not None:
+            image_stats(stats, len(package), self.images)
+            stats["build_mode"] = mode
+            stats["patched_slides"] = len(changed) if mode != "reuse" else 0
+        return package
+
+    def _full_build(self, specs, attach_images):
+        package, self.images = assemble_deck(specs, attach_images, self.engine)
+        self.media_index = None
+        return package
+
+    def _media_index(self, src):
+        if self.media_index is None:
+            by_hash, refs = {}, {}
+            for name in src.namelist():
+                if name.startswith("ppt/media/"):
+                    by_hash[hashlib.sha1(src.read(name)).hexdigest()] = name
+                elif name.endswith(".rels"):
+                    targets = _media_targets(name, ET.fromstring(src.read(name)))
+                    if targets:
+                        refs[name] = targets
+            self.media_index = {"by_hash": by_hash, "refs": refs}
+        return self.media_index
+
+    def _patch(self, package, specs, changed, attach_images):
+        src = zipfile.ZipFile(io.BytesIO(package))
+        # Updated copies; the index is only replaced once the patch succeeded
+        index = self._media_index(src)
+        media_by_hash, refs = dict(index["by_hash"]), dict(index["refs"])
+        render = self._render_fast if (self.engine or PPTX_ENGINE) == "fast" else self._render_pptx
+        replaced, added_media, media_types, images = render(src, specs, changed, attach_images, media_by_hash)
+
+        # Content types: make sure every new media extension has a Default entry
+        content_types = src.read("[Content_Types].xml").decode("utf-8")
+        for media_name in added_media:
+            ext = posixpath.splitext(media_name)[1].lstrip(".")
+            if f'Extension="{ext}"' not in content_types and ext in media_types:
+                content_types = content_types.replace(
+                    "</Types>", f'<Default Extension="{ext}" ContentType="{media_types[ext]}"/></Types>'
+                )
+        replaced["[Content_Types].xml"] = content_types.encode("utf-8")
+
+        # Drop pictures no relationship points at any more
+        for name, data in replaced.items():
+            if name.endswith(".rels"):
+                targets = _media_targets(name, ET.fromstring(data))
+                if targets:
+                    refs[name] = targets
+                else:
+                    refs.pop(name, None)
+        referenced = {m for targets in refs.values() for m in targets}
+
+        out = io.BytesIO()
+        with span("pptx_save", mode="patch"), zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+            for info in src.infolist():
+                name = info.filename
+                if name.startswith("ppt/media/") and name not in referenced:
+                    continue
+                if name in replaced:
+                    z.writestr(name, replaced[name])
+                else:
+                    _copy_raw(src, z, info)
+            # JPEG/PNG data is already compressed
+            for name, data in added_media.items():
+                if name in referenced:
+                    z.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+        for i, image in zip(changed, images):
+            self.images[i] = image
+        self.media_index = {
+            "by_hash": {h: name for h, name in media_by_hash.items() if name in referenced},
+            "refs": refs,
+        }
+        return out.getvalue()
+
+    # Both renderers return the changed slides' parts under their names in src,
+    # as (replaced parts, added media parts, {extension: content type}, images),
+    # and record new pictures in media_by_hash.
+
+    # Slide XML straight from ooxml_writer's fragments, as a full fast build writes it
+    def _render_fast(self, src, specs, changed, attach_images, media_by_hash):
+        from ooxml_writer import DeckMedia, slide_parts, media_content_type
+
+        media = DeckMedia({h: posixpath.basename(name) for h, name in media_by_hash.items()})
+        target_slides = _slide_parts(src)
+        replaced, images = {}, []
+        for i in changed:
+            target_slide = target_slides[i]
+            target_notes = _related(src, target_slide, "notesSlide")
+            if (target_notes is None) == (specs[i][0] == "content"):
+                raise ValueError(f"notes mismatch on slide {i + 1}")
+            notes_number = _part_number(target_notes, "ppt/notesSlides/notesSlide") if target_notes else None
+            parts, image = slide_parts(
+                *specs[i], _part_number(target_slide, "ppt/slides/slide"), notes_number, media, attach_images,
+            )
+            replaced.update(parts)
+            images.append(image)
+        added_media, types = {}, {}
+        for name, blob in media.parts:
+            added_media["ppt/media/" + name] = blob
+            media_by_hash[hashlib.sha1(blob).hexdigest()] = "ppt/media/" + name
+            ext = posixpath.splitext(name)[1][1:]
+            types[ext] = media_content_type(ext)
+        return replaced, added_media, types, images
+
+    # Changed slides rendered into a python-pptx scratch presentation, then
+    # transplanted with their relationships retargeted
+    def _render_pptx(self, src, specs, changed, attach_images, media_by_hash):
+        from pptx import Presentation
+
+        scratch = Presentation()
+        images = [add_deck_slide(scratch, *specs[i], attach_images) for i in changed]
+        buf = io.BytesIO()
+        with span("pptx_save"):
+            scratch.save(buf)
+
+        new = zipfile.ZipFile(buf)
+        target_slides = _slide_parts(src)
+        replaced, added_media = {}, {}
+        for i, scratch_slide in zip(changed, _slide_parts(new)):
+            target_slide = target_slides[i]
+            scratch_notes = _related(new, scratch_slide, "notesSlide")
+            target_notes = _related(src, target_slide, "notesSlide")
+            if (scratch_notes is None) != (target_notes is None):
+                raise ValueError(f"notes mismatch on slide {i + 1}")
+
+            rels = _relationships(new, scratch_slide)
+            for rel in rels:
+                rel_type = rel.get("Type")[len(REL_TYPE_NS):]
+                if rel_type == "notesSlide":
+                    rel.set("Target", _relative(target_slide, target_notes))
+                elif rel_type == "image":
+                    media = _resolve(scratch_slide, rel.get("Target"))
+                    data = new.read(media)
+                    digest = hashlib.sha1(data).hexdigest()
+                    # Reuse a picture the deck already carries instead of adding a copy
+                    media_name = media_by_hash.get(digest)
+                    if media_name is None:
+                        media_name = "ppt/media/patch_%s%s" % (digest[:16], posixpath.splitext(media)[1])
+                        added_media[media_name] = data
+                        media_by_hash[digest] = media_name
+                    rel.set("Target", _relative(target_slide, media_name))
+            replaced[target_slide] = new.read(scratch_slide)
+            replaced[_rels_name(target_slide)] = _serialize(rels)
+
+            if scratch_notes:
+                notes_rels = _relationships(new, scratch_notes)
+                for rel in notes_rels:
+                    if rel.get("Type") == REL_TYPE_NS + "slide":
+                        rel.set("Target", _relative(target_notes, target_slide))
+                replaced[target_notes] = new.read(scratch_notes)
+                replaced[_rels_name(target_notes)] = _serialize(notes_rels)
+        types = {d.get("Extension"): d.get("ContentType") for d in ET.fromstring(new.read("[Content_Types].xml"))
+                 if d.get("Extension")}
+        return replaced, added_media, types, images
@@ -0,0 +1,191 @@
+"""Persistent job queue (SQLite backed) shared by the UI and worker processes.
+
+The UI submits jobs and polls them; ppt_worker.py processes claim queued jobs
+one at a time with an atomic UPDATE, report progress (and an optional live
+preview) while they run, and store a JSON result plus any files under
+<root>/artifacts. Because state lives in the database, a job outlives the
+Streamlit rerun, tab or even server process that submitted it.
+
+Workers heartbeat both their own row and their running job. A job whose
+worker stopped heartbeating is put back in the queue (up to max_attempts).
+Every update a worker makes to a job names the worker, so one that lost its
+job to stale reclaim can no longer report progress on it or finish it.
+
+No credentials are stored: workers call Gemini and Pexels with the keys in
+their own environment. The directory and database are still private to the
+owning account (0700 / 0600), since payloads hold the users' slide text.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    def __init__(self, root, stale_seconds=120, max_attempts=3, retention_seconds=24 * 3600):
+        self.root = root
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "artifacts"), mode=0o700, exist_ok=True)
+        os.chmod(root, 0o700)
+        path = os.path.join(root, "jobs.sqlite3")
+        # SQLite gives the -wal and -shm files the database file's mode
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        for name in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(name):
+                os.chmod(name, 0o600)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, result TEXT, error TEXT, preview TEXT,"
+            " done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0, worker TEXT,"
+            " created REAL NOT NULL, started REAL, finished REAL, heartbeat REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, pid INTEGER, heartbeat REAL)")
+
+    def artifact_dir(self, job_id):
+        return os.path.join(self.root, "artifacts", job_id)
+
+    def submit(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), time.time()),
+            )
+            self._sweep(time.time())
+        return job_id
+
+    # Atomically takes the oldest queued job (optionally of the given kinds).
+    # Returns (id, kind, payload) or None.
+    def claim(self, worker, kinds=None):
+        now = time.time()
+        with self._lock:
+            self._requeue_stale(now)
+            kind_filter, params = "", [worker, now, now]
+            if kinds:
+                kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})"
+                params += list(kinds)
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ?, attempts = attempts + 1"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued'" + kind_filter +
+                " ORDER BY created LIMIT 1) RETURNING id, kind, payload",
+                params,
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def _requeue_stale(self, now):
+        cutoff = now - self.stale_seconds
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', finished = ?, error = 'worker stopped responding'"
+            " WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+            (now, cutoff, self.max_attempts),
+        )
+        self._conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?", (cutoff,)
+        )
+
+    # Records progress and heartbeats the job. Returns False once `worker` no
+    # longer runs it (cancelled, or requeued and maybe claimed by another
+    # worker), so the worker can stop.
+    def progress(self, job_id, worker, done=None, total=None, preview=None):
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET heartbeat = ?, done = COALESCE(?, done), total = COALESCE(?, total),"
+                " preview = COALESCE(?, preview) WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), done, total, json.dumps(preview) if preview is not None else None, job_id, worker),
+            )
+        return cur.rowcount > 0
+
+    # complete/fail return False when `worker` had lost the job, which is then left as it is
+    def complete(self, job_id, worker, result):
+        return self._finish(job_id, DONE, worker, result=json.dumps(result))
+
+    def fail(self, job_id, worker, error):
+        return self._finish(job_id, FAILED, worker, error=str(error))
+
+    def cancel(self, job_id):
+        return self._finish(job_id, CANCELLED)
+
+    def _finish(self, job_id, status, worker=None, result=None, error=None):
+        owner_filter, params = "status IN ('queued', 'running')", [job_id]
+        if worker is not None:
+            owner_filter, params = "status = 'running' AND worker = ?", [job_id, worker]
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, preview = NULL, finished = ?"
+                " WHERE id = ? AND " + owner_filter,
+                [status, result, error, time.time()] + params,
+            )
+        return cur.rowcount > 0
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, payload, result, error, preview, done, total, created, started, finished,"
+                " (SELECT COUNT(*) FROM jobs AS q WHERE q.status = 'queued' AND q.created < jobs.created)"
+                " FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "status", "payload", "result", "error", "preview",
+                        "done", "total", "created", "started", "finished", "position"), row))
+        for field in ("payload", "result", "preview"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    # Heartbeats the worker and, if given, its running job. Returns False when
+    # the worker no longer runs job_id.
+    def heartbeat_worker(self, name, job_id=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (name, pid, heartbeat) VALUES (?, ?, ?)", (name, os.getpid(), now)
+            )
+            if job_id:
+                cur = self._conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                    (now, job_id, name),
+                )
+                return cur.rowcount > 0
+        return True
+
+    def remove_worker(self, name):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE name = ?", (name,))
+
+    def live_workers(self, max_age=30):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat > ?", (time.time() - max_age,)
+            ).fetchone()[0]
+
+    # Drops finished jobs (and their artifacts) past the retention period
+    def _sweep(self, now):
+        old = [r[0] for r in self._conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+            (now - self.retention_seconds,),
+        )]
+        for job_id in old:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            shutil.rmtree(self.artifact_dir(job_id), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        counts["workers"] = self.live_workers()
+        return counts
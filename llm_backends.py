@@ -0,0 +1,150 @@
+"""LLM backends behind one interface: generate, batch-generate and stream.
+
+ppt_core talks to an LLMBackend instead of a provider SDK, so the model can be
+swapped per purpose (e.g. titles on a cheaper backend) and the cache,
+rate-control and metrics code stays provider-agnostic.
+
+- GeminiBackend wraps google.generativeai. One instance per API key keeps a
+  single GenerativeModel, so its client and connections are reused across
+  calls. The model gets its own API client built for that key; genai's
+  process-global configure() is never used, so backends for different keys
+  can run side by side.
+- TemplateBackend produces deterministic replies from the prompt alone (same
+  prompt, same reply) without network access, fast enough for load tests and
+  offline demos. It understands every prompt ppt_core sends.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LLMResponse:
+    def __init__(self, text, prompt_tokens=None, response_tokens=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.response_tokens = response_tokens
+
+
+class LLMBackend:
+    name = "base"
+    model_name = "base"
+    # Rate-control service and key for this backend's quota (None = unlimited)
+    rate_service = None
+    api_key = None
+
+    def generate(self, parts, generation_config=None):
+        raise NotImplementedError
+
+    # Yields text chunks as the model produces them
+    def stream(self, parts, generation_config=None):
+        yield self.generate(parts, generation_config).text
+
+    # One LLMResponse (or the exception it raised) per prompt, in order.
+    # `call` wraps every single request (ppt_core passes its rate control).
+    def generate_batch(self, prompts, generation_config=None, max_workers=8, call=None):
+        call = call or (lambda fn, *args: fn(*args))
+
+        def one(parts):
+            try:
+                return call(self.generate, parts, generation_config)
+            except Exception as e:
+                return e
+
+        if len(prompts) <= 1:
+            return [one(p) for p in prompts]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as pool:
+            return list(pool.map(one, prompts))
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+    rate_service = "gemini"
+
+    # `model` replaces the genai model (anything with generate_content), e.g.
+    # a local stand-in for benchmarks; genai is then never touched
+    def __init__(self, api_key, model_name, model=None):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = model
+        self._lock = threading.Lock()
+
+    def _client(self):
+        if self._model is not None:
+            return self._model
+        import google.generativeai as genai
+        from google.ai import generativelanguage as glm
+        with self._lock:
+            if self._model is None:
+                model = genai.GenerativeModel(self.model_name)
+                # A model without a client binds genai's process-wide default (the
+                # last configure()'s key) on its first call; give it one for our key
+                model._client = glm.GenerativeServiceClient(client_options={"api_key": self.api_key})
+                self._model = model
+            return self._model
+
+    def generate(self, parts, generation_config=None):
+        resp = self._client().generate_content(parts, generation_config=generation_config)
+        usage = getattr(resp, "usage_metadata", None)
+        return LLMResponse(
+            resp.text or "",
+            getattr(usage, "prompt_token_count", None),
+            getattr(usage, "candidates_token_count", None),
+        )
+
+    def stream(self, parts, generation_config=None):
+        for chunk in self._client().generate_content(parts, generation_config=generation_config, stream=True):
+            yield chunk.text or ""
+
+
+class TemplateBackend(LLMBackend):
+    name = "template"
+    model_name = "template-v1"
+
+    def __init__(self, words=12, latency=0.0):
+        self.words = words
+        self.latency = latency
+
+    def _sentence(self, rng, topic):
+        vocab = ["growth", "data", "teams", "risk", "cost", "platform", "customers", "quality", "scale", "insight"]
+        return f"{topic}: " + " ".join(rng.choice(vocab) for _ in range(self.words))
+
+    # Reply text for a ppt_core prompt, seeded by the prompt's hash
+    def reply(self, prompt):
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        m = re.search(r"Generate (\d+) concise titles", prompt)
+        if m:
+            return "\n".join(f"{i}. {self._sentence(rng, 'Title')[:60]}" for i in range(1, int(m.group(1)) + 1))
+        m = re.search(r"Split it into (\d+) consecutive parts.*?add up to (\d+)", prompt, flags=re.S)
+        if m:
+            n_parts, count = int(m.group(1)), int(m.group(2))
+            sizes = [count // n_parts + (i < count % n_parts) for i in range(n_parts)]
+            return json.dumps({"parts": [{"title": f"Part {i + 1}", "slides": n} for i, n in enumerate(sizes)]})
+        m = re.search(r"Write exactly (\d+) slide titles for part (\d+)", prompt)
+        if m:
+            return json.dumps({"sections": [f"Part {m.group(2)} topic {i + 1}" for i in range(int(m.group(1)))]})
+        m = re.search(r"Slides \(index: title\):\n(.*?)\nFor every slide", prompt, flags=re.S)
+        if m:
+            titles = [line.split(": ", 1)[1] for line in m.group(1).splitlines()]
+            return json.dumps({"slides": [
+                {"index": i, "bullets": [self._sentence(rng, t) for _ in range(4)],
+                 "notes": self._sentence(rng, "Note"), "image_keyword": f"{t} photo"}
+                for i, t in enumerate(titles)
+            ]})
+        m = re.search(r"Slide title: (.+)", prompt)
+        title = m.group(1) if m else "Slide"
+        lines = [f"ImageKeyword: {title} photo"] + [f"- {self._sentence(rng, title)}" for _ in range(4)]
+        return "\n".join(lines + [self._sentence(rng, "Note")])
+
+    def generate(self, parts, generation_config=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return LLMResponse(self.reply("\n".join(parts)))
+
+    def stream(self, parts, generation_config=None):
+        for piece in re.split(r"(?<=\n)", self.generate(parts, generation_config).text):
+            if piece:
+                yield piece
@@ -0,0 +1,179 @@
+"""Timing spans and counters for the deck build path, exportable as Prometheus text.
+
+ppt_core wraps each stage (titles, outline, LLM calls, Pexels search, image
+download, PPTX build and save) in `span(stage)`. A span adds its duration to
+a per-stage latency histogram and keeps a window of recent durations for the
+sidebar's p50/p95. Counters hold LLM characters/tokens, downloaded and written
+bytes, and cache hits/misses.
+
+Export paths, all optional:
+
+- json_log: one JSON line per finished span, appended to a file
+- prom_file: Prometheus text format, rewritten at most every few seconds
+  (e.g. for node_exporter's textfile collector)
+- port: a local HTTP server answering GET /metrics
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RECENT = 200
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self.recent = deque(maxlen=RECENT)
+
+    def observe(self, seconds, error=False):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+        self.errors += error
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+class Metrics:
+    def __init__(self, json_log=None, prom_file=None, port=None, prom_interval=5.0):
+        self.json_log = json_log
+        self.prom_file = prom_file
+        self.prom_interval = prom_interval
+        self.histograms = {}
+        self.counters = {}
+        # name -> callable returning {label value: number}, read at export time
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._last_prom_write = 0.0
+        self.server = self._serve(port) if port else None
+
+    @contextmanager
+    def span(self, stage, **fields):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield fields
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, error, **fields)
+
+    def observe(self, stage, seconds, error=False, **fields):
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds, error)
+        if self.json_log:
+            record = {"ts": round(time.time(), 3), "stage": stage, "ms": round(seconds * 1000, 2), "error": error, **fields}
+            line = json.dumps(record, default=str) + "\n"
+            with self._lock, open(self.json_log, "a", encoding="utf-8") as f:
+                f.write(line)
+        self._maybe_write_prom()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    # Per-stage count, p50/p95 (recent window) and error count, slowest first
+    def summary(self):
+        with self._lock:
+            rows = [
+                {"stage": stage, "count": h.count, "errors": h.errors, "total_s": h.sum,
+                 "p50_ms": h.percentile(0.5) * 1000, "p95_ms": h.percentile(0.95) * 1000}
+                for stage, h in self.histograms.items()
+            ]
+        return sorted(rows, key=lambda r: -r["total_s"])
+
+    def prometheus_text(self):
+        lines = ["# TYPE ppt_stage_seconds histogram"]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS + ("+Inf",), h.counts):
+                    cumulative += n
+                    lines.append(f'ppt_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'ppt_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}')
+                lines.append(f'ppt_stage_seconds_count{{stage="{stage}"}} {h.count}')
+                lines.append(f'ppt_stage_errors_total{{stage="{stage}"}} {h.errors}')
+            counters = sorted(self.counters.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE ppt_{name} counter")
+                seen.add(name)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"ppt_{name}{{{label_text}}} {value}" if label_text else f"ppt_{name} {value}")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                values = read()
+            except Exception:
+                continue
+            lines.append(f"# TYPE ppt_{name} gauge")
+            for label, value in sorted(values.items()):
+                lines.append(f'ppt_{name}{{kind="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        path = path or self.prom_file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def _maybe_write_prom(self):
+        if not self.prom_file:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prom_write < self.prom_interval:
+                return
+            self._last_prom_write = now
+        try:
+            self.write_prometheus()
+        except OSError:
+            pass
+
+    def _serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError:
+            # Another process (e.g. a second worker) already serves this port
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+        return server
@@ -0,0 +1,252 @@
+"""Fast PPTX assembly: slide XML streamed into the zip from precompiled fragments.
+
+python-pptx builds every slide as an lxml tree with its own part objects and
+relationship graph, and serializes them all again on save. For a deck of
+hundreds of slides that is most of the export time. Our slides only ever come
+in three shapes (title, bullets + notes + picture, closing), so this module
+renders a tiny probe deck once per process through ppt_core.add_deck_slide and
+cuts it at sentinel strings into fragments: the slide XML before and after the
+title and bullets, the picture element, the notes slide, the relationship
+files and every static part of the package. Writing a deck is then string
+concatenation of escaped text into those fragments, each part written
+straight into the output zip.
+
+Because the fragments come from python-pptx's own output, the result has the
+same parts, layouts, placeholders, picture geometry and media deduplication
+as the python-pptx path, and layout changes in add_deck_slide carry over.
+"""
+import io
+import os
+import re
+import zipfile
+import posixpath
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from ppt_core import (
+    log, span, add_deck_slide, placed_image_path,
+    IMAGE_LEFT_IN, IMAGE_TOP_IN, IMAGE_WIDTH_IN,
+)
+
+REL_TYPE_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+SLIDE_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+NOTES_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.notesSlide+xml"
+EMU_PER_INCH = 914400
+# Sentinels placed in the probe deck; the fragments are cut around them
+TITLE, SLIDE_TITLE, BULLET, NOTES = "PROBExDECKxTITLE", "PROBExSLIDExTITLE", "PROBExBULLET", "PROBExNOTES"
+# Parts written per deck rather than copied from the probe
+GENERATED = ("ppt/slides/", "ppt/notesSlides/", "ppt/media/", "[Content_Types].xml",
+             "ppt/presentation.xml", "ppt/_rels/presentation.xml.rels")
+
+
+# python-pptx's escaping of run text: control characters other than tab and
+# line feed become "_xHHHH_"
+def _run_text(text):
+    text = re.sub(r"[\x00-\x08\x0B-\x1F]", lambda m: "_x%04X_" % ord(m.group(0)), text)
+    return escape(text)
+
+
+# One <a:p> as written by python-pptx's _Paragraph.text: "\n" and "\v" become
+# line breaks, empty runs are left out
+def paragraph_xml(text):
+    runs = ["<a:r><a:t>%s</a:t></a:r>" % _run_text(r) if r else "" for r in re.split("\n|\v", text)]
+    inner = "<a:br/>".join(runs)
+    return "<a:p>%s</a:p>" % inner if inner else "<a:p/>"
+
+
+# Paragraphs as written by python-pptx's TextFrame.text: one per "\n"-separated line
+def frame_xml(text):
+    return "".join(paragraph_xml(line) for line in text.split("\n"))
+
+
+def _cut(xml, sentinel):
+    head, sep, tail = xml.partition("<a:p><a:r><a:t>%s</a:t></a:r></a:p>" % sentinel)
+    if not sep:
+        raise ValueError(f"sentinel {sentinel} not found in probe deck")
+    return head, tail
+
+
+def _replace_once(text, old, new):
+    if text.count(old) != 1:
+        raise ValueError(f"expected exactly one {old!r} in probe deck")
+    return text.replace(old, new)
+
+
+class DeckTemplate:
+    def __init__(self):
+        from pptx import Presentation
+        from pptx.util import Inches
+        from PIL import Image
+
+        prs = Presentation()
+        add_deck_slide(prs, "title", TITLE)
+        add_deck_slide(prs, "content", {"slide_title": SLIDE_TITLE, "bullets": [BULLET], "notes": NOTES})
+        add_deck_slide(prs, "closing", None)
+        probe_img = io.BytesIO()
+        Image.new("RGB", (40, 30)).save(probe_img, format="PNG")
+        pic = prs.slides[1].shapes.add_picture(
+            probe_img, Inches(IMAGE_LEFT_IN), Inches(IMAGE_TOP_IN), width=Inches(IMAGE_WIDTH_IN))
+        bio = io.BytesIO()
+        prs.save(bio)
+        zf = zipfile.ZipFile(bio)
+        read = lambda name: zf.read(name).decode("utf-8")
+
+        self.title_head, self.title_tail = _cut(read("ppt/slides/slide1.xml"), TITLE)
+        self.content_head, rest = _cut(read("ppt/slides/slide2.xml"), SLIDE_TITLE)
+        self.content_mid, rest = _cut(rest, BULLET)
+        start, end = rest.index("<p:pic>"), rest.index("</p:pic>") + len("</p:pic>")
+        self.content_tail, self.content_end = rest[:start], rest[end:]
+        # \x00 = picture description (file name), \x01 = height in EMU
+        picture = _replace_once(rest[start:end], 'descr="%s"' % pic._element.nvPicPr.cNvPr.get("descr"), 'descr="\x00"')
+        self.picture = _replace_once(picture, 'cy="%d"' % pic.height, 'cy="\x01"')
+        self.picture_width = pic.width
+        self.notes_head, self.notes_tail = _cut(read("ppt/notesSlides/notesSlide1.xml"), NOTES)
+        self.closing = zf.read("ppt/slides/slide3.xml")
+
+        self.title_rels = zf.read("ppt/slides/_rels/slide1.xml.rels")
+        self.closing_rels = zf.read("ppt/slides/_rels/slide3.xml.rels")
+        # \x00 = notes slide number, \x01 = media file name
+        content_rels = _replace_once(read("ppt/slides/_rels/slide2.xml.rels"), "notesSlide1.xml", "notesSlide\x00.xml")
+        self.content_rels_picture = _replace_once(content_rels, "media/image1.png", "media/\x01")
+        self.content_rels = re.sub(r'<Relationship Id="rId3"[^>]*/>', "", self.content_rels_picture)
+        if "\x01" in self.content_rels or 'r:embed="rId3"' not in self.picture:
+            raise ValueError("unexpected picture relationship in probe deck")
+        self.notes_rels = _replace_once(read("ppt/notesSlides/_rels/notesSlide1.xml.rels"), "slides/slide2.xml", "slides/slide\x00.xml")
+
+        presentation = read("ppt/presentation.xml")
+        self.presentation = re.sub(r"<p:sldIdLst>.*?</p:sldIdLst>", "\x00", presentation, count=1, flags=re.S)
+        rels = read("ppt/_rels/presentation.xml.rels")
+        slide_rel = r'<Relationship Id="rId\d+" Type="%sslide" Target="[^"]*"/>' % re.escape(REL_TYPE_NS)
+        self.presentation_rels = re.sub(slide_rel, "", rels).replace("</Relationships>", "\x00</Relationships>")
+        self.first_slide_rid = 1 + max(int(n) for n in re.findall(r'Id="rId(\d+)"', self.presentation_rels))
+        types = read("[Content_Types].xml")
+        types = re.sub(r'<Override PartName="/ppt/(slides|notesSlides)/[^"]*" ContentType="[^"]*"/>', "", types)
+        # The probe picture's Default; a deck only gets the ones its media needs
+        types = types.replace('<Default Extension="png" ContentType="image/png"/>', "")
+        self.content_types = types.replace("</Types>", "\x00</Types>")
+        self.default_extensions = set(re.findall(r'<Default Extension="([^"]+)"', types))
+        self.static_parts = [(name, zf.read(name)) for name in zf.namelist() if not name.startswith(GENERATED)]
+
+
+@lru_cache(maxsize=None)
+def deck_template():
+    return DeckTemplate()
+
+
+class DeckMedia:
+    # `existing` (sha1 -> file name in ppt/media) lists the pictures of a
+    # package being patched: those are reused, and new ones get names that
+    # cannot clash with the package's.
+    def __init__(self, existing=None):
+        self.existing = existing
+        self.by_path = {}    # placed image path -> entry
+        self.by_sha1 = {}    # identical bytes are stored once, like python-pptx does
+        self.parts = []      # (zip name, blob) of pictures to write
+
+    # (file name in ppt/media, description, height in EMU) for a placed image
+    def add(self, path, width):
+        if path in self.by_path:
+            return self.by_path[path]
+        from pptx.parts.image import Image
+
+        image = Image.from_file(path)
+        entry = self.by_sha1.get(image.sha1)
+        if entry is None:
+            if self.existing is None:
+                name = "image%d.%s" % (len(self.parts) + 1, image.ext)
+            else:
+                name = self.existing.get(image.sha1) or "patch_%s.%s" % (image.sha1[:16], image.ext)
+            if name not in (self.existing or {}).values():
+                self.parts.append((name, image.blob))
+            px_width, px_height = image.size
+            dpi_x, dpi_y = image.dpi
+            native_cx = int(EMU_PER_INCH * px_width / dpi_x)
+            native_cy = int(EMU_PER_INCH * px_height / dpi_y)
+            height = int(round(native_cy * (float(width) / float(native_cx))))
+            entry = (name, escape(image.filename, {'"': "&quot;"}), height)
+            self.by_sha1[image.sha1] = entry
+        self.by_path[path] = entry
+        return entry
+
+
+def media_content_type(ext):
+    return "image/jpeg" if ext == "jpg" else "image/" + ext
+
+
+# The parts of deck slide number `slide_number` (kind/payload as in
+# ppt_core.deck_slide_specs) as [(zip name, bytes)], and its picture as
+# add_deck_slide reports it. A content slide's notes are notesSlide<notes_number>
+# and its picture is added to `media`.
+def slide_parts(kind, payload, slide_number, notes_number, media, attach_images=False):
+    t = deck_template()
+    slide_name = f"ppt/slides/slide{slide_number}.xml"
+    rels_name = f"ppt/slides/_rels/slide{slide_number}.xml.rels"
+    if kind == "title":
+        xml = (t.title_head + frame_xml(payload) + t.title_tail).encode("utf-8")
+        return [(slide_name, xml), (rels_name, t.title_rels)], None
+    if kind == "closing":
+        return [(slide_name, t.closing), (rels_name, t.closing_rels)], None
+
+    s = payload
+    body = "".join(paragraph_xml(b) for b in s.get("bullets", [])) or "<a:p/>"
+    parts = [t.content_head, frame_xml(s.get("slide_title", "")[:80]), t.content_mid, body, t.content_tail]
+    rels = t.content_rels.replace("\x00", str(notes_number))
+    image = None
+    img_path = s.get("image_local_path")
+    if attach_images and img_path and os.path.exists(img_path):
+        try:
+            placed_path = placed_image_path(img_path)
+            name, descr, height = media.add(placed_path, t.picture_width)
+            parts.append(t.picture.replace("\x00", descr).replace("\x01", str(height)))
+            rels = t.content_rels_picture.replace("\x00", str(notes_number)).replace("\x01", name)
+            image = (img_path, placed_path)
+        except Exception as e:
+            log.warning("Could not add image: %s", e)
+    parts.append(t.content_end)
+    notes = (t.notes_head + frame_xml(s.get("notes", "")) + t.notes_tail).encode("utf-8")
+    return [
+        (slide_name, "".join(parts).encode("utf-8")),
+        (rels_name, rels.encode("utf-8")),
+        (f"ppt/notesSlides/notesSlide{notes_number}.xml", notes),
+        (f"ppt/notesSlides/_rels/notesSlide{notes_number}.xml.rels",
+         t.notes_rels.replace("\x00", str(slide_number)).encode("utf-8")),
+    ], image
+
+
+# Writes the deck for `specs` (ppt_core.deck_slide_specs) and returns
+# (package bytes, images) with images as add_deck_slide reports them.
+def write_deck(specs, attach_images=False):
+    t = deck_template()
+    media = DeckMedia()
+    parts, images, notes_count = [], [], 0
+    for n, (kind, payload) in enumerate(specs, start=1):
+        if kind == "content":
+            notes_count += 1
+        slide, image = slide_parts(kind, payload, n, notes_count, media, attach_images)
+        parts += slide
+        images.append(image)
+
+    first = t.first_slide_rid
+    sld_ids = "".join('<p:sldId id="%d" r:id="rId%d"/>' % (256 + i, first + i) for i in range(len(specs)))
+    pres_rels = "".join(
+        '<Relationship Id="rId%d" Type="%sslide" Target="slides/slide%d.xml"/>' % (first + i, REL_TYPE_NS, i + 1)
+        for i in range(len(specs))
+    )
+    extensions = sorted({posixpath.splitext(name)[1][1:] for name, _ in media.parts} - t.default_extensions)
+    types = "".join('<Default Extension="%s" ContentType="%s"/>' % (ext, media_content_type(ext)) for ext in extensions)
+    types += "".join('<Override PartName="/ppt/slides/slide%d.xml" ContentType="%s"/>' % (i + 1, SLIDE_TYPE) for i in range(len(specs)))
+    types += "".join('<Override PartName="/ppt/notesSlides/notesSlide%d.xml" ContentType="%s"/>' % (i + 1, NOTES_TYPE) for i in range(notes_count))
+
+    out = io.BytesIO()
+    with span("pptx_save", engine="fast"), zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", t.content_types.replace("\x00", types))
+        for name, data in t.static_parts:
+            z.writestr(name, data)
+        z.writestr("ppt/presentation.xml", t.presentation.replace("\x00", "<p:sldIdLst>%s</p:sldIdLst>" % sld_ids))
+        z.writestr("ppt/_rels/presentation.xml.rels", t.presentation_rels.replace("\x00", pres_rels))
+        for name, data in parts:
+            z.writestr(name, data)
+        # JPEG/PNG data is already compressed; deflating it again only costs time
+        for name, blob in media.parts:
+            z.writestr("ppt/media/" + name, blob, compress_type=zipfile.ZIP_STORED)
+    return out.getvalue(), images
@@ -0,0 +1,121 @@
+"""Bulk deck generation from a JSONL file of deck specs, without a browser.
+
+Each non-empty line is a JSON object:
+
+    {"topic": "AI in Healthcare", "audience": "Executive", "slides_count": 8,
+     "title": "optional fixed title", "sections": ["optional", "outline"],
+     "output": "optional/file/name.pptx"}
+
+Only "topic" is required ("title" alone is accepted and used as the topic).
+Decks are built in parallel on a process pool and written as .pptx files;
+per-deck timings are printed and optionally written to a JSONL report.
+
+    python ppt_batch.py decks.jsonl -o out/ -j 4
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ppt_core
+
+log = logging.getLogger("ppt_batch")
+
+
+def load_specs(path):
+    specs = []
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            if not (spec.get("topic") or spec.get("title")):
+                raise ValueError(f"{path}:{lineno}: deck spec needs a 'topic'")
+            specs.append(spec)
+    return specs
+
+
+def _init_worker(api_key, log_level):
+    logging.basicConfig(level=log_level, format="%(processName)s %(levelname)s %(name)s: %(message)s")
+    ppt_core.configure(api_key)
+
+
+def build_one(index, spec, out_dir, pexels_key, refresh, slide_workers):
+    started = time.perf_counter()
+    topic = spec.get("topic") or spec["title"]
+    try:
+        bio, info = ppt_core.build_deck(
+            topic,
+            audience=spec.get("audience", ppt_core.AUDIENCE_PRESETS[0]),
+            slides_count=int(spec.get("slides_count", ppt_core.DEFAULT_SLIDES)),
+            title=spec.get("title"),
+            sections=spec.get("sections"),
+            pexels_key=pexels_key,
+            refresh=refresh,
+            max_workers=slide_workers,
+        )
+        name = spec.get("output") or f"{index:04d}_{ppt_core.safe_filename(info['title']) or 'deck'}.pptx"
+        path = os.path.join(out_dir, name)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(bio.getbuffer())
+        return {"index": index, "ok": True, "path": path, "wall_s": round(time.perf_counter() - started, 3), **info}
+    except Exception as e:
+        return {"index": index, "ok": False, "topic": topic, "error": str(e),
+                "wall_s": round(time.perf_counter() - started, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build PPTX decks in bulk from a JSONL file of deck specs.")
+    parser.add_argument("specs", help="JSONL file, one deck spec per line")
+    parser.add_argument("-o", "--out-dir", default="decks", help="where .pptx files are written (default: decks)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 2, help="decks built in parallel")
+    parser.add_argument("--slide-workers", type=int, default=ppt_core.MAX_PARALLEL_SLIDES,
+                        help="parallel slide requests inside each deck")
+    parser.add_argument("--no-images", action="store_true", help="skip Pexels even if PEXELS_API_KEY is set")
+    parser.add_argument("--refresh", action="store_true", help="bypass the response cache")
+    parser.add_argument("--report", help="write one JSON result per deck to this file")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=log_level, format="%(levelname)s %(name)s: %(message)s")
+    api_key = os.getenv("G_API_KEY")
+    if not api_key and "gemini" in (ppt_core.LLM_BACKEND, ppt_core.LLM_TITLE_BACKEND):
+        parser.error("G_API_KEY is not set (environment or .env); set LLM_BACKEND=template to run offline")
+    pexels_key = None if args.no_images else os.getenv("PEXELS_API_KEY")
+
+    specs = load_specs(args.specs)
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=_init_worker,
+                             initargs=(api_key, log_level)) as pool:
+        futures = [
+            pool.submit(build_one, i, spec, args.out_dir, pexels_key, args.refresh, args.slide_workers)
+            for i, spec in enumerate(specs)
+        ]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            if res["ok"]:
+                t = res["timings"]
+                print(f"[{res['index']:4d}] ok   {res['wall_s']:7.2f}s  titles {t['titles_s']:.2f}s  "
+                      f"outline {t['outline_s']:.2f}s  slides {t['slides_s']:.2f}s  pptx {t['pptx_s']:.2f}s  {res['slides']} slides  {res['path']}")
+            else:
+                print(f"[{res['index']:4d}] FAIL {res['wall_s']:7.2f}s  {res['topic']}: {res['error']}")
+
+    results.sort(key=lambda r: r["index"])
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for res in results:
+                f.write(json.dumps(res) + "\n")
+    failed = sum(not r["ok"] for r in results)
+    print(f"{len(results) - failed}/{len(results)} decks built in {time.perf_counter() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
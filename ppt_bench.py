@@ -0,0 +1,387 @@
+"""Offline benchmark of the deck build path, with local Gemini and Pexels stand-ins.
+
+No API keys or network access are needed. Gemini is replaced by FakeGemini
+(configurable latency, error rate and reply size) and Pexels by a local HTTP
+server that answers searches and serves generated JPEGs. Everything else is
+the real code: ppt_core.build_deck with its rate controllers, LLM cache,
+image store, image downscaling and PPTX assembly.
+
+Every scenario (one deck size) runs in a fresh process with empty caches and
+reports wall time, per-stage timings, peak RSS and deck size:
+
+    python ppt_bench.py                          # 5, 30 and 200 slides
+    python ppt_bench.py --save-baseline bench_baseline.json
+    python ppt_bench.py --baseline bench_baseline.json --tolerance 0.2
+
+--engines instead times PPTX assembly alone, once per engine (python-pptx's
+object model vs the fast ooxml_writer), on decks of ready-made slides with
+pictures, at 30, 300 and 1000 slides by default:
+
+    python ppt_bench.py --engines
+
+Each engine scenario also times a re-export: the deck is built once through
+IncrementalDeck, one slide's bullets and picture change, and the rebuild
+(which only patches that slide into the previous package) is timed.
+
+With --baseline, a metric that got worse than the baseline by more than the
+tolerance is reported as a regression and the exit status is 1. A scenario
+that crashes or runs past --timeout also exits 1.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_SIZES = (5, 30, 200)
+ENGINE_SIZES = (30, 300, 1000)
+ENGINES = ("pptx", "fast")
+# Metrics compared against the baseline; all of them are "lower is better"
+COMPARED = ("wall_s", "titles_s", "outline_s", "slides_s", "pptx_s", "peak_rss_mb", "deck_mb")
+
+
+# ---------- FAKE GEMINI ----------
+class FakeAPIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"fake Gemini error {code}")
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+# Stands in for genai.GenerativeModel behind ppt_core's GeminiBackend, so the
+# Gemini path (rate control, retries) is exercised. Replies come from
+# TemplateBackend: valid for every prompt ppt_core sends and the same on every
+# run for the same prompt.
+class FakeGemini:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, words=12, chunk_delay=0.005):
+        from llm_backends import TemplateBackend
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.template = TemplateBackend(words=words)
+        self._lock = threading.Lock()
+        self._errors = random.Random(0)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._errors.random() < self.error_rate
+            code = self._errors.choice((429, 503))
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if failed:
+            raise FakeAPIError(code)
+
+    def _stream(self, text):
+        for piece in re.split(r"(?<=\n)", text):
+            time.sleep(self.chunk_delay)
+            yield FakeResponse(piece)
+
+    def generate_content(self, parts, generation_config=None, stream=False):
+        self._call()
+        text = self.template.reply("\n".join(parts))
+        return self._stream(text) if stream else FakeResponse(text)
+
+
+# ---------- FAKE PEXELS ----------
+def make_images(count, size, quality=90):
+    from PIL import Image
+
+    images = []
+    for i in range(count):
+        img = Image.effect_noise(size, 40 + i).convert("RGB")
+        bio = io.BytesIO()
+        img.save(bio, format="JPEG", quality=quality)
+        images.append(bio.getvalue())
+    return images
+
+
+# Local stand-in for PEXELS_SEARCH_URL plus the photo CDN. A query always maps
+# to the same page of photo URLs; photos are served from a small set of generated JPEGs.
+def start_pexels_server(images, latency=0.03):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            host = f"http://127.0.0.1:{self.server.server_address[1]}"
+            if self.path.startswith("/v1/search"):
+                query = parse_qs(urlparse(self.path).query)
+                photos = []
+                for i in range(int(query.get("per_page", ["1"])[0])):
+                    digest = hashlib.sha256(f"{query.get('query')}/{i}".encode("utf-8")).hexdigest()
+                    url = f"{host}/photos/{digest[:16]}.jpg"
+                    photos.append({"id": i, "src": {"landscape": url, "original": url, "tiny": url}})
+                self._send(json.dumps({"photos": photos}).encode("utf-8"), "application/json")
+            elif self.path.startswith("/photos/"):
+                self._send(images[int(self.path[8:24], 16) % len(images)], "image/jpeg")
+            else:
+                self.send_error(404)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------- SCENARIOS ----------
+def peak_rss_mb():
+    import resource
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+# Runs in a fresh process: private caches, fake backends, one build_deck call
+def run_scenario(slides, options, result_queue):
+    work_dir = tempfile.mkdtemp(prefix="ppt_bench_")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(work_dir, "llm_cache.sqlite3")
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(work_dir, "images")
+    # The stand-ins have no quota; the controllers still run, just without throttling
+    os.environ.setdefault("GEMINI_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("PEXELS_REQUESTS_PER_HOUR", "1000000")
+    import ppt_core
+    from llm_backends import GeminiBackend
+
+    fake = FakeGemini(options["latency"], options["jitter"], options["error_rate"], options["words"])
+    ppt_core.set_backend("gemini", GeminiBackend("bench", ppt_core.GEMINI_MODEL_NAME, model=fake))
+    server = start_pexels_server(make_images(8, tuple(options["image_size"])), options["pexels_latency"])
+    ppt_core.PEXELS_SEARCH_URL = f"http://127.0.0.1:{server.server_address[1]}/v1/search"
+
+    started = time.perf_counter()
+    bio, info = ppt_core.build_deck(
+        f"Benchmark topic {slides}", slides_count=slides,
+        pexels_key="bench" if options["images"] else None, max_workers=options["workers"],
+    )
+    wall = time.perf_counter() - started
+    server.shutdown()
+    result_queue.put({
+        "slides": slides,
+        "wall_s": round(wall, 3),
+        **info["timings"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "deck_mb": round(len(bio.getbuffer()) / 1e6, 3),
+        "llm_calls": fake.calls,
+        "pipeline": info["pipeline"],
+        "stages": ppt_core.get_metrics().summary(),
+    })
+
+
+# Runs in a fresh process: one create_pptx_bytes call with the given engine on
+# `slides` generated slides sharing a few pictures (already downscaled, so only
+# assembly is timed), then a re-export after a one-slide edit
+def run_engine_scenario(slides, options, result_queue):
+    work_dir = tempfile.mkdtemp(prefix="ppt_bench_")
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(work_dir, "images")
+    import ppt_core
+    from llm_backends import TemplateBackend
+
+    template = TemplateBackend(words=options["words"])
+    paths = []
+    for i, data in enumerate(make_images(8, tuple(options["image_size"]))):
+        path = os.path.join(work_dir, f"photo{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(data)
+        ppt_core.placed_image_path(path)
+        paths.append(path)
+    contents = []
+    for i in range(slides):
+        title = f"Section {i + 1}"
+        bullets, notes = ppt_core.parse_lines_to_bullets_and_notes(template.reply(f"Slide title: {title}"))
+        contents.append({"slide_title": title, "bullets": bullets, "notes": notes,
+                         "image_local_path": paths[i % len(paths)] if options["images"] else None})
+
+    started = time.perf_counter()
+    bio = ppt_core.create_pptx_bytes(f"Benchmark topic {slides}", contents, attach_images=True, engine=options["engine"])
+    pptx_s = time.perf_counter() - started
+
+    from incremental_deck import IncrementalDeck
+
+    deck = IncrementalDeck(engine=options["engine"])
+    deck.build(f"Benchmark topic {slides}", contents, attach_images=True)
+    edited = slides // 2
+    contents[edited] = dict(contents[edited], bullets=["Edited bullet"],
+                            image_local_path=paths[(edited + 1) % len(paths)] if options["images"] else None)
+    stats = {}
+    started = time.perf_counter()
+    deck.build(f"Benchmark topic {slides}", contents, attach_images=True, stats=stats)
+    result_queue.put({
+        "slides": slides,
+        "engine": options["engine"],
+        "pptx_s": round(pptx_s, 3),
+        "reexport_s": round(time.perf_counter() - started, 3),
+        "reexport_mode": stats.get("build_mode"),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "deck_mb": round(len(bio.getbuffer()) / 1e6, 3),
+    })
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+# Runs target in a fresh process and returns its result. Raises ScenarioFailed
+# when the process exits without one (its traceback is on stderr) or is still
+# running after options["timeout"] seconds.
+def run_isolated(slides, options, target=run_scenario):
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=(slides, options, result_queue))
+    proc.start()
+    deadline = time.monotonic() + options["timeout"]
+    try:
+        while True:
+            try:
+                return result_queue.get(timeout=1.0)
+            except queue.Empty:
+                pass
+            if not proc.is_alive():
+                # The result may have been queued just before the process exited
+                try:
+                    return result_queue.get(timeout=1.0)
+                except queue.Empty:
+                    raise ScenarioFailed(
+                        f"{target.__name__} ({slides} slides) exited with code {proc.exitcode} without a result"
+                    ) from None
+            if time.monotonic() > deadline:
+                raise ScenarioFailed(f"{target.__name__} ({slides} slides) still running after {options['timeout']:g}s")
+    finally:
+        proc.join(5)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+
+
+# Median of every compared metric over `repeat` runs
+def run_size(slides, options, repeat, target=run_scenario, metrics=COMPARED):
+    runs = [run_isolated(slides, options, target) for _ in range(repeat)]
+    result = dict(runs[-1])
+    for metric in metrics:
+        values = sorted(r[metric] for r in runs)
+        result[metric] = values[len(values) // 2]
+    return result
+
+
+def compare_engines(sizes, options, repeat):
+    results = []
+    for slides in sizes:
+        row = {}
+        for engine in ENGINES:
+            res = run_size(slides, dict(options, engine=engine), repeat, run_engine_scenario,
+                           ("pptx_s", "reexport_s", "peak_rss_mb", "deck_mb"))
+            results.append(res)
+            row[engine] = res
+            print(f"{slides:5d} slides  {engine:5s}  build {res['pptx_s']:7.2f}s  "
+                  f"re-export {res['reexport_s']:6.2f}s ({res['reexport_mode']})  "
+                  f"rss {res['peak_rss_mb']:.0f} MB  deck {res['deck_mb']:.2f} MB")
+        print(f"{slides:5d} slides  speedup x{row['pptx']['pptx_s'] / max(row['fast']['pptx_s'], 1e-9):.1f}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for res in results:
+        base = baseline.get(str(res["slides"]))
+        if not base:
+            continue
+        for metric in COMPARED:
+            old, new = base.get(metric), res.get(metric)
+            # Sub-10ms stages are noise, not regressions
+            if old is None or new is None or (metric.endswith("_s") and new < 0.01):
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{res['slides']} slides: {metric} {old} -> {new} (+{(new / max(old, 1e-9) - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark deck builds offline against local Gemini/Pexels stand-ins.")
+    parser.add_argument("--sizes", type=int, nargs="+", help=f"deck sizes (slides; default {DEFAULT_SIZES}, with --engines {ENGINE_SIZES})")
+    parser.add_argument("--engines", action="store_true", help="compare the PPTX assembly engines instead of full builds")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size (the median is reported)")
+    parser.add_argument("--workers", type=int, default=8, help="parallel slide requests")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean fake Gemini latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="std deviation of the fake Gemini latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake Gemini calls failing with 429/503")
+    parser.add_argument("--words", type=int, default=12, help="words per generated bullet")
+    parser.add_argument("--pexels-latency", type=float, default=0.03, help="fake Pexels latency per request (s)")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1920, 1280), metavar=("W", "H"))
+    parser.add_argument("--no-images", action="store_true", help="benchmark without pictures")
+    parser.add_argument("--baseline", help="JSON file written by --save-baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown/growth vs the baseline")
+    parser.add_argument("--save-baseline", help="write this run's results to a baseline file")
+    parser.add_argument("--report", help="write the full results as JSON to this file")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds a single scenario may run")
+    args = parser.parse_args(argv)
+
+    options = {
+        "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate, "words": args.words,
+        "pexels_latency": args.pexels_latency, "image_size": args.image_size, "images": not args.no_images,
+        "workers": args.workers, "timeout": args.timeout,
+    }
+    try:
+        return run_benchmarks(args, options)
+    except ScenarioFailed as e:
+        print(f"FAILED {e}", file=sys.stderr)
+        return 1
+
+
+def run_benchmarks(args, options):
+    if args.engines:
+        results = compare_engines(args.sizes or ENGINE_SIZES, options, max(1, args.repeat))
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump({"options": options, "results": results}, f, indent=2)
+        return 0
+
+    results = []
+    for slides in args.sizes or DEFAULT_SIZES:
+        res = run_size(slides, options, max(1, args.repeat))
+        results.append(res)
+        print(f"{res['slides']:4d} slides  wall {res['wall_s']:7.2f}s  titles {res['titles_s']:.2f}s  "
+              f"outline {res['outline_s']:.2f}s  slides {res['slides_s']:.2f}s  pptx {res['pptx_s']:.2f}s  "
+              f"rss {res['peak_rss_mb']:.0f} MB  deck {res['deck_mb']:.2f} MB  {res['llm_calls']} LLM calls")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"options": options, "results": results}, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({str(r["slides"]): {m: r[m] for m in COMPARED} for r in results}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
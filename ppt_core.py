@@ -0,0 +1,1363 @@
+"""Generation core of AI PPT Wizard, usable without Streamlit.
+
+Holds the Gemini prompts, the Pexels image flow, the concurrent slide pipeline
+and PPTX assembly. source.py (the Streamlit UI) and ppt_batch.py (the bulk CLI)
+are both thin front-ends over this module. Problems are reported through the
+"ppt_core" logger rather than raised, matching how the UI degrades per slide.
+"""
+import os
+import re
+import hashlib
+import io
+import json
+import time
+import logging
+import tempfile
+import threading
+from functools import lru_cache, partial, wraps
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import jsonschema
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from llm_cache import LLMCache
+from image_store import ImageStore, normalize_keyword
+from prefetch import SpeculativePrefetcher
+from job_queue import JobQueue
+from rate_control import RateController, RateLimited
+from metrics import Metrics
+from llm_backends import GeminiBackend, TemplateBackend, LLMResponse
+from session_artifacts import ArtifactManager
+from single_flight import SingleFlight, FlightTimeout, FlightAbandoned, set_thread_cancel_event
+
+# google.generativeai, pptx and Pillow (image_prep) together cost
+# ~0.75s to import, so they are imported on first use rather than here.
+
+log = logging.getLogger("ppt_core")
+
+# Load .env if present
+load_dotenv()
+
+# ---------- CONFIG ----------
+DEFAULT_SLIDES = 5
+AUDIENCE_PRESETS = ["Executive", "Technical", "Marketing", "Educational"]
+PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+# Max slides generated in parallel (each slide = 1 Gemini call + Pexels search/download)
+MAX_PARALLEL_SLIDES = int(os.getenv("MAX_PARALLEL_SLIDES", "8"))
+# Slides requested per Gemini call in batch mode (0 or 1 = one call per slide)
+SLIDE_BATCH_SIZE = int(os.getenv("SLIDE_BATCH_SIZE", "10"))
+# Pexels search + download workers; image work overlaps with text generation
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "6"))
+# Shared content-addressed image store (keyword -> URL -> file), LRU-evicted past the budget
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(tempfile.gettempdir(), "ai_ppt_wizard", "images"))
+IMAGE_STORE_MAX_MB = int(os.getenv("IMAGE_STORE_MAX_MB", "500"))
+# Photos kept per keyword from its one Pexels search, offered as alternates in Step 4
+PEXELS_CANDIDATES = int(os.getenv("PEXELS_CANDIDATES", "8"))
+# Background downloads of candidate thumbnails (and the next full-size photo)
+CANDIDATE_PREFETCH_WORKERS = int(os.getenv("CANDIDATE_PREFETCH_WORKERS", "4"))
+# Pictures are placed 3.5" wide at (6.5", 1.0"); they are downscaled to that size at IMAGE_DPI before embedding
+IMAGE_LEFT_IN = 6.5
+IMAGE_TOP_IN = 1.0
+IMAGE_WIDTH_IN = 3.5
+IMAGE_DPI = int(os.getenv("IMAGE_DPI", "150"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+# LLM backend for slide/outline requests and for title suggestions: "gemini" or
+# "template" (deterministic local replies for load tests and offline demos)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_TITLE_BACKEND = os.getenv("LLM_TITLE_BACKEND") or LLM_BACKEND
+# On-disk Gemini response cache (shared by all sessions and restarts)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "ai_ppt_wizard", "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "50"))
+LLM_CACHE_TTL_HOURS = int(os.getenv("LLM_CACHE_TTL_HOURS", str(24 * 7)))
+# Speculative slide generation while the user picks a title: slides per guess,
+# guesses running at once, and slides per rolling hour (process-wide); 0 disables it
+SPECULATIVE_MAX_SLIDES = int(os.getenv("SPECULATIVE_MAX_SLIDES", "10"))
+SPECULATIVE_MAX_JOBS = int(os.getenv("SPECULATIVE_MAX_JOBS", "2"))
+SPECULATIVE_SLIDES_PER_HOUR = int(os.getenv("SPECULATIVE_SLIDES_PER_HOUR", "200"))
+# Background job queue drained by ppt_worker.py processes (see job_queue.py)
+JOB_QUEUE_DIR = os.getenv("JOB_QUEUE_DIR", os.path.join(tempfile.gettempdir(), "ai_ppt_wizard", "jobs"))
+# A running job whose worker has not heartbeated for this long is handed to another worker
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", "24"))
+# Request quotas per API key, shared by every session of the process (see rate_control.py).
+# Concurrency adapts between 1 and *_MAX_CONCURRENCY; a request waits at most
+# *_MAX_WAIT_S for quota before it fails (a Pexels one then just has no picture).
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_LATENCY_TARGET_S = float(os.getenv("GEMINI_LATENCY_TARGET_S", "30"))
+GEMINI_MAX_WAIT_S = float(os.getenv("GEMINI_MAX_WAIT_S", "120"))
+PEXELS_REQUESTS_PER_HOUR = float(os.getenv("PEXELS_REQUESTS_PER_HOUR", "200"))
+PEXELS_BURST = int(os.getenv("PEXELS_BURST", "50"))
+PEXELS_MAX_CONCURRENCY = int(os.getenv("PEXELS_MAX_CONCURRENCY", "12"))
+PEXELS_LATENCY_TARGET_S = float(os.getenv("PEXELS_LATENCY_TARGET_S", "5"))
+PEXELS_MAX_WAIT_S = float(os.getenv("PEXELS_MAX_WAIT_S", "30"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
+# Longest a request waits for an identical one already in flight (same LLM
+# prompt, Pexels keyword or image URL) before making its own call
+SINGLE_FLIGHT_WAIT_S = float(os.getenv("SINGLE_FLIGHT_WAIT_S", "120"))
+# Stage timing export (see metrics.py): JSON lines file, Prometheus text file, /metrics port
+METRICS_JSON_LOG = os.getenv("METRICS_JSON_LOG")
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Per-session blobs (exported decks): kept in memory up to SESSION_MEMORY_MB per
+# session, spilled to disk past that, and evicted after SESSION_IDLE_MINUTES idle
+SESSION_ARTIFACT_DIR = os.getenv("SESSION_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "ai_ppt_wizard", "sessions"))
+SESSION_MEMORY_MB = int(os.getenv("SESSION_MEMORY_MB", "32"))
+SESSION_IDLE_MINUTES = int(os.getenv("SESSION_IDLE_MINUTES", "60"))
+# Budget for the downscaled picture variants (image_prep), pruned with idle sessions
+IMAGE_VARIANTS_MAX_MB = int(os.getenv("IMAGE_VARIANTS_MAX_MB", "200"))
+# Step 4 layout thumbnails (slide_preview): width in pixels and cache budget
+PREVIEW_WIDTH_PX = int(os.getenv("PREVIEW_WIDTH_PX", "480"))
+PREVIEW_MAX_MB = int(os.getenv("PREVIEW_MAX_MB", "50"))
+# How often streamed partial slides are handed to the UI (seconds)
+STREAM_PREVIEW_INTERVAL = float(os.getenv("STREAM_PREVIEW_INTERVAL", "0.15"))
+# Largest deck the UI offers, and the slides per part of a generated outline
+MAX_SLIDES = int(os.getenv("MAX_SLIDES", "300"))
+OUTLINE_PART_SIZE = int(os.getenv("OUTLINE_PART_SIZE", "10"))
+# PPTX assembly: "fast" streams slide XML from precompiled fragments (ooxml_writer),
+# "pptx" builds every slide through python-pptx's object model
+PPTX_ENGINE = os.getenv("PPTX_ENGINE", "fast")
+
+
+# ---------- SHARED RESOURCES (one per process) ----------
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    return LLMCache(
+        LLM_CACHE_PATH,
+        max_entries=LLM_CACHE_MAX_ENTRIES,
+        max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+        ttl_seconds=LLM_CACHE_TTL_HOURS * 3600,
+    )
+
+# One keep-alive connection pool for all Pexels traffic instead of a new TLS handshake per request
+@lru_cache(maxsize=None)
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(IMAGE_WORKERS, 10))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@lru_cache(maxsize=None)
+def get_image_store():
+    return ImageStore(IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_MB * 1024 * 1024)
+
+@lru_cache(maxsize=None)
+def get_job_queue():
+    return JobQueue(JOB_QUEUE_DIR, stale_seconds=JOB_STALE_SECONDS, retention_seconds=JOB_RETENTION_HOURS * 3600)
+
+def _prune_image_variants():
+    from image_prep import prune_variants
+    prune_variants(os.path.join(IMAGE_STORE_DIR, "variants"), IMAGE_VARIANTS_MAX_MB * 1024 * 1024)
+    prune_variants(os.path.join(IMAGE_STORE_DIR, "previews"), PREVIEW_MAX_MB * 1024 * 1024, suffix=".png")
+
+@lru_cache(maxsize=None)
+def get_artifact_manager():
+    return ArtifactManager(
+        SESSION_ARTIFACT_DIR,
+        session_budget=SESSION_MEMORY_MB * 1024 * 1024,
+        idle_seconds=SESSION_IDLE_MINUTES * 60,
+        on_sweep=_prune_image_variants,
+    )
+
+# Bytes held by the process's artifacts: session blobs in memory and on disk,
+# the shared image store and the downscaled variants
+def artifact_stats():
+    stats = get_artifact_manager().stats()
+    stats["image_store_bytes"] = get_image_store().stats()["bytes"]
+    variants = os.path.join(IMAGE_STORE_DIR, "variants")
+    try:
+        stats["variant_bytes"] = sum(e.stat().st_size for e in os.scandir(variants) if e.is_file())
+    except FileNotFoundError:
+        stats["variant_bytes"] = 0
+    return stats
+
+@lru_cache(maxsize=None)
+def get_metrics():
+    metrics = Metrics(json_log=METRICS_JSON_LOG, prom_file=METRICS_PROM_FILE, port=METRICS_PORT or None)
+    metrics.gauge("llm_cache", lambda: {k: v for k, v in get_llm_cache().stats().items() if k != "hit_rate"})
+    metrics.gauge("image_store", lambda: {"hits": get_image_store().hits, "misses": get_image_store().misses})
+    metrics.gauge("artifacts", artifact_stats)
+    metrics.gauge("single_flight_in_flight", lambda: {k: v["in_flight"] for k, v in single_flight_stats().items()})
+    return metrics
+
+def span(stage, **fields):
+    return get_metrics().span(stage, **fields)
+
+# Decorator form of span
+def timed(stage):
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+# Keyed by API key, so sessions sharing a key share its quota
+_rate_controllers = {}
+_rate_controllers_lock = threading.Lock()
+
+def get_rate_controller(service, api_key):
+    with _rate_controllers_lock:
+        controller = _rate_controllers.get((service, api_key))
+        if controller is None:
+            if service == "gemini":
+                controller = RateController(
+                    "gemini", GEMINI_REQUESTS_PER_MINUTE / 60, GEMINI_BURST, concurrency=MAX_PARALLEL_SLIDES,
+                    max_concurrency=GEMINI_MAX_CONCURRENCY, latency_target=GEMINI_LATENCY_TARGET_S,
+                    max_attempts=MAX_RETRIES + 1, max_wait=GEMINI_MAX_WAIT_S,
+                )
+            else:
+                controller = RateController(
+                    "pexels", PEXELS_REQUESTS_PER_HOUR / 3600, PEXELS_BURST, concurrency=IMAGE_WORKERS,
+                    max_concurrency=PEXELS_MAX_CONCURRENCY, latency_target=PEXELS_LATENCY_TARGET_S,
+                    max_attempts=MAX_RETRIES + 1, max_wait=PEXELS_MAX_WAIT_S,
+                )
+            _rate_controllers[(service, api_key)] = controller
+        return controller
+
+# Per-service stats of the controllers used so far, summed over keys
+def rate_control_stats():
+    with _rate_controllers_lock:
+        controllers = list(_rate_controllers.items())
+    totals = {}
+    for (service, _), controller in controllers:
+        merged = totals.setdefault(service, {})
+        for k, v in controller.stats().items():
+            merged[k] = merged.get(k, 0) + v
+    return totals
+
+# One SingleFlight per kind of remote call: "llm", "pexels_search", "image_download"
+@lru_cache(maxsize=None)
+def get_single_flight(service):
+    return SingleFlight(
+        service, timeout=SINGLE_FLIGHT_WAIT_S,
+        on_event=lambda event: get_metrics().count("single_flight_total", service=service, result=event),
+    )
+
+def single_flight_stats():
+    return {service: get_single_flight(service).stats() for service in ("llm", "pexels_search", "image_download")}
+
+# Part of the flight key of calls made with an API key: requests that are
+# otherwise identical but use different keys must not share one call, since
+# its auth or quota error (and the quota it uses) belong to that key
+def _key_digest(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else None
+
+# fn(*args), shared with every concurrent caller using the same key. A caller
+# that gave up waiting, or whose leader went away without a result, makes the
+# call itself; a cancelled wait raises FlightCancelled.
+def coalesced(service, key, fn, *args):
+    try:
+        return get_single_flight(service).do(key, fn, *args)
+    except (FlightTimeout, FlightAbandoned) as e:
+        log.warning("%s; calling directly", e)
+        return fn(*args)
+
+# ---------- HELPERS ----------
+def safe_filename(s: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_\-]+', '_', s).strip('_')[:80]
+
+def parse_lines_to_bullets_and_notes(generated_text: str):
+    lines = [ln.strip() for ln in generated_text.splitlines() if ln.strip()]
+    bullets, notes_lines = [], []
+    for ln in lines:
+        if re.match(r"^(-|•|\d+\.)\s*", ln):
+            bullets.append(re.sub(r"^(-|•|\d+\.)\s*", "", ln).strip())
+        else:
+            notes_lines.append(ln)
+    if not bullets and lines:
+        bullets, notes_lines = lines[:4], lines[4:]
+    return bullets[:6], " ".join(notes_lines).strip()
+
+# Incremental form of the slide text parsing for streamed responses. Chunks are
+# fed as they arrive and each line is classified as soon as it is complete, so
+# the image keyword (and the bullets so far) are known before the reply ends.
+class SlideTextStream:
+    def __init__(self, on_keyword=None):
+        self.on_keyword = on_keyword
+        self.image_keyword = None
+        self.lines = []
+        self.buffer = ""
+
+    def feed(self, chunk):
+        *complete, self.buffer = (self.buffer + chunk).split("\n")
+        for line in complete:
+            self._line(line)
+
+    def _line(self, line):
+        m = re.search(r"ImageKeyword\s*:\s*(.+)$", line, flags=re.I)
+        if m:
+            line = line[:m.start()]
+            if self.image_keyword is None:
+                self.image_keyword = m.group(1).strip()
+                if self.on_keyword:
+                    self.on_keyword(self.image_keyword)
+        if line.strip():
+            self.lines.append(line.strip())
+
+    # Bullets and notes so far, including the line still being written
+    def partial(self):
+        lines = list(self.lines)
+        if self.buffer.strip() and not re.match(r"\s*image", self.buffer, flags=re.I):
+            lines.append(self.buffer.strip())
+        bullets, notes = parse_lines_to_bullets_and_notes("\n".join(lines))
+        return {"bullets": bullets, "notes": notes, "image_keyword": self.image_keyword}
+
+    def close(self):
+        self._line(self.buffer)
+        self.buffer = ""
+        return self.partial()
+
+# ---------- PEXELS ----------
+def _search_pexels(query, api_key):
+    with span("pexels_search"):
+        resp = get_http_session().get(PEXELS_SEARCH_URL, headers={"Authorization": api_key},
+                                      params={"query": query, "per_page": max(1, PEXELS_CANDIDATES)}, timeout=10)
+    if resp.status_code == 429 or resp.status_code >= 500:
+        retry_after = resp.headers.get("Retry-After")
+        raise RateLimited(f"Pexels returned {resp.status_code}", status=resp.status_code,
+                          retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+    return resp
+
+# What the index keeps of a Pexels photo; None if it has no usable URL
+def _candidate(photo):
+    src = photo.get("src") or {}
+    url = src.get("landscape") or src.get("original")
+    if not url:
+        return None
+    return {
+        "id": photo.get("id"), "url": url, "thumb": src.get("tiny") or src.get("small") or url,
+        "original": src.get("original") or url, "width": photo.get("width"), "height": photo.get("height"),
+        "photographer": photo.get("photographer"), "alt": photo.get("alt"), "avg_color": photo.get("avg_color"),
+    }
+
+# Candidate photos for a keyword, best match first. A keyword searched before is
+# answered from the image store's index; otherwise one Pexels search fetches
+# PEXELS_CANDIDATES results and indexes them. [] without a key or on failure.
+def image_candidates(query, api_key, refresh=False):
+    store = get_image_store()
+    if not refresh:
+        candidates = store.candidates_for(query)
+        if candidates:
+            get_metrics().count("image_candidates_total", source="index")
+            return candidates
+    if not api_key:
+        return []
+    return coalesced("pexels_search", (normalize_keyword(query), _key_digest(api_key)), _search_candidates, query, api_key)
+
+# One Pexels search for query; its results are indexed and returned as candidates
+def _search_candidates(query, api_key):
+    store = get_image_store()
+    try:
+        resp = get_rate_controller("pexels", api_key).call(_search_pexels, query, api_key)
+    except RateLimited as e:
+        log.warning("⚠️ Pexels API error (%s) — check your key or usage limits.", e.status)
+        return []
+    except Exception as e:
+        log.warning("Pexels request error: %s", e)
+        return []
+    if resp.status_code == 200:
+        try:
+            candidates = [c for c in map(_candidate, resp.json().get("photos") or []) if c]
+        except Exception as e:
+            log.warning("Failed to parse Pexels response: %s", e)
+            return []
+        if candidates:
+            store.remember_candidates(query, candidates)
+        get_metrics().count("image_candidates_total", source="search")
+        return candidates
+    if resp.status_code in (401, 403):
+        log.warning("⚠️ Pexels API error — check your key or usage limits.")
+    return []
+
+def fetch_image_url_safe(query, api_key):
+    candidates = image_candidates(query, api_key)
+    return candidates[0]["url"] if candidates else None
+
+def download_image_to_path(img_url, keyword):
+    try:
+        if keyword:
+            get_image_store().remember_keyword(keyword, img_url)
+        with span("image_download"):
+            path = coalesced("image_download", img_url, get_image_store().fetch, img_url, get_http_session())
+        get_metrics().count("image_bytes_total", os.path.getsize(path))
+        return path
+    except Exception as e:
+        log.warning("Failed to download image: %s", e)
+        return None
+
+
+# ---------- LLM BACKENDS ----------
+_api_key = None      # process default key, set by configure()
+_backend_overrides = {}
+
+# Sets the Gemini key used when a call does not pass api_key. Only for
+# single-user processes (batch CLI, queue workers): a server shared by several
+# sessions passes each session's key explicitly, so a call in flight keeps the
+# key (and quota) it started with.
+def configure(api_key):
+    global _api_key
+    _api_key = api_key
+
+# One GeminiBackend per key, so its model client (and connections) are reused
+@lru_cache(maxsize=None)
+def _gemini_backend(api_key):
+    return GeminiBackend(api_key, GEMINI_MODEL_NAME)
+
+@lru_cache(maxsize=None)
+def _template_backend():
+    return TemplateBackend()
+
+# Installs `backend` under `name` for this process (e.g. a stand-in model for
+# benchmarks); None removes it again.
+def set_backend(name, backend):
+    if backend is None:
+        _backend_overrides.pop(name, None)
+    else:
+        _backend_overrides[name] = backend
+
+# Backend for a kind of request: "titles" goes to LLM_TITLE_BACKEND, everything
+# else to LLM_BACKEND. Gemini is called with api_key, else configure()'s key.
+def get_backend(purpose="default", api_key=None):
+    name = LLM_TITLE_BACKEND if purpose == "titles" else LLM_BACKEND
+    if name in _backend_overrides:
+        return _backend_overrides[name]
+    if name == "template":
+        return _template_backend()
+    if name != "gemini":
+        raise ValueError(f"Unknown LLM backend {name!r} (expected 'gemini' or 'template')")
+    api_key = api_key or _api_key
+    if api_key is None:
+        raise RuntimeError("No Gemini API key; pass api_key or call ppt_core.configure(api_key) first")
+    return _gemini_backend(api_key)
+
+def _rate_controller_for(backend):
+    return get_rate_controller(backend.rate_service, backend.api_key) if backend.rate_service else None
+
+# Character counts always; token counts when the backend reports them
+def _record_llm_usage(parts, text, resp=None):
+    metrics = get_metrics()
+    metrics.count("llm_chars_total", sum(len(p) for p in parts if isinstance(p, str)), direction="prompt")
+    metrics.count("llm_chars_total", len(text), direction="response")
+    if resp is not None and resp.prompt_tokens is not None:
+        metrics.count("llm_tokens_total", resp.prompt_tokens or 0, direction="prompt")
+        metrics.count("llm_tokens_total", resp.response_tokens or 0, direction="response")
+
+def _timed_generate(backend, parts, generation_config):
+    with span("llm_call", backend=backend.name):
+        resp = backend.generate(parts, generation_config)
+    _record_llm_usage(parts, resp.text, resp)
+    return resp
+
+# One request, through the backend's rate controller (throttling and retries) if it has one
+def _call_backend(backend, parts, generation_config):
+    controller = _rate_controller_for(backend)
+    if controller is None:
+        return _timed_generate(backend, parts, generation_config)
+    return controller.call(_timed_generate, backend, parts, generation_config)
+
+# True when validate(text) does not raise (or there is no validate). A reply
+# the caller cannot use is neither cached nor served from the cache, or every
+# later build would replay it and take the caller's fallback path forever.
+def _usable(text, validate):
+    if validate is None:
+        return True
+    try:
+        validate(text)
+    except Exception:
+        return False
+    return True
+
+# _call_backend for a request whose cache key may already be in flight: one
+# remote call, cached once if usable, its response shared by every concurrent caller
+def _call_backend_once(backend, key, parts, generation_config, validate=None):
+    def call():
+        resp = _call_backend(backend, parts, generation_config)
+        if resp.text and _usable(resp.text, validate):
+            get_llm_cache().put(key, resp.text, model=backend.model_name)
+        return resp
+    return coalesced("llm", (key, _key_digest(backend.api_key)), call)
+
+# Returns the response text for `parts`, served from the LLM cache when possible.
+# refresh=True forces a new call and overwrites the entry. `purpose` picks the
+# backend (see get_backend); entries are keyed by the backend's model name.
+# validate(text) raises for a reply the caller will reject (see _usable).
+def generate_cached(parts, generation_config=None, refresh=False, purpose="default", api_key=None, validate=None):
+    backend = get_backend(purpose, api_key)
+    cache = get_llm_cache()
+    key = LLMCache.make_key(backend.model_name, parts, generation_config)
+    if not refresh:
+        text = cache.get(key)
+        if text is not None and _usable(text, validate):
+            return text
+    return _call_backend_once(backend, key, parts, generation_config, validate).text
+
+# generate_cached for several prompts at once: cached ones are answered
+# directly, the rest go out together through the backend's generate_batch.
+# Returns one text (or the exception the request raised) per prompt.
+def generate_cached_batch(prompts, generation_config=None, refresh=False, purpose="default",
+                          max_workers=MAX_PARALLEL_SLIDES, api_key=None, validate=None):
+    backend = get_backend(purpose, api_key)
+    cache = get_llm_cache()
+    keys = [LLMCache.make_key(backend.model_name, parts, generation_config) for parts in prompts]
+    results = [None if refresh else cache.get(key) for key in keys]
+    results = [text if text is not None and _usable(text, validate) else None for text in results]
+    todo = [i for i, text in enumerate(results) if text is None]
+    responses = backend.generate_batch(
+        [prompts[i] for i in todo], generation_config, max_workers=max_workers,
+        call=lambda _generate, parts, config: _call_backend_once(
+            backend, LLMCache.make_key(backend.model_name, parts, config), parts, config, validate),
+    )
+    for i, resp in zip(todo, responses):
+        results[i] = resp if isinstance(resp, Exception) else resp.text
+    return results
+
+# Streaming form of generate_cached: yields text chunks as the model produces
+# them. A cached response is yielded in one piece; a streamed one is cached once
+# complete, under the same key, so both forms share entries. While an identical
+# request (streamed or not) is in flight, its full text is awaited and yielded
+# in one piece instead of streaming a second copy.
+def stream_cached(parts, generation_config=None, refresh=False, purpose="default", api_key=None):
+    backend = get_backend(purpose, api_key)
+    cache = get_llm_cache()
+    key = LLMCache.make_key(backend.model_name, parts, generation_config)
+    if not refresh:
+        text = cache.get(key)
+        if text is not None:
+            yield text
+            return
+    flights = get_single_flight("llm")
+    flight_key = (key, _key_digest(backend.api_key))
+    flight, leader = flights.begin(flight_key)
+    if not leader:
+        try:
+            text = flights.wait(flight).text
+        except (FlightTimeout, FlightAbandoned) as e:
+            log.warning("%s; streaming directly", e)
+        else:
+            yield text
+            return
+    chunks = []
+    controller = _rate_controller_for(backend)
+    started = time.perf_counter()
+    try:
+        with span("llm_stream", backend=backend.name):
+            pieces = controller.stream(backend.stream, parts, generation_config) if controller else backend.stream(parts, generation_config)
+            for piece in pieces:
+                if not chunks:
+                    get_metrics().observe("llm_first_chunk", time.perf_counter() - started)
+                chunks.append(piece)
+                yield piece
+    except Exception as e:
+        if leader:
+            flights.finish(flight_key, flight, error=e)
+        raise
+    except BaseException:
+        # Consumer stopped early (GeneratorExit): waiters make their own call
+        if leader:
+            flights.finish(flight_key, flight, abandoned=True)
+        raise
+    text = "".join(chunks)
+    _record_llm_usage(parts, text)
+    if text:
+        cache.put(key, text, model=backend.model_name)
+    if leader:
+        flights.finish(flight_key, flight, result=LLMResponse(text))
+
+@timed("titles")
+def generate_titles(subject, count=6, refresh=False, api_key=None):
+    system = "You are an expert presentation author. Produce short, engaging presentation titles."
+    prompt = f"Generate {count} concise titles (max 10 words each) for: \"{subject}\"."
+    try:
+        text = generate_cached([system, prompt], refresh=refresh, purpose="titles", api_key=api_key)
+        titles = [re.sub(r'^[\-\d\.\)\s]+', '', line).strip() for line in text.splitlines() if line.strip()]
+        return titles[:count]
+    except Exception as e:
+        log.error("Error generating titles: %s", e)
+        return []
+
+# `context` (see outline_context) places the slide within a long deck. With
+# stream=True the reply is parsed while it streams: on_keyword(keyword) fires as
+# soon as the keyword line is complete and on_partial(slide) after every chunk.
+@timed("slide_text")
+def generate_slide_text(ppt_title, section_title, audience, include_image_keyword=True, refresh=False, context=None,
+                        stream=False, on_keyword=None, on_partial=None, api_key=None):
+    system = "You are an expert presentation writer. Use concise bullets and notes."
+    prompt = f"Create slide content for '{ppt_title}'.\n"
+    if context:
+        prompt += f"{context}\n"
+    prompt += (
+        f"Slide title: {section_title}\n"
+        f"Audience: {audience}\n"
+        "- 3 to 5 concise bullet points (<= 20 words each)\n"
+        "- A short speaker note (1-2 sentences)\n"
+    )
+    if include_image_keyword:
+        # First, so a streamed reply names its picture before the bullets arrive
+        prompt += "- Start your reply with the line 'ImageKeyword: <2-4 word idea>'.\n"
+    try:
+        if stream:
+            parser = SlideTextStream(on_keyword)
+            for chunk in stream_cached([system, prompt], refresh=refresh, api_key=api_key):
+                parser.feed(chunk)
+                if on_partial:
+                    on_partial(parser.partial())
+            return parser.close()
+        text = generate_cached([system, prompt], refresh=refresh, api_key=api_key)
+        ik_match = re.search(r"ImageKeyword\s*:\s*(.+)$", text, flags=re.I | re.M)
+        image_keyword = ik_match.group(1).strip() if ik_match else None
+        if image_keyword:
+            text = re.sub(r"ImageKeyword\s*:\s*.+$", "", text, flags=re.I | re.M).strip()
+        bullets, notes = parse_lines_to_bullets_and_notes(text)
+        return {"bullets": bullets, "notes": notes, "image_keyword": image_keyword}
+    except Exception as e:
+        log.error("Error generating slide: %s", e)
+        return {"bullets": ["(Generation failed)"], "notes": "", "image_keyword": None}
+
+SLIDE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "index": {"type": "integer", "minimum": 0},
+        "bullets": {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 1},
+        "notes": {"type": "string"},
+        "image_keyword": {"type": ["string", "null"]},
+    },
+    "required": ["index", "bullets", "notes"],
+}
+DECK_SCHEMA = {
+    "type": "object",
+    "properties": {"slides": {"type": "array", "items": {"type": "object"}}},
+    "required": ["slides"],
+}
+
+@lru_cache(maxsize=None)
+def slide_validator():
+    return jsonschema.Draft7Validator(SLIDE_SCHEMA)
+
+def parse_json_response(text: str):
+    text = (text or "").strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, flags=re.S | re.I)
+    if fenced:
+        text = fenced.group(1)
+    return json.loads(text)
+
+def parse_deck_response(text):
+    data = parse_json_response(text)
+    jsonschema.validate(data, DECK_SCHEMA)
+    return data
+
+# Asks for a chunk of slides in one request. Returns one entry per section, in
+# order; slides that are missing or fail SLIDE_SCHEMA come back as None so the
+# caller can fall back to generate_slide_text for just those.
+@timed("slide_batch")
+def generate_slide_batch(ppt_title, section_titles, audience, include_image_keyword=True, refresh=False,
+                         context=None, api_key=None):
+    system = "You are an expert presentation writer. Use concise bullets and notes. Reply with JSON only."
+    listing = "\n".join(f"{i}: {t}" for i, t in enumerate(section_titles))
+    prompt = f"Create slide content for '{ppt_title}'.\n"
+    if context:
+        prompt += f"{context}\nThe slides below are one consecutive chunk of that deck; do not repeat other parts.\n"
+    prompt += (
+        f"Audience: {audience}\n"
+        f"Slides (index: title):\n{listing}\n"
+        "For every slide give:\n"
+        "- index: the slide index above\n"
+        "- bullets: 3 to 5 concise bullet points (<= 20 words each)\n"
+        "- notes: a short speaker note (1-2 sentences)\n"
+    )
+    if include_image_keyword:
+        prompt += "- image_keyword: a 2-4 word image idea\n"
+    prompt += f'Return a JSON object {{"slides": [...]}} where each slide matches this JSON schema:\n{json.dumps(SLIDE_SCHEMA)}'
+
+    results = [None] * len(section_titles)
+    try:
+        data = parse_deck_response(
+            generate_cached([system, prompt], refresh=refresh, api_key=api_key, validate=parse_deck_response)
+        )
+    except Exception as e:
+        log.warning("Batch generation failed, falling back to per-slide requests: %s", e)
+        return results
+    for item in data["slides"]:
+        if not slide_validator().is_valid(item):
+            continue
+        i = item["index"]
+        if i < len(results) and results[i] is None:
+            results[i] = {
+                "bullets": [b.strip() for b in item["bullets"]][:6],
+                "notes": item["notes"].strip(),
+                "image_keyword": (item.get("image_keyword") or "").strip() or None,
+            }
+    return results
+
+# ---------- SLIDE GENERATION ENGINE ----------
+# Thin wrapper over an executor that records queue depth and queue wait per stage
+class PipelineStage:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.max_queue_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def submit(self, fn, *args):
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.submitted - self.started)
+        return self.pool.submit(self._run, queued_at, fn, *args)
+
+    def _run(self, queued_at, fn, *args):
+        start = time.perf_counter()
+        with self._lock:
+            self.started += 1
+            self.wait_total += start - queued_at
+            self.wait_max = max(self.wait_max, start - queued_at)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.run_total += time.perf_counter() - start
+
+    def stats(self):
+        jobs = self.submitted or 1
+        return {
+            "jobs": self.submitted,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_ms": round(1000 * self.wait_total / jobs, 1),
+            "max_wait_ms": round(1000 * self.wait_max, 1),
+            "avg_run_ms": round(1000 * self.run_total / jobs, 1),
+        }
+
+def attach_image(slide, pexels_key):
+    # A keyword seen before resolves straight to the stored file: no search, no download
+    local_path = get_image_store().path_for_keyword(slide['image_keyword'])
+    if not local_path:
+        img_url = fetch_image_url_safe(slide['image_keyword'], pexels_key)
+        if img_url:
+            local_path = download_image_to_path(img_url, slide['image_keyword'])
+    if local_path:
+        slide['image_local_path'] = local_path
+    return slide
+
+# Switches the slide to candidate `index` (wrapping around) of its keyword's
+# indexed candidates. Never searches; the download is skipped too when the photo
+# was prefetched. The keyword's default photo for other slides is unchanged.
+def choose_image(slide, index):
+    candidates = get_image_store().candidates_for(slide.get('image_keyword') or "")
+    if not candidates:
+        return slide
+    index %= len(candidates)
+    local_path = download_image_to_path(candidates[index]["url"], None)
+    if local_path:
+        slide['image_local_path'] = local_path
+        slide['image_choice'] = index
+        prefetch_candidates(slide['image_keyword'], index)
+    return slide
+
+@lru_cache(maxsize=None)
+def get_candidate_pool():
+    return ThreadPoolExecutor(max_workers=CANDIDATE_PREFETCH_WORKERS, thread_name_prefix="image-prefetch")
+
+_prefetching = set()
+_prefetching_lock = threading.Lock()
+
+def _prefetch_url(url):
+    try:
+        download_image_to_path(url, None)
+    finally:
+        with _prefetching_lock:
+            _prefetching.discard(url)
+
+# Downloads, in the background, the thumbnails of a keyword's candidates and the
+# full-size photo after `current`, so the picker and "next image" are instant.
+def prefetch_candidates(keyword, current=0):
+    candidates = get_image_store().candidates_for(keyword or "")
+    urls = [c["thumb"] for c in candidates]
+    if len(candidates) > 1:
+        urls.append(candidates[(current + 1) % len(candidates)]["url"])
+    stored = get_image_store().paths_for_urls(urls)
+    for url in urls:
+        if url in stored:
+            continue
+        with _prefetching_lock:
+            if url in _prefetching:
+                continue
+            _prefetching.add(url)
+        get_candidate_pool().submit(_prefetch_url, url)
+
+# Per candidate, its local thumbnail if prefetched, else its URL (the browser loads it)
+def candidate_thumbnails(candidates):
+    stored = get_image_store().paths_for_urls(c["thumb"] for c in candidates)
+    return [stored.get(c["thumb"], c["thumb"]) for c in candidates]
+
+def failed_slide(section_title):
+    return {
+        "slide_title": section_title, "bullets": ["(Generation failed)"],
+        "notes": "", "image_keyword": None, "image_local_path": None,
+    }
+
+# Pool initializer that also makes single-flight waits on the worker threads
+# give up once cancel_event is set
+def _cancellable(cancel_event, initializer=None):
+    def init(*args):
+        set_thread_cancel_event(cancel_event)
+        if initializer:
+            initializer(*args)
+    return init
+
+# Two-stage pipeline: text generation on a pool of max_workers, Pexels search +
+# download on a separate pool of image_workers. A slide's image job starts as soon
+# as its text (and so its image_keyword) is known, while other slides are still
+# being written. With batch_size > 1 text comes from one generate_slide_batch
+# call per chunk and only slides the batch missed are re-requested one by one.
+# Results come back in section order; a slide that raises gets a placeholder
+# without cancelling the rest. Images are only fetched when pexels_key is set.
+# `initializer`/`initargs` run in every worker thread (the UI uses them to attach
+# its script context). Once `cancel_event` is set no further requests are issued;
+# slides that were not finished by then come back as None. `context` is shared
+# deck context (outline_context) sent with every text request.
+# With stream=True every slide is its own streamed request (batch_size is
+# ignored): its image job starts the moment the keyword line arrives, and
+# on_partial(i, slide) receives the partly written slides, called from the
+# caller's thread about every STREAM_PREVIEW_INTERVAL seconds.
+# Text requests use the Gemini key api_key (see get_backend).
+# Returns (slides, per-stage stats).
+def generate_slides_concurrently(ppt_title, sections, audience, pexels_key=None, refresh=False,
+                                 max_workers=MAX_PARALLEL_SLIDES, batch_size=SLIDE_BATCH_SIZE,
+                                 image_workers=IMAGE_WORKERS, on_progress=None, initializer=None, initargs=(),
+                                 cancel_event=None, context=None, stream=False, on_partial=None, api_key=None):
+    results = [None] * len(sections)
+    if not sections:
+        return results, {}
+    slide_text = partial(generate_slide_text, api_key=api_key)
+    slide_batch = partial(generate_slide_batch, api_key=api_key)
+    workers = max(1, min(max_workers, len(sections)))
+    if cancel_event is not None:
+        initializer = _cancellable(cancel_event, initializer)
+    with ThreadPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as text_pool, \
+         ThreadPoolExecutor(max_workers=max(1, image_workers), initializer=initializer, initargs=initargs) as image_pool:
+        text_stage = PipelineStage("text", text_pool)
+        image_stage = PipelineStage("image", image_pool)
+        pending = {}
+        live = {}            # slide index -> latest partial slide, flushed to on_partial
+        early_images = {}    # slide index -> image job started mid-stream
+        live_lock = threading.Lock()
+
+        def streamed_text(i):
+            slide = {"image_local_path": None}   # shared with the image job, which fills in the picture
+            def keyword_ready(keyword):
+                slide['image_keyword'] = keyword
+                if pexels_key:
+                    early_images[i] = image_stage.submit(attach_image, slide, pexels_key)
+            def partial_ready(partial):
+                with live_lock:
+                    live[i] = {"slide_title": sections[i], **partial}
+            result = slide_text(
+                ppt_title, sections[i], audience, True, refresh, context,
+                stream=True, on_keyword=keyword_ready, on_partial=partial_ready if on_partial else None,
+            )
+            slide.update(result)
+            return slide
+
+        if stream:
+            for i in range(len(sections)):
+                pending[text_stage.submit(streamed_text, i)] = ("text", i)
+        elif batch_size > 1:
+            for start in range(0, len(sections), batch_size):
+                chunk = sections[start:start + batch_size]
+                pending[text_stage.submit(slide_batch, ppt_title, chunk, audience, True, refresh, context)] = ("batch", start)
+        else:
+            for i, sec in enumerate(sections):
+                pending[text_stage.submit(slide_text, ppt_title, sec, audience, True, refresh, context)] = ("text", i)
+
+        done = 0
+        def finish():
+            nonlocal done
+            done += 1
+            if on_progress:
+                on_progress(done, len(sections))
+
+        # Text is done, so the image keyword is known: hand the slide to the image stage
+        # right away (a streamed slide's image job may already be running)
+        def route(i, slide):
+            slide['slide_title'] = sections[i]
+            slide['gen_key'] = slide_gen_key(ppt_title, sections[i], audience)
+            results[i] = slide
+            early = early_images.pop(i, None)
+            if early is not None:
+                pending[early] = ("image", i)
+                return
+            slide['image_local_path'] = None
+            if pexels_key and slide.get('image_keyword'):
+                pending[image_stage.submit(attach_image, slide, pexels_key)] = ("image", i)
+            else:
+                finish()
+
+        while pending:
+            if cancel_event is not None and cancel_event.is_set():
+                for fut in pending:
+                    fut.cancel()
+                break
+            # Wake up periodically when cancellable so a cancel is noticed promptly, and
+            # more often while streaming to hand partial slides to the caller
+            timeout = STREAM_PREVIEW_INTERVAL if on_partial else 0.5 if cancel_event else None
+            finished, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if on_partial:
+                with live_lock:
+                    updates = dict(live)
+                    live.clear()
+                for i, partial_slide in sorted(updates.items()):
+                    on_partial(i, partial_slide)
+            for fut in finished:
+                kind, i = pending.pop(fut)
+                if kind == "batch":
+                    try:
+                        batch = fut.result()
+                    except Exception as e:
+                        log.warning("Batch generation failed, falling back to per-slide requests: %s", e)
+                        batch = [None] * len(sections[i:i + batch_size])
+                    for j, slide in enumerate(batch, start=i):
+                        if slide is None:
+                            pending[text_stage.submit(slide_text, ppt_title, sections[j], audience, True, refresh, context)] = ("text", j)
+                        else:
+                            route(j, slide)
+                elif kind == "text":
+                    try:
+                        slide = fut.result()
+                    except Exception as e:
+                        log.error("Error generating slide %d: %s", i + 1, e)
+                        results[i] = failed_slide(sections[i])
+                        early_images.pop(i, None)
+                        finish()
+                        continue
+                    route(i, slide)
+                else:
+                    # results[i] already holds the text; a failed image just leaves it without one
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        log.warning("Could not fetch image for slide %d: %s", i + 1, e)
+                    finish()
+    return results, {"text": text_stage.stats(), "image": image_stage.stats()}
+
+# ---------- INCREMENTAL REGENERATION ----------
+# The inputs a slide was generated from; a slide whose inputs are unchanged can
+# be reused as-is (its text, edits and image).
+def slide_gen_key(ppt_title, section_title, audience):
+    return [ppt_title, section_title, audience]
+
+# Matches existing slides to the requested sections by gen_key, so reordered or
+# untouched sections keep their content. Returns (slides, dirty): slides holds the
+# reusable slide per section or None, dirty lists the indexes that need generating.
+def plan_slides(existing, ppt_title, sections, audience):
+    by_key = {}
+    for s in existing or []:
+        if s and s.get('gen_key'):
+            by_key.setdefault(tuple(s['gen_key']), s)
+    slides, dirty = [], []
+    for i, sec in enumerate(sections):
+        slide = by_key.pop(tuple(slide_gen_key(ppt_title, sec, audience)), None)
+        slides.append(slide)
+        if slide is None:
+            dirty.append(i)
+    return slides, dirty
+
+# Generates only the slides at `indexes` (using sections[i] as their title) and
+# leaves every other slide untouched. A replaced slide's "rev" is bumped so UIs
+# can tell its content changed. Extra kwargs go to generate_slides_concurrently
+# (on_partial gets deck indexes). Slides a cancelled run did not finish keep
+# their previous content. Returns (slides, pipeline stats).
+def regenerate_slides(ppt_title, slides, sections, indexes, audience, **kwargs):
+    merged = list(slides)
+    if not indexes:
+        return merged, {}
+    if kwargs.get('on_partial'):
+        on_partial = kwargs['on_partial']
+        kwargs['on_partial'] = lambda j, slide: on_partial(indexes[j], slide)
+    fresh, stats = generate_slides_concurrently(ppt_title, [sections[i] for i in indexes], audience, **kwargs)
+    for i, slide in zip(indexes, fresh):
+        if slide is None:
+            continue
+        slide['rev'] = (merged[i] or {}).get('rev', 0) + 1
+        merged[i] = slide
+    return merged, stats
+
+# Fetches pictures for slides that have an image keyword but no picture yet (e.g.
+# text that was generated speculatively). Returns the image stage stats.
+def attach_missing_images(slides, pexels_key, image_workers=IMAGE_WORKERS, initializer=None, initargs=()):
+    todo = [s for s in slides if s and s.get('image_keyword') and not s.get('image_local_path')]
+    if not pexels_key or not todo:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, image_workers), initializer=initializer, initargs=initargs) as pool:
+        stage = PipelineStage("image", pool)
+        for fut in [stage.submit(attach_image, s, pexels_key) for s in todo]:
+            try:
+                fut.result()
+            except Exception as e:
+                log.warning("Could not fetch image: %s", e)
+    return stage.stats()
+
+# ---------- SPECULATIVE PREFETCH ----------
+# Outline requests a guess at the first `limit` slides of a `count`-slide deck
+# may make: one for a short deck, else the parts plus one per part the slides
+# can span. They are charged to the speculation budget like slides.
+def speculative_outline_requests(count, limit):
+    if count <= OUTLINE_PART_SIZE:
+        return 1
+    return 1 + -(-limit // OUTLINE_PART_SIZE)
+
+# The start of the outline the UI would propose: the same prompts as
+# generate_outline (so its replies are LLM cache hits once the user accepts), but
+# only for the parts the first `limit` slides fall in, stopping on cancel.
+# Returns (sections, parts) like generate_outline.
+def _speculative_outline(topic, ppt_title, count, audience, limit, refresh, cancel_event, api_key=None):
+    if count <= OUTLINE_PART_SIZE:
+        return generate_outline(topic, ppt_title, count, audience, refresh, api_key=api_key)
+    parts = generate_outline_parts(topic, ppt_title, count, audience, refresh, api_key=api_key)
+    sections = []
+    for i in range(min(len(parts), speculative_outline_requests(count, limit) - 1)):
+        if cancel_event.is_set() or len(sections) >= limit:
+            break
+        text = generate_cached(part_sections_prompt(ppt_title, audience, parts, i), refresh=refresh, api_key=api_key,
+                               validate=parse_part_sections)
+        sections += _fill_part(parts[i], parse_part_sections(text))
+    return sections, parts
+
+# Text for the first `limit` slides of the outline the UI would propose for
+# ppt_title. Text only: speculative Pexels traffic would eat into the (small)
+# hourly quota.
+def _speculative_slides(ppt_title, audience, count, limit, refresh, cancel_event, topic=None, api_key=None):
+    sections, parts = _speculative_outline(
+        topic or ppt_title, ppt_title, count, audience, limit, refresh, cancel_event, api_key=api_key,
+    )
+    if cancel_event.is_set() or not sections:
+        return []
+    slides, _ = generate_slides_concurrently(
+        ppt_title, sections[:limit], audience, refresh=refresh, cancel_event=cancel_event,
+        context=outline_context(parts), api_key=api_key,
+    )
+    return slides
+
+@lru_cache(maxsize=None)
+def get_prefetcher():
+    return SpeculativePrefetcher(
+        _speculative_slides,
+        max_jobs=SPECULATIVE_MAX_JOBS,
+        max_slides=SPECULATIVE_MAX_SLIDES,
+        slides_per_hour=SPECULATIVE_SLIDES_PER_HOUR,
+        overhead=speculative_outline_requests,
+    )
+
+# ---------- PPT CREATION ----------
+# Every slide of a deck as (kind, payload): the title slide, one bullet slide per
+# entry of slide_contents, and the closing slide.
+def deck_slide_specs(ppt_title, slide_contents):
+    return [("title", ppt_title)] + [("content", s) for s in slide_contents] + [("closing", None)]
+
+@timed("image_prep")
+def placed_image_path(img_path):
+    from image_prep import prepare_image
+    try:
+        return prepare_image(
+            img_path, os.path.join(IMAGE_STORE_DIR, "variants"),
+            width_in=IMAGE_WIDTH_IN, dpi=IMAGE_DPI, quality=IMAGE_JPEG_QUALITY,
+        )
+    except Exception as e:
+        log.warning("Could not downscale image, embedding original: %s", e)
+        return img_path
+
+# Appends one slide to `prs`. Returns (original, embedded) image paths when a
+# picture was placed, else None.
+def add_deck_slide(prs, kind, payload, attach_images=False):
+    from pptx.util import Inches
+
+    if kind == "title":
+        slide = prs.slides.add_slide(prs.slide_layouts[0])
+        slide.shapes.title.text = payload
+        try:
+            slide.placeholders[1].text = "Generated by AI PPT Wizard"
+        except Exception:
+            pass
+        return None
+
+    if kind == "closing":
+        closing = prs.slides.add_slide(prs.slide_layouts[1])
+        closing.shapes.title.text = "Conclusion & Next Steps"
+        try:
+            closing.shapes.placeholders[1].text_frame.text = "Summary and suggested next steps."
+        except Exception:
+            pass
+        return None
+
+    s = payload
+    slide_obj = prs.slides.add_slide(prs.slide_layouts[1])
+    slide_obj.shapes.title.text = s.get("slide_title", "")[:80]
+    body = slide_obj.shapes.placeholders[1].text_frame
+    body.clear()
+    bullets = s.get("bullets", [])
+    if bullets:
+        body.paragraphs[0].text = bullets[0]
+        for b in bullets[1:]:
+            p = body.add_paragraph()
+            p.text = b
+    try:
+        slide_obj.notes_slide.notes_text_frame.text = s.get("notes", "")
+    except Exception:
+        pass
+
+    img_path = s.get("image_local_path")
+    if attach_images and img_path and os.path.exists(img_path):
+        try:
+            placed_path = placed_image_path(img_path)
+            # python-pptx stores identical image bytes as a single media part
+            slide_obj.shapes.add_picture(placed_path, Inches(IMAGE_LEFT_IN), Inches(IMAGE_TOP_IN), width=Inches(IMAGE_WIDTH_IN))
+            return img_path, placed_path
+        except Exception as e:
+            log.warning("Could not add image: %s", e)
+    return None
+
+# Cached layout thumbnail (PNG path) of one deck slide, drawn with the geometry
+# create_pptx_bytes uses. A slide is only drawn again once its content changed.
+@timed("slide_preview")
+def slide_preview_path(kind, payload, attach_images=False):
+    from slide_preview import preview_path
+    try:
+        img_path = payload.get("image_local_path") if kind == "content" else None
+        image_path = placed_image_path(img_path) if attach_images and img_path and os.path.exists(img_path) else None
+        path, cached = preview_path(
+            kind, payload, os.path.join(IMAGE_STORE_DIR, "previews"), image_path,
+            width_px=PREVIEW_WIDTH_PX, picture=(IMAGE_LEFT_IN, IMAGE_TOP_IN, IMAGE_WIDTH_IN),
+        )
+    except Exception as e:
+        log.warning("Could not render slide preview: %s", e)
+        return None
+    get_metrics().count("slide_previews_total", result="cached" if cached else "rendered")
+    return path
+
+# Fills stats with deck_bytes plus original_image_bytes / embedded_image_bytes
+# summed over the distinct pictures in `images` (add_deck_slide results).
+def image_stats(stats, deck_bytes, images):
+    images = [im for im in images if im]
+    stats["deck_bytes"] = deck_bytes
+    stats["original_image_bytes"] = sum(os.path.getsize(p) for p in {im[0] for im in images} if os.path.exists(p))
+    stats["embedded_image_bytes"] = sum(os.path.getsize(p) for p in {im[1] for im in images} if os.path.exists(p))
+
+# If `stats` is a dict it receives deck_bytes, plus original_image_bytes and
+# embedded_image_bytes for the (deduplicated) pictures.
+@timed("pptx_build")
+def create_pptx_bytes(ppt_title, slide_contents, attach_images=False, stats=None, engine=None):
+    package, images = assemble_deck(deck_slide_specs(ppt_title, slide_contents), attach_images, engine)
+    get_metrics().count("deck_bytes_total", len(package))
+    if stats is not None:
+        image_stats(stats, len(package), images)
+    return io.BytesIO(package)
+
+# Writes a whole deck for `specs` (deck_slide_specs) with the given engine
+# (default PPTX_ENGINE). Returns (package bytes, add_deck_slide result per slide).
+# The fast writer falls back to python-pptx if it fails.
+def assemble_deck(specs, attach_images=False, engine=None):
+    from pptx import Presentation
+
+    if (engine or PPTX_ENGINE) == "fast":
+        try:
+            from ooxml_writer import write_deck
+            return write_deck(specs, attach_images)
+        except Exception as e:
+            log.warning("Fast PPTX writer failed, using python-pptx: %s", e)
+    prs = Presentation()
+    images = [add_deck_slide(prs, kind, payload, attach_images) for kind, payload in specs]
+    bio = io.BytesIO()
+    with span("pptx_save"):
+        prs.save(bio)
+    return bio.getvalue(), images
+
+
+# ---------- OUTLINE ----------
+def default_sections(topic, count=DEFAULT_SLIDES):
+    sections = [
+        f"Introduction to {topic}",
+        f"Importance of {topic}",
+        f"Key technologies in {topic}",
+        "Case studies",
+        "Conclusion & Recommendations"
+    ]
+    # Longer decks get numbered filler sections before the conclusion
+    extra = [f"{topic}: key point {i}" for i in range(1, max(0, count - len(sections)) + 1)]
+    return (sections[:-1] + extra + sections[-1:])[:count] if extra else sections[:count]
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "parts": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {"title": {"type": "string", "minLength": 1}, "slides": {"type": "integer", "minimum": 1}},
+                "required": ["title", "slides"],
+            },
+        },
+    },
+    "required": ["parts"],
+}
+SECTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {"sections": {"type": "array", "items": {"type": "string", "minLength": 1}, "minItems": 1}},
+    "required": ["sections"],
+}
+
+# Top level of a long outline: about count / OUTLINE_PART_SIZE parts with a slide
+# count each (rescaled so they add up to `count`). Returns [{"title", "slides"}].
+def generate_outline_parts(topic, ppt_title, count, audience, refresh=False, api_key=None):
+    n_parts = max(1, -(-count // OUTLINE_PART_SIZE))
+    system = "You are an expert presentation author. Reply with JSON only."
+    prompt = (
+        f"Plan the structure of a {count}-slide presentation titled '{ppt_title}' about \"{topic}\".\n"
+        f"Audience: {audience}\n"
+        f"Split it into {n_parts} consecutive parts that build on each other. For every part give a short title "
+        f"and how many slides it gets; the slide counts must add up to {count}.\n"
+        f"Return a JSON object matching this JSON schema:\n{json.dumps(OUTLINE_SCHEMA)}"
+    )
+    data = parse_outline_response(
+        generate_cached([system, prompt], refresh=refresh, api_key=api_key, validate=parse_outline_response)
+    )
+    parts = [{"title": p["title"].strip(), "slides": p["slides"]} for p in data["parts"]][:count]
+    # Rescale to exactly `count` slides, at least one per part
+    total = sum(p["slides"] for p in parts)
+    for p in parts:
+        p["slides"] = max(1, round(p["slides"] * count / total))
+    parts[-1]["slides"] += count - sum(p["slides"] for p in parts)
+    while parts[-1]["slides"] < 1:
+        parts.pop()
+        parts[-1]["slides"] += count - sum(p["slides"] for p in parts)
+    return parts
+
+# Shared context sent with every slide request of a long deck so that chunks
+# generated in parallel stay consistent with each other.
+def outline_context(parts):
+    if not parts or len(parts) < 2:
+        return None
+    lines, first = [], 1
+    for i, p in enumerate(parts, start=1):
+        n = p.get("slides") or len(p.get("sections", []))
+        lines.append(f"{i}. {p['title']} (slides {first}-{first + n - 1})")
+        first += n
+    return "Deck outline (parts):\n" + "\n".join(lines)
+
+# Prompt for the slide titles of one part, written with the whole outline in view.
+def part_sections_prompt(ppt_title, audience, parts, index):
+    part = parts[index]
+    system = "You are an expert presentation author. Reply with JSON only."
+    prompt = (
+        f"Presentation: '{ppt_title}'\nAudience: {audience}\n"
+        f"{outline_context(parts) or ''}\n"
+        f"Write exactly {part['slides']} slide titles for part {index + 1}, \"{part['title']}\". "
+        "Keep them specific, non-overlapping with the other parts, and in presentation order.\n"
+        f"Return a JSON object matching this JSON schema:\n{json.dumps(SECTIONS_SCHEMA)}"
+    )
+    return [system, prompt]
+
+def parse_outline_response(text):
+    data = parse_json_response(text)
+    jsonschema.validate(data, OUTLINE_SCHEMA)
+    return data
+
+def parse_part_sections(text):
+    data = parse_json_response(text)
+    jsonschema.validate(data, SECTIONS_SCHEMA)
+    return [t.strip() for t in data["sections"]]
+
+# Exactly part["slides"] titles for a part; gaps get numbered titles
+def _fill_part(part, titles):
+    titles = titles[:part["slides"]]
+    return titles + [f"{part['title']} ({k})" for k in range(len(titles) + 1, part["slides"] + 1)]
+
+# Hierarchical outline: parts first, then every part's slide titles as one batch.
+# Short decks (one part) skip the first step. Anything that fails falls back to
+# default_sections / numbered titles, so this always returns exactly `count`
+# sections. Returns (sections, parts) with parts = [{"title", "sections"}].
+@timed("outline")
+def generate_outline(topic, ppt_title, count, audience, refresh=False, max_workers=MAX_PARALLEL_SLIDES, api_key=None):
+    if count <= OUTLINE_PART_SIZE:
+        parts = [{"title": ppt_title, "slides": count}]
+    else:
+        try:
+            parts = generate_outline_parts(topic, ppt_title, count, audience, refresh, api_key=api_key)
+        except Exception as e:
+            log.warning("Outline generation failed, using the default outline: %s", e)
+            return default_sections(topic, count), []
+
+    replies = generate_cached_batch(
+        [part_sections_prompt(ppt_title, audience, parts, i) for i in range(len(parts))],
+        refresh=refresh, max_workers=max_workers, api_key=api_key, validate=parse_part_sections,
+    )
+    for part, reply in zip(parts, replies):
+        try:
+            if isinstance(reply, Exception):
+                raise reply
+            titles = parse_part_sections(reply)
+        except Exception as e:
+            if len(parts) == 1:
+                log.warning("Outline generation failed, using the default outline: %s", e)
+                return default_sections(topic, count), []
+            log.warning("Could not outline part '%s': %s", part["title"], e)
+            titles = []
+        part["sections"] = _fill_part(part, titles)
+        del part["slides"]
+    sections = [t for part in parts for t in part["sections"]]
+    return sections, parts
+
+# ---------- HEADLESS DECK BUILD ----------
+# One-call API: topic -> PPTX bytes. Missing title/sections are filled the same
+# way the UI does (first generated title, generated outline). Returns
+# (BytesIO, info) where info has the title, slide count and per-stage timings.
+@timed("deck_build")
+def build_deck(topic, audience=AUDIENCE_PRESETS[0], slides_count=DEFAULT_SLIDES, title=None,
+               sections=None, pexels_key=None, refresh=False, max_workers=MAX_PARALLEL_SLIDES, api_key=None):
+    timings = {}
+    started = time.perf_counter()
+    if not title:
+        titles = generate_titles(topic, count=8, refresh=refresh, api_key=api_key)
+        title = titles[0] if titles else topic
+    timings["titles_s"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    parts = []
+    if sections:
+        sections = list(sections)[:slides_count]
+    else:
+        sections, parts = generate_outline(topic, title, slides_count, audience, refresh, max_workers=max_workers,
+                                           api_key=api_key)
+    timings["outline_s"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    slide_contents, pipeline_stats = generate_slides_concurrently(
+        title, sections, audience, pexels_key=pexels_key, refresh=refresh, max_workers=max_workers,
+        context=outline_context(parts), api_key=api_key,
+    )
+    timings["slides_s"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    deck_stats = {}
+    bio = create_pptx_bytes(title, slide_contents, attach_images=bool(pexels_key), stats=deck_stats)
+    timings["pptx_s"] = time.perf_counter() - mark
+    timings["total_s"] = time.perf_counter() - started
+    info = {
+        "title": title,
+        "slides": len(slide_contents),
+        "timings": {k: round(v, 3) for k, v in timings.items()},
+        "pipeline": pipeline_stats,
+        **deck_stats,
+    }
+    return bio, info
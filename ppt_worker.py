@@ -0,0 +1,191 @@
+"""Worker processes that drain the background job queue (job_queue.py).
+
+    python ppt_worker.py -w 4
+
+Each worker process claims one job at a time, runs it with ppt_core and stores
+the result. Two kinds of job are understood:
+
+- "slides": regenerate_slides over a planned outline (what Step 3 of the UI
+  submits). Progress and the streaming preview are written back while it runs.
+- "pptx": build the .pptx for a finished outline. The deck is written under the
+  job's artifact directory; when the payload names a previous pptx job, only
+  the slides that changed since then are rebuilt (IncrementalDeck).
+
+The Streamlit app hands work to the queue whenever at least one worker is
+alive, so capacity grows by starting more workers (on this or any host that
+shares JOB_QUEUE_DIR, LLM_CACHE_PATH and IMAGE_STORE_DIR).
+
+Workers use the G_API_KEY and PEXELS_API_KEY of their own environment; keys
+never pass through the queue. The app therefore only queues slide jobs for
+sessions running on those same server keys.
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+
+import ppt_core
+from incremental_deck import IncrementalDeck
+
+log = logging.getLogger("ppt_worker")
+
+HEARTBEAT_SECONDS = 10
+# Partial slides kept in a job's live preview
+PREVIEW_SLIDES = 3
+
+
+def run_slides(queue, name, job_id, payload, cancel_event):
+    def on_progress(done, total):
+        if not queue.progress(job_id, name, done, total):
+            cancel_event.set()
+
+    live = {}
+    def on_partial(i, slide):
+        live.pop(i, None)
+        live[i] = slide
+        if not queue.progress(job_id, name, preview=list(live.items())[-PREVIEW_SLIDES:]):
+            cancel_event.set()
+
+    pexels_key = os.getenv("PEXELS_API_KEY") if payload.get("images") else None
+    if not queue.progress(job_id, name, 0, len(payload["dirty"])):
+        cancel_event.set()
+        return None
+    slides, pipeline_stats = ppt_core.regenerate_slides(
+        payload["title"],
+        payload["slides"],
+        payload["sections"],
+        payload["dirty"],
+        payload["audience"],
+        pexels_key=pexels_key,
+        refresh=payload.get("refresh", False),
+        context=payload.get("context"),
+        stream=payload.get("stream", False),
+        on_progress=on_progress,
+        on_partial=on_partial if payload.get("stream") else None,
+        cancel_event=cancel_event,
+    )
+    if cancel_event.is_set():
+        return None
+    missing = [slides[i] for i in payload.get("missing_images", []) if slides[i]]
+    if pexels_key and missing:
+        image_stats = ppt_core.attach_missing_images(missing, pexels_key)
+        if image_stats and not pipeline_stats:
+            pipeline_stats = {"image": image_stats}
+    return {"slides": slides, "pipeline_stats": pipeline_stats}
+
+
+def run_pptx(queue, name, job_id, payload, cancel_event):
+    deck = IncrementalDeck()
+    base = queue.get(payload["base_job"]) if payload.get("base_job") else None
+    if base and base["status"] == "done" and os.path.exists(base["result"]["path"]):
+        with open(base["result"]["path"], "rb") as f:
+            deck = IncrementalDeck.from_state(
+                f.read(), base["result"]["fingerprints"], base["result"]["images"], base["result"].get("media_index"),
+            )
+    stats = {}
+    bio = deck.build(payload["title"], payload["slides"], attach_images=payload.get("attach_images", False), stats=stats)
+    out_dir = queue.artifact_dir(job_id)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "deck.pptx")
+    with open(path, "wb") as f:
+        f.write(bio.getbuffer())
+    return {"path": path, "stats": stats, "fingerprints": deck.fingerprints, "images": deck.images,
+            "media_index": deck.media_index}
+
+
+HANDLERS = {"slides": run_slides, "pptx": run_pptx}
+
+
+def run_job(queue, name, job):
+    job_id, kind, payload = job
+    cancel_event = threading.Event()
+    finished = threading.Event()
+
+    # Long model calls report no progress, so liveness comes from a separate heartbeat
+    def heartbeat():
+        while not finished.wait(HEARTBEAT_SECONDS):
+            if not queue.heartbeat_worker(name, job_id):
+                cancel_event.set()
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    started = time.perf_counter()
+    try:
+        result = HANDLERS[kind](queue, name, job_id, payload, cancel_event)
+        # Cancelled by the user, or handed to another worker after a missed heartbeat:
+        # the job is no longer this worker's to finish
+        if cancel_event.is_set():
+            log.info("%s: %s job %s stopped after %.2fs", name, kind, job_id, time.perf_counter() - started)
+            return
+        if not queue.complete(job_id, name, result):
+            log.warning("%s: %s job %s finished after it was taken away; result dropped", name, kind, job_id)
+            return
+        log.info("%s: %s job %s done in %.2fs", name, kind, job_id, time.perf_counter() - started)
+    except Exception as e:
+        if cancel_event.is_set():
+            log.info("%s: %s job %s stopped: %s", name, kind, job_id, e)
+            return
+        log.exception("%s: %s job %s failed", name, kind, job_id)
+        queue.fail(job_id, name, e)
+    finally:
+        finished.set()
+
+
+def worker_loop(name, stop_event, poll_seconds, log_level):
+    logging.basicConfig(level=log_level, format="%(processName)s %(levelname)s %(name)s: %(message)s")
+    # The parent handles Ctrl-C and tells workers to stop after their current job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ppt_core.configure(os.getenv("G_API_KEY"))
+    queue = ppt_core.get_job_queue()
+    try:
+        while not stop_event.is_set():
+            queue.heartbeat_worker(name)
+            job = queue.claim(name, kinds=list(HANDLERS))
+            if job is None:
+                stop_event.wait(poll_seconds)
+                continue
+            run_job(queue, name, job)
+    finally:
+        queue.remove_worker(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run worker processes for the AI PPT Wizard job queue.")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 2, help="worker processes to start")
+    parser.add_argument("--poll", type=float, default=0.5, help="seconds between queue polls when idle")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=log_level, format="%(levelname)s %(name)s: %(message)s")
+    stop_event = multiprocessing.Event()
+    host = socket.gethostname()
+    procs = [
+        multiprocessing.Process(
+            target=worker_loop, name=f"worker-{i}",
+            args=(f"{host}:{os.getpid()}:{i}", stop_event, args.poll, log_level),
+        )
+        for i in range(max(1, args.workers))
+    ]
+    for p in procs:
+        p.start()
+    print(f"{len(procs)} workers draining {ppt_core.JOB_QUEUE_DIR}")
+
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        print("Stopping after current jobs ...")
+        stop_event.set()
+        for p in procs:
+            p.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Speculative background generation, capped so guesses cannot run up the bill.
+
+While the user is still reading titles, SpeculativePrefetcher generates slide
+content for the most likely choice (top title and its outline). The result
+is only a guess: the UI feeds it to plan_slides, which reuses whatever still
+matches the user's final title/sections/audience and regenerates the rest.
+A job that no longer matches is cancelled: requests it has not issued yet
+are dropped and whatever is in flight is discarded.
+
+Spend is bounded three ways: slides per job (a long deck is only speculated
+on up to its first max_slides slides), jobs running at once (excess
+requests are rejected, not queued), and slides started per rolling hour
+across the whole process. Requests a job makes besides its slides (its
+outline) count as slides against the per-job and hourly caps.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+class PrefetchJob:
+    def __init__(self, ppt_title, audience, count, future, cancel_event, budget_entry, prefetcher):
+        self.ppt_title = ppt_title
+        self.audience = audience
+        self.count = count
+        self.future = future
+        self.cancel_event = cancel_event
+        self.budget_entry = budget_entry
+        self._prefetcher = prefetcher
+
+    def matches(self, ppt_title, audience):
+        return self.ppt_title == ppt_title and self.audience == audience
+
+    def cancel(self):
+        self._prefetcher.discard(self)
+
+    # Generated slides, or [] if the job failed or was cancelled
+    def result(self, timeout=None):
+        try:
+            return self.future.result(timeout=timeout) or []
+        except (CancelledError, Exception):
+            return []
+
+
+class SpeculativePrefetcher:
+    def __init__(self, generate, max_jobs=2, max_slides=10, slides_per_hour=200, overhead=None):
+        # generate(ppt_title, audience, count, limit, refresh, cancel_event, **kwargs)
+        # -> the first `limit` slides of a `count`-slide deck; it should stop
+        # issuing requests once cancel_event is set. overhead(count, limit) is
+        # the most requests it makes on top of the slides.
+        self.generate = generate
+        self.overhead = overhead or (lambda count, limit: 0)
+        self.max_jobs = max_jobs
+        self.max_slides = max_slides
+        self.slides_per_hour = slides_per_hour
+        self.started = 0
+        self.rejected = 0
+        self.used = 0
+        self.discarded = 0
+        self._running = 0
+        self._spent = deque()   # (started_at, slides) within the last hour
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix="prefetch")
+
+    def _spent_last_hour(self, now):
+        while self._spent and now - self._spent[0][0] > 3600:
+            self._spent.popleft()
+        return sum(n for _, n in self._spent)
+
+    # Starts a speculative job for a `count`-slide deck, or returns None when a
+    # cap says no. Extra kwargs are passed on to generate.
+    def start(self, ppt_title, audience, count, refresh=False, **kwargs):
+        limit = min(count, self.max_slides)
+        while limit > 0 and limit + self.overhead(count, limit) > self.max_slides:
+            limit -= 1
+        if limit <= 0:
+            return None
+        cost = limit + self.overhead(count, limit)
+        now = time.time()
+        with self._lock:
+            if self._running >= self.max_jobs or self._spent_last_hour(now) + cost > self.slides_per_hour:
+                self.rejected += 1
+                return None
+            self._running += 1
+            budget_entry = (now, cost)
+            self._spent.append(budget_entry)
+            self.started += 1
+        cancel_event = threading.Event()
+        future = self._pool.submit(self.generate, ppt_title, audience, count, limit, refresh, cancel_event, **kwargs)
+        future.add_done_callback(self._job_done)
+        return PrefetchJob(ppt_title, audience, count, future, cancel_event, budget_entry, self)
+
+    def _job_done(self, future):
+        with self._lock:
+            self._running -= 1
+
+    def claim(self, job):
+        with self._lock:
+            self.used += 1
+        return job.result()
+
+    # A job that has not started yet is dropped and its budget refunded; a
+    # running one stops issuing requests, and what it already has in flight
+    # still lands in the LLM cache.
+    def discard(self, job):
+        job.cancel_event.set()
+        refunded = job.future.cancel()
+        with self._lock:
+            self.discarded += 1
+            if refunded and job.budget_entry in self._spent:
+                self._spent.remove(job.budget_entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "rejected": self.rejected,
+                "used": self.used,
+                "discarded": self.discarded,
+                "running": self._running,
+                "slides_last_hour": self._spent_last_hour(time.time()),
+            }
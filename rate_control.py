@@ -0,0 +1,230 @@
+"""Process-wide rate control for the Gemini and Pexels APIs.
+
+One RateController exists per (service, API key) and every session, worker
+thread and speculative job of the process goes through it, so a key's quota
+is shared rather than multiplied by the number of users. A controller combines:
+
+- a token bucket for the request-rate quota. A 429 pauses the whole bucket for
+  the server's Retry-After, so all callers back off together.
+- an adaptive concurrency limit (AIMD). It grows by about one slot per window
+  of fast successes and halves on a 429 or another retryable status (5xx).
+  It shrinks by a smaller factor when latency rises above the target (at most
+  once per decrease_interval). Other failures never grow it.
+- retries with full-jitter exponential backoff for throttling, 5xx and
+  connection errors. Other errors are raised at once.
+
+Limits are per process: with several ppt_worker.py / ppt_batch.py processes on
+one key, give each its share of the quota through the environment.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+THROTTLE_STATUS = (429,)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimited(Exception):
+    # Raised by callers for a throttled or transiently failing HTTP response
+    def __init__(self, message, status=429, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class QuotaWaitExceeded(Exception):
+    pass
+
+
+def error_status(e):
+    for attr in ("status", "code", "status_code"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+def is_throttled(e):
+    # google.api_core reports quota errors as ResourceExhausted (code 429)
+    return error_status(e) in THROTTLE_STATUS or type(e).__name__ == "ResourceExhausted"
+
+def is_retryable(e):
+    if isinstance(e, QuotaWaitExceeded):
+        return False
+    if is_throttled(e) or error_status(e) in RETRY_STATUS:
+        return True
+    return type(e).__name__ in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout",
+                                "ServiceUnavailable", "DeadlineExceeded", "InternalServerError")
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, burst):
+        self.rate = rate_per_second
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Takes a token, sleeping until one is available. Raises QuotaWaitExceeded
+    # instead when that would take longer than max_wait seconds.
+    def acquire(self, max_wait=None):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate > 0 else 60.0)
+            if max_wait is not None and waited + delay > max_wait:
+                raise QuotaWaitExceeded(f"request quota exhausted (next slot in {delay:.0f}s)")
+            time.sleep(delay)
+            waited += delay
+
+    # Stops handing out tokens for `seconds` (e.g. the Retry-After of a 429)
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial, min_limit=1, max_limit=32, latency_target=None, backoff=0.5,
+                 latency_backoff=0.9, decrease_interval=1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    # throttled: the request hit a quota or overload (halves the limit);
+    # error: it failed some other way, which is no reason to allow more
+    def release(self, latency=None, throttled=False, error=False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            slow = latency is not None and self.latency_target and latency > self.latency_target
+            if throttled or slow:
+                # Requests already in flight report the same congestion; react once
+                if now - self._last_decrease >= self.decrease_interval:
+                    factor = self.backoff if throttled else self.latency_backoff
+                    self.limit = max(self.min_limit, self.limit * factor)
+                    self._last_decrease = now
+            elif latency is not None and not error:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class RateController:
+    def __init__(self, name, rate_per_second, burst, concurrency, max_concurrency=None, latency_target=None,
+                 max_attempts=4, base_delay=0.5, max_delay=30.0, max_wait=None):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.limiter = AdaptiveLimiter(
+            concurrency, max_limit=max_concurrency or concurrency * 4, latency_target=latency_target,
+        )
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.quota_wait = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _backoff(self, attempt, e):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = getattr(e, "retry_after", None)
+        if is_throttled(e):
+            self.bucket.pause(retry_after if retry_after is not None else delay)
+        return max(delay, retry_after or 0)
+
+    # One request: a token, then a concurrency slot held until the block ends.
+    # The block's duration and the error it raised (if any) feed the limiter.
+    @contextmanager
+    def slot(self):
+        waited = self.bucket.acquire(self.max_wait)
+        self._count(calls=1, quota_wait=waited)
+        self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            throttled = is_throttled(e)
+            if throttled:
+                self._count(throttled=1)
+            # 5xx means the upstream is overloaded too: back off as for a 429
+            congested = throttled or error_status(e) in RETRY_STATUS
+            self.limiter.release(time.monotonic() - started, throttled=congested, error=True)
+            raise
+        self.limiter.release(time.monotonic() - started)
+
+    def _attempts(self):
+        for attempt in range(self.max_attempts):
+            yield attempt, attempt == self.max_attempts - 1
+
+    # fn(*args, **kwargs) under rate control, retried while the error is retryable
+    def call(self, fn, *args, **kwargs):
+        for attempt, last in self._attempts():
+            try:
+                with self.slot():
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if last or not is_retryable(e):
+                    self._count(failures=1)
+                    raise
+                self._count(retries=1)
+                time.sleep(self._backoff(attempt, e))
+
+    # Like call for a function returning an iterable (a streamed response). The
+    # slot is held until the stream is exhausted; the request is only retried
+    # while nothing has been yielded yet.
+    def stream(self, fn, *args, **kwargs):
+        for attempt, last in self._attempts():
+            started = False
+            try:
+                with self.slot():
+                    for item in fn(*args, **kwargs):
+                        started = True
+                        yield item
+                return
+            except Exception as e:
+                if started or last or not is_retryable(e):
+                    self._count(failures=1)
+                    raise
+                self._count(retries=1)
+                time.sleep(self._backoff(attempt, e))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "quota_wait_s": round(self.quota_wait, 1),
+                "concurrency_limit": round(self.limiter.limit, 1),
+                "in_flight": self.limiter.in_flight,
+            }
@@ -0,0 +1,161 @@
+"""Per-session storage for large blobs (exported decks) with a memory budget.
+
+Each browser session gets a SessionArtifacts, looked up by session id through
+the process-wide ArtifactManager. Blobs stay in memory while the session's
+total is under its budget. Past the budget, the least recently used blobs
+spill to <root>/<session id>/ and are read back from there on demand. A
+session that has not been touched for idle_seconds is evicted: its memory is
+dropped and its directory removed. Directories left by earlier processes are
+removed the same way once they are older than idle_seconds.
+
+Eviction only loses cached work. Callers treat a missing blob like a first
+build, so an evicted session that comes back keeps working.
+"""
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionArtifacts:
+    def __init__(self, manager, session_id):
+        self.manager = manager
+        self.session_id = session_id
+        self.dir = os.path.join(manager.root, session_id)
+        self.memory = OrderedDict()   # name -> bytes, least recently used first
+        self.on_disk = {}             # name -> size of the spilled file
+        self.last_used = time.time()
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def put(self, name, data):
+        data = bytes(data)
+        with self.manager._lock:
+            self.manager._touch(self)
+            self._remove_file(name)
+            self.memory.pop(name, None)
+            self.memory[name] = data
+            self._spill()
+
+    # The blob, or None if it was never stored or has been evicted
+    def get(self, name):
+        with self.manager._lock:
+            self.manager._touch(self)
+            if name in self.memory:
+                self.memory.move_to_end(name)
+                return self.memory[name]
+            if name not in self.on_disk:
+                return None
+            try:
+                with open(self._path(name), "rb") as f:
+                    return f.read()
+            except OSError:
+                self.on_disk.pop(name, None)
+                return None
+
+    def drop(self, name):
+        with self.manager._lock:
+            self.memory.pop(name, None)
+            self._remove_file(name)
+
+    def memory_bytes(self):
+        return sum(len(b) for b in self.memory.values())
+
+    # Caller holds the manager lock
+    def _spill(self):
+        total = self.memory_bytes()
+        while total > self.manager.session_budget and self.memory:
+            name, data = self.memory.popitem(last=False)
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = self._path(name) + ".part"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(name))
+            self.on_disk[name] = len(data)
+            self.manager.spilled += 1
+            total -= len(data)
+
+    def _remove_file(self, name):
+        if self.on_disk.pop(name, None) is not None:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _clear(self):
+        self.memory.clear()
+        self.on_disk.clear()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class ArtifactManager:
+    def __init__(self, root, session_budget=32 * 1024 * 1024, idle_seconds=3600, sweep_interval=60, on_sweep=None):
+        self.root = root
+        self.session_budget = session_budget
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        # Extra cleanup run with every sweep (e.g. pruning derived image files)
+        self.on_sweep = on_sweep
+        self.spilled = 0
+        self.evicted = 0
+        self._sessions = {}
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    # The session's artifacts, created on first use. Also marks it active and
+    # evicts idle sessions every sweep_interval seconds.
+    def session(self, session_id):
+        with self._lock:
+            artifacts = self._sessions.get(session_id)
+            if artifacts is None:
+                artifacts = SessionArtifacts(self, session_id)
+            self._touch(artifacts)
+        self.maybe_sweep()
+        return artifacts
+
+    def _touch(self, artifacts):
+        artifacts.last_used = time.time()
+        self._sessions[artifacts.session_id] = artifacts
+
+    def maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        cutoff = now - self.idle_seconds
+        with self._lock:
+            for session_id, artifacts in list(self._sessions.items()):
+                if artifacts.last_used < cutoff:
+                    artifacts._clear()
+                    del self._sessions[session_id]
+                    self.evicted += 1
+            live = set(self._sessions)
+        # Leftovers of sessions from earlier processes
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name not in live and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+        if self.on_sweep:
+            self.on_sweep()
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            return {
+                "sessions": len(sessions),
+                "memory_bytes": sum(s.memory_bytes() for s in sessions),
+                "disk_bytes": sum(sum(s.on_disk.values()) for s in sessions),
+                "spilled": self.spilled,
+                "evicted": self.evicted,
+            }
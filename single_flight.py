@@ -0,0 +1,132 @@
+"""Process-wide single-flight: concurrent identical requests share one call.
+
+The LLM cache and the image store only help once a response has arrived.
+During a burst (several users on the same topic, many slides whose image
+keyword is "teamwork") every identical request that starts before then
+would go out on its own. SingleFlight.do(key, fn) runs fn for the first
+caller of a key, the leader. Every caller that arrives while that call is in
+flight waits for its result or exception instead of making a second call.
+
+Waiters have a timeout and can be cancelled, by an explicit event or by the
+one set for their thread with set_thread_cancel_event. Giving up only affects
+that waiter: the leader's call carries on and the other waiters still get its
+result. The leader runs fn inline, exactly as without coalescing. A leader
+that stops without a result (e.g. an abandoned stream) releases its waiters
+with FlightAbandoned, so they can make the call themselves.
+"""
+import threading
+import time
+
+# How often a cancellable waiter checks its cancel event (seconds)
+CANCEL_POLL = 0.1
+
+_local = threading.local()
+
+
+class FlightTimeout(TimeoutError):
+    pass
+
+
+class FlightCancelled(Exception):
+    pass
+
+
+class FlightAbandoned(Exception):
+    pass
+
+
+# Cancel event for waits on the calling thread that are not given one
+# explicitly (e.g. set by a pool initializer for a cancellable job)
+def set_thread_cancel_event(event):
+    _local.cancel_event = event
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    # `timeout` is the default wait for waiters (None = no limit). on_event(name)
+    # is called with "leader", "coalesced", "timeout", "cancelled" or "abandoned".
+    def __init__(self, name, timeout=None, on_event=None):
+        self.name = name
+        self.timeout = timeout
+        self.on_event = on_event
+        self.counts = {"leader": 0, "coalesced": 0, "timeout": 0, "cancelled": 0, "abandoned": 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _event(self, name):
+        with self._lock:
+            self.counts[name] += 1
+        if self.on_event:
+            self.on_event(name)
+
+    # Joins the flight for key, starting it if there is none. Returns
+    # (flight, is_leader); the leader must end it with finish().
+    def begin(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.waiters += 1
+        self._event("leader" if leader else "coalesced")
+        return flight, leader
+
+    # Publishes the leader's result (or error) to the waiters; abandoned=True
+    # releases them with FlightAbandoned instead.
+    def finish(self, key, flight, result=None, error=None, abandoned=False):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result, flight.error, flight.abandoned = result, error, abandoned
+        flight.done.set()
+
+    def wait(self, flight, timeout=None, cancel_event=None):
+        timeout = self.timeout if timeout is None else timeout
+        cancel_event = cancel_event or getattr(_local, "cancel_event", None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self._event("timeout")
+                raise FlightTimeout(f"{self.name}: gave up waiting for an identical request after {timeout:g}s")
+            step = remaining if cancel_event is None else min(CANCEL_POLL, remaining or CANCEL_POLL)
+            if flight.done.wait(step):
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                self._event("cancelled")
+                raise FlightCancelled(f"{self.name}: cancelled while waiting for an identical request")
+        if flight.abandoned:
+            self._event("abandoned")
+            raise FlightAbandoned(f"{self.name}: the identical request it waited for was abandoned")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    # fn(*args, **kwargs), or the result of the identical call already in flight
+    def do(self, key, fn, *args, timeout=None, cancel_event=None, **kwargs):
+        flight, leader = self.begin(key)
+        if not leader:
+            return self.wait(flight, timeout, cancel_event)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        except BaseException:
+            self.finish(key, flight, abandoned=True)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "in_flight": len(self._flights)}
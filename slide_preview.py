@@ -0,0 +1,186 @@
+"""Slide thumbnails drawn locally with Pillow, for checking layout without exporting.
+
+render_preview() lays a slide out the way create_pptx_bytes does. It uses the
+placeholder boxes of the default template's layouts, the template master's
+title and body text sizes, bullets with the master's indent, and the picture
+at (IMAGE_LEFT_IN, IMAGE_TOP_IN), IMAGE_WIDTH_IN wide. The picture is drawn
+over the body text, as PowerPoint shows it. It is an approximation: no theme
+fonts and no autofit. Text that runs past its placeholder is outlined in red.
+
+preview_path() caches each thumbnail as a PNG named by a hash of everything
+the drawing depends on. An unchanged slide costs one file lookup; only edited
+slides are drawn again.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Bump when the drawing changes so cached thumbnails are not reused
+RENDER_VERSION = 1
+EMU_PER_INCH = 914400
+EMU_PER_PT = 12700
+# Text sizes and bullet indent of the default template's master
+TITLE_PT, BODY_PT = 44, 32
+BULLET_INDENT_EMU = 342900
+LINE_SPACING = 1.2
+TEXT_COLOR, BULLET_COLOR, OVERFLOW_COLOR = (0, 0, 0), (60, 60, 60), (220, 40, 40)
+
+
+class Geometry:
+    def __init__(self):
+        from pptx import Presentation
+
+        prs = Presentation()
+        self.width, self.height = prs.slide_width, prs.slide_height
+        boxes = lambda layout: {ph.placeholder_format.idx: (ph.left, ph.top, ph.width, ph.height) for ph in layout.placeholders}
+        self.title_slide = boxes(prs.slide_layouts[0])
+        self.content_slide = boxes(prs.slide_layouts[1])
+
+
+# Placeholder boxes (EMU) of the layouts add_deck_slide uses, read from
+# python-pptx's default template once
+@lru_cache(maxsize=None)
+def geometry():
+    return Geometry()
+
+
+@lru_cache(maxsize=None)
+def _font(px):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", px)
+    except OSError:
+        return ImageFont.load_default(size=px)
+
+
+def _wrap(text, font, width):
+    lines = []
+    for paragraph in text.replace("\v", "\n").split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+class _Canvas:
+    def __init__(self, width_px):
+        g = geometry()
+        self.scale = width_px / g.width
+        self.image = Image.new("RGB", (width_px, max(1, round(g.height * self.scale))), "white")
+        self.draw = ImageDraw.Draw(self.image)
+
+    def px(self, emu):
+        return round(emu * self.scale)
+
+    def box(self, box):
+        left, top, width, height = (self.px(v) for v in box)
+        return left, top, width, height
+
+    # Draws the lines of text in box; returns the y just below the last line
+    def text_block(self, lines, box, pt, center=False, bullet=False, y=None):
+        left, top, width, height = self.box(box)
+        font = _font(max(6, self.px(pt * EMU_PER_PT)))
+        step = round(font.size * LINE_SPACING)
+        indent = self.px(BULLET_INDENT_EMU) if bullet else 0
+        y = top if y is None else y
+        for i, line in enumerate(lines):
+            x = left + indent
+            if center:
+                x = left + (width - font.getlength(line)) / 2
+            if bullet and i == 0:
+                self.draw.text((left, y), "•", font=font, fill=BULLET_COLOR)
+            self.draw.text((x, y), line, font=font, fill=TEXT_COLOR)
+            y += step
+        return y
+
+    def title(self, text, box, pt):
+        left, top, width, height = self.box(box)
+        font = _font(max(6, self.px(pt * EMU_PER_PT)))
+        lines = _wrap(text, font, width)
+        # Titles are anchored at the middle of their box
+        used = len(lines) * round(font.size * LINE_SPACING)
+        y = top + (height - used) / 2
+        self.text_block(lines, box, pt, center=True, y=y)
+        if used > height:
+            self.outline(box)
+
+    def outline(self, box):
+        left, top, width, height = self.box(box)
+        self.draw.rectangle((left, top, left + width - 1, top + height - 1), outline=OVERFLOW_COLOR, width=2)
+
+
+# Thumbnail of one deck slide (kind/payload as in ppt_core.deck_slide_specs).
+# image_path is the picture as embedded (already downscaled), or None.
+def render_preview(kind, payload, image_path=None, width_px=480, picture=(6.5, 1.0, 3.5)):
+    g = geometry()
+    canvas = _Canvas(width_px)
+    if kind == "title":
+        canvas.title(payload or "", g.title_slide[0], TITLE_PT)
+        canvas.text_block(["Generated by AI PPT Wizard"], g.title_slide[1], BODY_PT, center=True)
+        return canvas.image
+    if kind == "closing":
+        canvas.title("Conclusion & Next Steps", g.content_slide[0], TITLE_PT)
+        canvas.text_block(["Summary and suggested next steps."], g.content_slide[1], BODY_PT, bullet=True)
+        return canvas.image
+
+    canvas.title(payload.get("slide_title", "")[:80], g.content_slide[0], TITLE_PT)
+    body = g.content_slide[1]
+    left, top, width, height = canvas.box(body)
+    font = _font(max(6, canvas.px(BODY_PT * EMU_PER_PT)))
+    y = top
+    for bullet in payload.get("bullets", []):
+        lines = _wrap(bullet, font, width - canvas.px(BULLET_INDENT_EMU))
+        y = canvas.text_block(lines, body, BODY_PT, bullet=True, y=y) + round(font.size * 0.2)
+    if y > top + height:
+        canvas.outline(body)
+
+    if image_path:
+        left_in, top_in, width_in = picture
+        with Image.open(image_path) as img:
+            pic_w = canvas.px(width_in * EMU_PER_INCH)
+            pic_h = max(1, round(pic_w * img.height / img.width))
+            img.draft("RGB", (pic_w, pic_h))
+            canvas.image.paste(img.convert("RGB").resize((pic_w, pic_h)), (canvas.px(left_in * EMU_PER_INCH), canvas.px(top_in * EMU_PER_INCH)))
+    return canvas.image
+
+
+def preview_key(kind, payload, image_path, width_px, picture):
+    if kind == "content":
+        # Variant and image store file names are content-derived, and their mtime
+        # marks last use, so path and size identify the picture
+        img_sig = [image_path, os.path.getsize(image_path)] if image_path else None
+        data = [kind, payload.get("slide_title", "")[:80], payload.get("bullets", []), img_sig]
+    else:
+        data = [kind, payload]
+    raw = json.dumps([RENDER_VERSION, width_px, list(picture)] + data, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# Path of the cached PNG thumbnail for the slide in out_dir, drawn only when
+# no thumbnail exists for the slide's current content. Returns (path, cached).
+def preview_path(kind, payload, out_dir, image_path=None, width_px=480, picture=(6.5, 1.0, 3.5)):
+    path = os.path.join(out_dir, preview_key(kind, payload, image_path, width_px, picture) + ".png")
+    if os.path.exists(path):
+        # mtime doubles as last use for pruning
+        os.utime(path)
+        return path, True
+    image = render_preview(kind, payload, image_path, width_px, picture)
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, "PNG", optimize=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, False
@@ -1,14 +1,22 @@
+import time
+_rerun_started = time.perf_counter()
+
 import os
-import re
-import io
-import requests
+import json
+import logging
 import streamlit as st
-from pptx import Presentation
-from pptx.util import Inches
 from dotenv import load_dotenv
-import google.generativeai as genai
 import streamlit.components.v1 as components
-import tempfile
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from ppt_core import (
+    DEFAULT_SLIDES, AUDIENCE_PRESETS, get_llm_cache, safe_filename,
+    MAX_SLIDES, generate_titles, generate_outline, outline_context, plan_slides, regenerate_slides,
+    attach_missing_images, get_prefetcher, get_job_queue, rate_control_stats, get_metrics,
+    get_artifact_manager, artifact_stats, LLM_BACKEND, LLM_TITLE_BACKEND,
+    image_candidates, choose_image, prefetch_candidates, candidate_thumbnails, slide_preview_path,
+    single_flight_stats,
+)
+from incremental_deck import IncrementalDeck
 
 
 # --- SESSION STATE DEFAULTS ---
@@ -25,126 +33,86 @@ if "slide_content" not in st.session_state:
 load_dotenv()
 
 # ---------- CONFIG ----------
-DEFAULT_SLIDES = 5
-AUDIENCE_PRESETS = ["Executive", "Technical", "Marketing", "Educational"]
 MAX_WORDS_PER_SLIDE = 70
-PEXELS_SEARCH_URL = "https://api.pexels.com/v1/search"
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "style.css")
+# Script time per rerun (every keystroke/click); slower reruns are logged
+RERUN_BUDGET_MS = int(os.getenv("RERUN_BUDGET_MS", "150"))
+# Step 4 renders this many slide editors at a time
+SLIDES_PER_PAGE = int(os.getenv("SLIDES_PER_PAGE", "5"))
+# Longer outlines are edited in one text area instead of one field per section
+SECTION_FIELDS_MAX = int(os.getenv("SECTION_FIELDS_MAX", "30"))
+# Up to this many slides are streamed with a live preview; more go out as batched requests
+STREAM_MAX_SLIDES = int(os.getenv("STREAM_MAX_SLIDES", "20"))
+# Slides shown at once in the streaming preview
+STREAM_PREVIEW_SLIDES = 3
+# "auto": hand generation and PPTX builds to ppt_worker.py processes whenever one
+# is alive; "off": always run them in the Streamlit process
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE", "auto")
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+# The sidebar's storage figures (SQLite counts, directory scans) are shared by
+# all sessions and recomputed at most this often (seconds)
+SIDEBAR_STATS_TTL = float(os.getenv("SIDEBAR_STATS_TTL", "15"))
+
+# Large per-session blobs (the exported deck) live in the session's artifact
+# store: in memory up to its budget, then on disk, and gone once it idles out.
+# Looking it up on every rerun keeps an active session from being evicted.
+def session_artifacts():
+    return get_artifact_manager().session(get_script_run_ctx().session_id)
+
+session_artifacts()
+
+# Route ppt_core warnings/errors to the Streamlit session whose thread logged them
+# (generation worker threads get the script context attached, see Step 3).
+class StreamlitLogHandler(logging.Handler):
+    def emit(self, record):
+        if get_script_run_ctx() is None:
+            return
+        if record.levelno >= logging.ERROR:
+            st.error(self.format(record))
+        else:
+            st.warning(self.format(record))
+
+core_log = logging.getLogger("ppt_core")
+if not any(h.get_name() == "streamlit" for h in core_log.handlers):
+    _handler = StreamlitLogHandler(logging.WARNING)
+    _handler.set_name("streamlit")
+    core_log.addHandler(_handler)
 
 # ---------- STREAMLIT PAGE STYLE ----------
 st.set_page_config(page_title="AI PPT Wizard", layout="wide")
-st.markdown("""
-    <style>
-    .stApp { background: linear-gradient(rgba(6,8,12,0.92), rgba(6,8,12,0.92)); color: #e6eef8 !important; }
-    .stButton>button { background-color:#2563EB !important; color: white !important; border: none !important; }
-    .stSidebar { background-color:#071233 !important; color: #e6eef8 !important; }
-    .stTextInput input, textarea { background-color:#0c1320 !important; color: #e6eef8 !important; border:1px solid #233554 !important; }
-    .gradient-title {
-      background: linear-gradient(90deg, #6ee7f9, #22d3ee, #60a5fa);
-      -webkit-background-clip: text; -webkit-text-fill-color: transparent;
-      font-weight: 900; letter-spacing: .3px; text-shadow: 0 0 .7px rgba(255,255,255,.15);
-    }
-
-    /* High-contrast “card” for sidebar sections */
-    .sidebar-card {
-      background:#0c1320; border:1px solid #233554; border-radius:12px;
-      padding:14px; color:#e6eef8 !important; opacity:1 !important;
-    }
-    .sidebar-card h4 { margin:0 0 8px 0; font-weight:800; }
-    .sidebar-card ol { margin:8px 0 0 18px; }
-    .sidebar-card li { margin:4px 0; }
-    .sidebar-card a { color:#8bd3ff; text-decoration:underline; }
-    .badge-ok {
-      display:inline-block; padding:2px 8px; border-radius:999px;
-      background:#0f5132; color:#d1fae5; font-size:12px; margin-left:6px;
-    }
-    
-    /* Labels for inputs, selects, sliders */
-    .stTextInput label, .stSelectbox label, .stSlider label, .stTextArea label {
-    color: #eaf2ff !important;          /* brighter */
-    font-weight: 700 !important;         /* bold */
-    letter-spacing: .2px;
-    }
-
-    /* Input & textarea fields */
-    .stTextInput input, textarea, .stTextArea textarea {
-    background-color: #0e1629 !important;
-    color: #f7fbff !important;           /* bright text */
-    border: 1px solid #3a4a6b !important;
-    font-weight: 600 !important;
-    }
-
-    /* Placeholder text */
-    .stTextInput input::placeholder,
-    .stTextArea textarea::placeholder {
-    color: #b9c7e6 !important;           /* lighter, still readable */
-    opacity: 1 !important;
-    }
-
-    /* Select (dropdown) text container */
-    div[data-baseweb="select"] {
-    background-color: #0e1629 !important;
-    color: #f7fbff !important;
-    border: 1px solid #3a4a6b !important;
-    font-weight: 600 !important;
-    }
-
-    /* Select menu items */
-    div[role="listbox"] > div {
-    color: #eaf2ff !important;
-    }
-
-    /* Slider numbers and ticks */
-    .css-1siy2j7, .css-q8sbsg, .stSlider .st-c7,
-    .stSlider [data-baseweb="slider"] {
-    color: #eaf2ff !important;
-    font-weight: 700 !important;
-    }
-
-    /* General small text (helper/descriptions) */
-    .small, .stMarkdown p, .stCaption, .stAlert p {
-    color: #dfe9ff !important;
-    }
-                
-    /* ===== Force bright headers & labels (high priority) ===== */
-    .stMarkdown h1, .stMarkdown h2, .stMarkdown h3,
-    h1, h2, h3 {
-    color: #eaf2ff !important;          /* bright */
-    text-shadow: 0 0 1px rgba(255,255,255,.10);
-    font-weight: 900 !important;
-    }
-
-    /* Step section header style */
-    .step-header {
-    color: #eaf2ff !important;          /* bright */
-    font-weight: 900 !important;
-    letter-spacing: .2px;
-    border-left: 6px solid #22d3ee;
-    padding-left: 12px;
-    margin: 8px 0 16px 0;
-    line-height: 1.25;
-    }
-
-    /* Labels above inputs */
-    label, .stTextInput label, .stSelectbox label, .stSlider label, .stTextArea label {
-    color: #eaf2ff !important;
-    opacity: 1 !important;
-    font-weight: 700 !important;
-    }
-
-    /* Inputs themselves (text is sometimes dim without this) */
-    input, textarea, [data-baseweb="select"] * {
-    color: #f7fbff !important;
-    }
+# style.css is read once per process and injected into the page <head> once per
+# browser session (the same components.html route as the popup below). Elements
+# emitted with st.markdown are dropped unless re-sent on every rerun; a <style>
+# node in <head> survives reruns, so later reruns send no CSS at all.
+@st.cache_resource(show_spinner=False)
+def load_stylesheet():
+    with open(STYLESHEET_PATH, encoding="utf-8") as f:
+        return f.read()
+
+if 'css_injected' not in st.session_state:
+    st.session_state['css_injected'] = True
+    components.html(
+        "<script>"
+        "const doc = window.parent.document;"
+        "if (!doc.getElementById('ppt-wizard-css')) {"
+        "  const style = doc.createElement('style'); style.id = 'ppt-wizard-css';"
+        f"  style.textContent = {json.dumps(load_stylesheet())}; doc.head.appendChild(style);"
+        "}"
+        "</script>",
+        height=0,
+    )
 
-    /* Placeholder text (brighter) */
-    input::placeholder, textarea::placeholder {
-    color: #cbd8ff !important;
-    opacity: 1 !important;
+# ---------- SIDEBAR ----------
+# Every rerun (each keystroke/click) redraws the sidebar; only the in-memory
+# counters are read live, the rest comes from this TTL cache.
+@st.cache_data(ttl=SIDEBAR_STATS_TTL, show_spinner=False)
+def storage_stats():
+    return {
+        "llm_cache": get_llm_cache().stats(),
+        "job_queue": get_job_queue().stats() if JOB_QUEUE_MODE != "off" else None,
+        "artifacts": artifact_stats(),
     }
-    </style>
-""", unsafe_allow_html=True)
 
-# ---------- SIDEBAR ----------
 with st.sidebar:
     st.title("⚡ AI PPT Wizard")
 
@@ -158,19 +126,18 @@ with st.sidebar:
     if gemini_input:
         st.session_state["gemini_key"] = gemini_input.strip()
 
+    # Passed to every generation call rather than set process-wide, so concurrent
+    # sessions never use each other's key
     G_API_KEY = st.session_state.get("gemini_key") or os.getenv("G_API_KEY")
 
-    if not G_API_KEY:
+    if "gemini" not in (LLM_BACKEND, LLM_TITLE_BACKEND):
+        # Offline demo / load test: the local template backend needs no key
+        st.markdown(f"**LLM backend** <span class='badge-ok'>{LLM_BACKEND}</span>", unsafe_allow_html=True)
+    elif not G_API_KEY:
         st.error("⚠ No Gemini API key found. Enter a key above (or set it in your environment) to generate slides.")
         st.stop()
     else:
-        try:
-            genai.configure(api_key=G_API_KEY)
-            MODEL = genai.GenerativeModel("gemini-2.5-flash")
-            st.markdown("**Gemini API key** <span class='badge-ok'>Active</span>", unsafe_allow_html=True)
-        except Exception as e:
-            st.error(f"Failed to initialize Gemini: {e}")
-            st.stop()
+        st.markdown("**Gemini API key** <span class='badge-ok'>Active</span>", unsafe_allow_html=True)
 
     # --- PEXELS KEY (persist + fallback) ---
     st.subheader("Pexels API Key (Optional)")
@@ -191,6 +158,68 @@ with st.sidebar:
         attach_images = False
         st.info("ℹ️ No Pexels API key provided. Slides will include image suggestions (keywords) only.")
 
+    # --- RESPONSE CACHE ---
+    st.subheader("Response Cache")
+    bypass_llm_cache = st.checkbox(
+        "Always regenerate (skip cached responses)",
+        key="bypass_llm_cache",
+        help="Repeated topic/title/audience combinations are served from a local cache without calling Gemini."
+    )
+    stored = storage_stats()
+    cache_stats = stored["llm_cache"]
+    st.caption(
+        f"{cache_stats['hits']} hits / {cache_stats['misses']} misses · "
+        f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB)"
+    )
+    queue_stats = stored["job_queue"]
+    if queue_stats and queue_stats['workers']:
+        st.caption(
+            f"Job queue: {queue_stats['workers']} worker(s) · {queue_stats.get('running', 0)} running · "
+            f"{queue_stats.get('queued', 0)} queued"
+        )
+    prefetch_stats = get_prefetcher().stats()
+    if prefetch_stats['started'] or prefetch_stats['rejected']:
+        st.caption(
+            f"Prefetch: {prefetch_stats['used']} used / {prefetch_stats['discarded']} discarded of "
+            f"{prefetch_stats['started']} · {prefetch_stats['rejected']} over budget · "
+            f"{prefetch_stats['slides_last_hour']} slides this hour"
+        )
+    for service, rc in rate_control_stats().items():
+        if rc['retries'] or rc['throttled'] or rc['quota_wait_s']:
+            st.caption(
+                f"{service.capitalize()}: {rc['throttled']} throttled · {rc['retries']} retries · "
+                f"{rc['quota_wait_s']:.0f}s waiting for quota · concurrency {rc['concurrency_limit']:.0f}"
+            )
+    flights = single_flight_stats()
+    if any(f['coalesced'] for f in flights.values()):
+        st.caption("Coalesced requests: " + " · ".join(
+            f"{service.replace('_', ' ')} {f['coalesced']}" for service, f in flights.items() if f['coalesced']
+        ))
+    art = stored["artifacts"]
+    st.caption(
+        f"Artifacts: {art['sessions']} session(s) · {art['memory_bytes'] / 1e6:.1f} MB in memory · "
+        f"{art['disk_bytes'] / 1e6:.1f} MB spilled · images {(art['image_store_bytes'] + art['variant_bytes']) / 1e6:.0f} MB"
+    )
+    stage_rows = get_metrics().summary()
+    if stage_rows:
+        with st.expander("Stage timings"):
+            rows = [
+                f"| {r['stage']} | {r['count']}{' (' + str(r['errors']) + ' failed)' if r['errors'] else ''} | "
+                f"{r['p50_ms']:.0f} | {r['p95_ms']:.0f} | {r['total_s']:.1f} |"
+                for r in stage_rows
+            ]
+            st.markdown("| Stage | Calls | p50 ms | p95 ms | Total s |\n|---|--:|--:|--:|--:|\n" + "\n".join(rows))
+
+    # --- RERUN LATENCY (measured at the end of the previous run) ---
+    rerun_history = sorted(st.session_state.get('rerun_ms', []))
+    if rerun_history:
+        p50 = rerun_history[len(rerun_history) // 2]
+        p95 = rerun_history[min(len(rerun_history) - 1, int(len(rerun_history) * 0.95))]
+        st.caption(
+            f"{'⚠️ ' if p50 > RERUN_BUDGET_MS else ''}Rerun p50 {p50:.0f} ms · p95 {p95:.0f} ms "
+            f"(budget {RERUN_BUDGET_MS} ms) · first run {st.session_state.get('first_run_ms', 0):.0f} ms"
+        )
+
 
     st.markdown("---")
 
@@ -238,197 +267,300 @@ if 'popup_shown' not in st.session_state:
     components.html("<script>alert('💡 This app uses a dark UI for best visibility.');</script>")
 
 # ---------- HELPERS ----------
-def safe_filename(s: str) -> str:
-    return re.sub(r'[^a-zA-Z0-9_\-]+', '_', s).strip('_')[:80]
-
 def word_count(text: str) -> int:
     return len(text.split())
 
-def parse_lines_to_bullets_and_notes(generated_text: str):
-    lines = [ln.strip() for ln in generated_text.splitlines() if ln.strip()]
-    bullets, notes_lines = [], []
-    for ln in lines:
-        if re.match(r"^(-|•|\d+\.)\s*", ln):
-            bullets.append(re.sub(r"^(-|•|\d+\.)\s*", "", ln).strip())
-        else:
-            notes_lines.append(ln)
-    if not bullets and lines:
-        bullets, notes_lines = lines[:4], lines[4:]
-    return bullets[:6], " ".join(notes_lines).strip()
-
-# ---------- PEXELS ----------
-def fetch_image_url_safe(query, api_key):
-    if not api_key:
-        return None
-    headers = {"Authorization": api_key}
-    params = {"query": query, "per_page": 1}
-    try:
-        resp = requests.get(PEXELS_SEARCH_URL, headers=headers, params=params, timeout=10)
-    except Exception as e:
-        st.warning(f"Pexels request error: {e}")
-        return None
-    if resp.status_code == 200:
-        try:
-            data = resp.json()
-            photos = data.get("photos") or []
-            if photos:
-                src = photos[0].get("src", {})
-                return src.get("landscape") or src.get("original")
-        except Exception as e:
-            st.warning(f"Failed to parse Pexels response: {e}")
-    elif resp.status_code in (401, 403, 429):
-        st.warning("⚠️ Pexels API error — check your key or usage limits.")
-    return None
-
-def download_image_to_path(img_url, keyword):
-    try:
-        r = requests.get(img_url, timeout=15)
-        r.raise_for_status()
-        safe_kw = re.sub(r'[^a-z0-9]', '_', keyword.lower())[:40]
-        fname = os.path.join(tempfile.gettempdir(), f"pexels_{safe_kw}.jpg")
-        with open(fname, "wb") as f:
-            f.write(r.content)
-        return fname
-    except Exception as e:
-        st.warning(f"Failed to download image: {e}")
-        return None
-
-
-# ---------- LLM (Gemini) ----------
-def generate_titles(subject, count=6):
-    system = "You are an expert presentation author. Produce short, engaging presentation titles."
-    prompt = f"Generate {count} concise titles (max 10 words each) for: \"{subject}\"."
-    try:
-        resp = MODEL.generate_content([system, prompt])
-        text = resp.text or ""
-        titles = [re.sub(r'^[\-\d\.\)\s]+', '', line).strip() for line in text.splitlines() if line.strip()]
-        return titles[:count]
-    except Exception as e:
-        st.error(f"Error generating titles: {e}")
-        return []
-
-def generate_slide_text(ppt_title, section_title, audience, include_image_keyword=True):
-    system = "You are an expert presentation writer. Use concise bullets and notes."
-    prompt = (
-        f"Create slide content for '{ppt_title}'.\n"
-        f"Slide title: {section_title}\n"
-        f"Audience: {audience}\n"
-        "- 3 to 5 concise bullet points (<= 20 words each)\n"
-        "- A short speaker note (1-2 sentences)\n"
-    )
-    if include_image_keyword:
-        prompt += "- End with 'ImageKeyword: <2-4 word idea>'.\n"
-    try:
-        resp = MODEL.generate_content([system, prompt])
-        text = resp.text or ""
-        ik_match = re.search(r"ImageKeyword\s*:\s*(.+)$", text, flags=re.I | re.M)
-        image_keyword = ik_match.group(1).strip() if ik_match else None
-        if image_keyword:
-            text = re.sub(r"ImageKeyword\s*:\s*.+$", "", text, flags=re.I | re.M).strip()
-        bullets, notes = parse_lines_to_bullets_and_notes(text)
-        return {"bullets": bullets, "notes": notes, "image_keyword": image_keyword}
-    except Exception as e:
-        st.error(f"Error generating slide: {e}")
-        return {"bullets": ["(Generation failed)"], "notes": "", "image_keyword": None}
-
-# ---------- PPT CREATION ----------
-def create_pptx_bytes(ppt_title, slide_contents, attach_images=False):
-    prs = Presentation()
-    # Title slide
-    title_slide_layout = prs.slide_layouts[0]
-    slide = prs.slides.add_slide(title_slide_layout)
-    slide.shapes.title.text = ppt_title
-    try:
-        slide.placeholders[1].text = "Generated by AI PPT Wizard"
-    except Exception:
-        pass
+# While the user reads the titles, start on the slide text for the likeliest
+# choice: the top title with the outline Step 2 would propose for it.
+def start_prefetch(titles):
+    cancel_prefetch()
+    if titles:
+        st.session_state['prefetch'] = get_prefetcher().start(
+            titles[0],
+            st.session_state.get('audience','Executive'),
+            st.session_state.get('slides_count', DEFAULT_SLIDES),
+            refresh=bypass_llm_cache,
+            topic=st.session_state.get('topic','Topic'),
+            api_key=G_API_KEY,
+        )
 
-    for s in slide_contents:
-        layout = prs.slide_layouts[1]
-        slide_obj = prs.slides.add_slide(layout)
-        slide_obj.shapes.title.text = s.get("slide_title", "")[:80]
-        body = slide_obj.shapes.placeholders[1].text_frame
-        body.clear()
-        bullets = s.get("bullets", [])
-        if bullets:
-            body.paragraphs[0].text = bullets[0]
-            for b in bullets[1:]:
-                p = body.add_paragraph()
-                p.text = b
-        try:
-            slide_obj.notes_slide.notes_text_frame.text = s.get("notes", "")
-        except Exception:
-            pass
-
-        img_path = s.get("image_local_path")
-        if attach_images and img_path and os.path.exists(img_path):
-            try:
-                slide_obj.shapes.add_picture(img_path, Inches(6.5), Inches(1.0), width=Inches(3.5))
-            except Exception as e:
-                st.warning(f"Could not add image: {e}")
-
-    # Closing slide
-    closing = prs.slides.add_slide(prs.slide_layouts[1])
-    closing.shapes.title.text = "Conclusion & Next Steps"
-    try:
-        closing.shapes.placeholders[1].text_frame.text = "Summary and suggested next steps."
-    except Exception:
-        pass
+def cancel_prefetch():
+    job = st.session_state.pop('prefetch', None)
+    if job is not None:
+        job.cancel()
+
+# Long outlines as text: a "## " line starts a part, every other line is a section
+def outline_to_text(sections, parts):
+    lines, i = [], 0
+    for p in parts if len(parts) > 1 else []:
+        if p['title']:
+            lines.append(f"## {p['title']}")
+        lines.extend(sections[i:i + len(p['sections'])])
+        i += len(p['sections'])
+    return "\n".join(lines + sections[i:])
+
+def text_to_outline(text):
+    sections, parts = [], [{'title': '', 'sections': []}]
+    for line in (ln.strip() for ln in text.splitlines()):
+        if line.startswith("## "):
+            parts.append({'title': line[3:].strip(), 'sections': []})
+        elif line:
+            parts[-1]['sections'].append(line)
+            sections.append(line)
+    return sections, [p for p in parts if p['sections']]
+
+# Markdown for the streaming preview: [(index, partial slide)]
+def stream_preview_markdown(slides):
+    blocks = []
+    for i, s in slides:
+        lines = [f"**Slide {i+1}: {s['slide_title']}**"] + [f"- {b}" for b in s.get('bullets', [])]
+        if s.get('image_keyword'):
+            lines.append(f"_Image: {s['image_keyword']}_")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+# Deck is built: success message, size caption and the download button
+def show_deck_ready(data, deck_stats, ppt_title):
+    st.success("PPT created!")
+    saved = deck_stats["original_image_bytes"] - deck_stats["embedded_image_bytes"]
+    st.caption(
+        f"Deck size: {deck_stats['deck_bytes'] / 1e6:.2f} MB "
+        f"(≈{(deck_stats['deck_bytes'] + saved) / 1e6:.2f} MB with original images) · "
+        f"{deck_stats['build_mode']} build, {deck_stats['patched_slides']} slide(s) rewritten"
+    )
+    st.download_button(
+        "Download PPT",
+        data=data,
+        file_name=safe_filename(ppt_title) + ".pptx",
+        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+    )
 
-    bio = io.BytesIO()
-    prs.save(bio)
-    bio.seek(0)
-    return bio
+def apply_generated_slides(slides, pipeline_stats, sections, parts):
+    # The outline as generated, so coming back to Step 3 shows these edits
+    st.session_state['sections'] = sections
+    st.session_state['outline_parts'] = parts
+    st.session_state['slide_contents'] = slides
+    if pipeline_stats:
+        st.session_state['pipeline_stats'] = pipeline_stats
+    st.session_state.pop('editor_page', None)
+    go_next()
+
+# ---------- BACKGROUND JOBS ----------
+# Workers call Gemini and Pexels with the server's own keys and keys are never
+# written to the queue, so jobs that need a key are only queued for sessions
+# that use those same keys; a key entered in the sidebar stays in this process.
+def use_job_queue(needs_keys=True):
+    if JOB_QUEUE_MODE == "off":
+        return False
+    if needs_keys and (G_API_KEY != os.getenv("G_API_KEY") or PEXELS_KEY != os.getenv("PEXELS_API_KEY")):
+        return False
+    return get_job_queue().live_workers() > 0
+
+# The running slide job is kept in the URL (?job=<id>) so a reloaded or reopened
+# tab can pick it up again. st.query_params replaced the experimental API in 1.30.
+def get_query_job():
+    if hasattr(st, "query_params"):
+        return st.query_params.get("job")
+    return (st.experimental_get_query_params().get("job") or [None])[0]
+
+def set_query_job(job_id):
+    if hasattr(st, "query_params"):
+        if job_id:
+            st.query_params["job"] = job_id
+        else:
+            st.query_params.pop("job", None)
+    else:
+        st.experimental_set_query_params(**({"job": job_id} if job_id else {}))
+
+def cancel_job(key):
+    job_id = st.session_state.pop(key, None)
+    if job_id:
+        get_job_queue().cancel(job_id)
+    if key == 'slides_job':
+        set_query_job(None)
+
+# Progress of the background slide job; applies its result once it is done.
+# Returns True while the job is still queued or running.
+def slides_job_panel():
+    job = get_job_queue().get(st.session_state['slides_job'])
+    if job is not None and job['status'] in ('queued', 'running'):
+        if job['status'] == 'queued':
+            st.info(f"Waiting for a worker ({job['position']} job(s) ahead) ...")
+        else:
+            st.progress(job['done'] / max(job['total'], 1), text=f"Generated {job['done']}/{job['total']} slides")
+            if job['preview']:
+                st.markdown(stream_preview_markdown(job['preview']))
+        st.button("Cancel", key="cancel_slides_job", on_click=cancel_job, args=('slides_job',))
+        return True
+    st.session_state.pop('slides_job', None)
+    set_query_job(None)
+    if job is not None and job['status'] == 'failed':
+        st.error(f"Slide generation failed: {job['error']}")
+    elif job is not None and job['status'] == 'done':
+        apply_generated_slides(
+            job['result']['slides'], job['result']['pipeline_stats'], job['payload']['sections'], job['payload']['parts'],
+        )
+    return False
+
+# Same for the PPTX build job; the finished deck moves the wizard to Step 5.
+def pptx_job_panel():
+    job_id = st.session_state['pptx_job']
+    job = get_job_queue().get(job_id)
+    if job is not None and job['status'] in ('queued', 'running'):
+        st.info("Building the deck ..." if job['status'] == 'running' else "Waiting for a worker to build the deck ...")
+        st.button("Cancel", key="cancel_pptx_job", on_click=cancel_job, args=('pptx_job',))
+        return
+    st.session_state.pop('pptx_job', None)
+    if job is not None and job['status'] == 'failed':
+        st.error(f"Building the deck failed: {job['error']}")
+    elif job is not None and job['status'] == 'done':
+        with open(job['result']['path'], "rb") as f:
+            data = f.read()
+        # The next export only rebuilds slides changed since this one
+        st.session_state['pptx_base_job'] = job_id
+        show_deck_ready(data, job['result']['stats'], job['payload']['title'])
+        st.session_state['step'] = 5
 
 # ---------- APP HEADER ----------
-st.markdown("""
-<style>
-:root {
-  --hero-grad: linear-gradient(90deg, #6ee7f9, #22d3ee, #60a5fa, #22d3ee, #6ee7f9);
-}
-
-/* fade-in + shimmer */
-@keyframes shimmer {
-  0% { background-position: 0% 50%; }
-  100% { background-position: 200% 50%; }
-}
-@keyframes fadeScale {
-  0% { opacity: 0; transform: translateY(4px) scale(0.98); }
-  100% { opacity: 1; transform: translateY(0) scale(1); }
-}
-
-h1.hero-title{
-  display:inline-block;               /* important for background-clip animation */
-  background: var(--hero-grad);
-  background-size: 200% 200%;
-  -webkit-background-clip: text;
-  -webkit-text-fill-color: transparent;
-  animation: fadeScale .8s ease-out both, shimmer 3s linear infinite !important;
-  font-weight: 900;
-  letter-spacing: .3px;
-  text-shadow: 0 0 1px rgba(255,255,255,.14);  /* subtle “brightness” */
-}
-
-</style>
-
-<h1 class="hero-title">✨ AI PPT Wizard</h1>
-""", unsafe_allow_html=True)
+st.markdown('<h1 class="hero-title">✨ AI PPT Wizard</h1>', unsafe_allow_html=True)
 
 st.write("Guided flow: Topic → Titles → Outline → Edit → Generate PPT")
 
 
 
+# ---------- STEP 4 EDITOR ----------
+# Each slide is edited in its own st.form, so typing never reruns the script;
+# edits are committed in one go by the form's submit callback. Where Streamlit
+# has fragments, a submit reruns only that slide's editor; older versions
+# (1.29 as pinned) fall back to a normal rerun.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda fn: fn)
+
+# Widget keys carry the slide's "rev" so regenerated content replaces stale widget state
+def widget_key(name, idx, s, *extra):
+    return "_".join(str(p) for p in (name, idx, s.get('rev', 0)) + extra)
+
+def save_slide(idx, add_bullet=False):
+    s = st.session_state['slide_contents'][idx]
+    s['slide_title'] = st.session_state[widget_key("title", idx, s)]
+    s['bullets'] = [st.session_state[widget_key("bullet", idx, s, j)] for j in range(len(s.get('bullets', [])))]
+    s['notes'] = st.session_state[widget_key("notes", idx, s)]
+    if add_bullet:
+        s['bullets'].append("(New bullet)")
+
+# Button callback: re-calls Gemini for the chosen slides only (using their current
+# titles); all other slides, edits and images stay as they are. The Step 3 outline is updated
+# so those slides are not seen as changed when the user goes back.
+def regenerate_in_place(indexes):
+    slides = st.session_state['slide_contents']
+    titles = [s.get('slide_title', '') for s in slides]
+    with st.spinner(f"Regenerating {len(indexes)} slide(s) ..."):
+        slides, pipeline_stats = regenerate_slides(
+            st.session_state.get('final_title','Presentation'),
+            slides,
+            titles,
+            indexes,
+            st.session_state.get('audience','Executive'),
+            pexels_key=PEXELS_KEY if attach_images else None,
+            refresh=True,
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx()),
+            context=outline_context(st.session_state.get('outline_parts')),
+            api_key=G_API_KEY,
+        )
+    st.session_state['slide_contents'] = slides
+    st.session_state['pipeline_stats'] = pipeline_stats
+    sections = st.session_state.get('sections', [])
+    for i in indexes:
+        if i < len(sections):
+            sections[i] = titles[i]
+            st.session_state.pop(f"sec_{i}", None)
+    st.session_state.pop('outline_text', None)
+
+def regenerate_selected(slide_labels):
+    regenerate_in_place([slide_labels.index(label) for label in st.session_state['regen_select_step4']])
+    st.session_state['regen_select_step4'] = []
+
+def choose_slide_image(idx, index):
+    choose_image(st.session_state['slide_contents'][idx], index)
+
+# Alternate photos from the candidates the keyword's Pexels search already
+# returned: swapping never searches again. Thumbnails and the next full-size
+# photo download in the background while the editor is on screen.
+def image_picker(idx):
+    s = st.session_state['slide_contents'][idx]
+    candidates = image_candidates(s['image_keyword'], None)
+    if len(candidates) < 2:
+        return
+    current = s.get('image_choice', 0)
+    prefetch_candidates(s['image_keyword'], current)
+    st.button("Next image", key=widget_key("next_image", idx, s), on_click=choose_slide_image, args=(idx, current + 1))
+    with st.expander(f"Pick from {len(candidates)} candidate images"):
+        cols = st.columns(4)
+        for j, (c, thumb) in enumerate(zip(candidates, candidate_thumbnails(candidates))):
+            with cols[j % 4]:
+                st.image(thumb, width=140, caption=c.get('photographer') or None)
+                st.button(
+                    "Current" if j == current else "Use", key=widget_key("pick_image", idx, s, j),
+                    disabled=j == current, on_click=choose_slide_image, args=(idx, j),
+                )
+
+@fragment
+def slide_editor(idx):
+    s = st.session_state['slide_contents'][idx]
+    st.markdown(f"### Slide {idx+1}")
+    form_col, preview_col = st.columns([3, 2])
+    with form_col, st.form(f"slide_form_{idx}"):
+        st.text_input(f"Slide {idx+1} Title", value=s.get('slide_title',''), key=widget_key("title", idx, s))
+        st.write("Bullets:")
+        for j, b in enumerate(s.get('bullets', [])):
+            st.text_input(f"Slide {idx+1} - Bullet {j+1}", value=b, key=widget_key("bullet", idx, s, j))
+        st.text_area(f"Speaker notes for slide {idx+1}", value=s.get('notes',''), key=widget_key("notes", idx, s))
+        cols = st.columns([1,1])
+        with cols[0]:
+            st.form_submit_button("Save slide", on_click=save_slide, args=(idx,))
+        with cols[1]:
+            st.form_submit_button("Save & add bullet", on_click=save_slide, args=(idx, True))
+    # Layout thumbnail of the saved slide; cached by content, so only a saved edit redraws it
+    if st.session_state.get('show_previews', True):
+        preview = slide_preview_path("content", s, attach_images)
+        if preview:
+            preview_col.image(preview, caption="Layout preview", use_column_width=True)
+    image_kw = s.get('image_keyword')
+    st.write(f"Image suggestion: **{image_kw if image_kw else 'No suggestion'}**")
+    if s.get('image_local_path') and os.path.exists(s.get('image_local_path')):
+        st.image(s.get('image_local_path'), width=320)
+    if attach_images and image_kw:
+        image_picker(idx)
+    if word_count(" ".join(s.get('bullets', []))) > MAX_WORDS_PER_SLIDE:
+        st.warning(f"Slide {idx+1} exceeds recommended {MAX_WORDS_PER_SLIDE} words.")
+    st.button(f"Regenerate slide {idx+1}", key=f"regen_{idx}", on_click=regenerate_in_place, args=([idx],))
+
+
 # ---------- STEP STATE HANDLERS ----------
 def go_next(): st.session_state['step'] = min(5, st.session_state['step'] + 1)
 def go_back(): st.session_state['step'] = max(1, st.session_state['step'] - 1)
 
 
+# A reloaded or reopened tab finds its slide job again through ?job=<id>
+if st.session_state['step'] == 1 and 'job_checked' not in st.session_state:
+    st.session_state['job_checked'] = True
+    query_job_id = get_query_job()
+    query_job = get_job_queue().get(query_job_id) if query_job_id else None
+    if query_job and query_job['kind'] == 'slides' and query_job['status'] in ('queued', 'running', 'done'):
+        payload = query_job['payload']
+        st.session_state.update({
+            'topic': payload.get('topic') or payload['title'], 'audience': payload['audience'],
+            'slides_count': payload.get('slides_count') or len(payload['sections']),
+            'final_title': payload['title'], 'sections': payload['sections'], 'outline_parts': payload['parts'],
+            'slides_job': query_job_id, 'step': 3,
+        })
+
 # Step 1
 if st.session_state['step'] == 1:
     st.markdown("<h2 class='step-header'>Step 1 — Topic & Purpose</h2>", unsafe_allow_html=True)
     topic = st.text_input("Enter the presentation topic", value=st.session_state.get('topic',''))
     audience = st.selectbox("Audience style", AUDIENCE_PRESETS, index=0)
-    slides_count = st.slider("Desired number of slides", min_value=1, max_value=30, value=DEFAULT_SLIDES)
+    slides_count = st.slider("Desired number of slides", min_value=1, max_value=MAX_SLIDES, value=DEFAULT_SLIDES)
     if st.button("Generate Titles"):
         if not topic:
             st.error("Please enter a topic.")
@@ -437,11 +569,12 @@ if st.session_state['step'] == 1:
             st.session_state['audience'] = audience
             st.session_state['slides_count'] = slides_count
             with st.spinner("Generating titles ..."):
-                titles = generate_titles(topic, count=8)
+                titles = generate_titles(topic, count=8, refresh=bypass_llm_cache, api_key=G_API_KEY)
             if not titles:
                 st.error("No titles generated. Try a different topic or check API key.")
             else:
                 st.session_state['titles'] = titles
+                start_prefetch(titles)
                 go_next()
     st.markdown("---")
     st.write("Tip: Keep topics concise and descriptive (e.g., 'AI in Healthcare').")
@@ -465,67 +598,152 @@ if st.session_state['step'] == 2:
         with cols[1]:
             if st.button("Regenerate Titles", key="regen_titles_step2"):
                 with st.spinner("Regenerating..."):
-                    st.session_state['titles'] = generate_titles(st.session_state.get('topic',''), count=8)
+                    st.session_state['titles'] = generate_titles(st.session_state.get('topic',''), count=8, refresh=True, api_key=G_API_KEY)
+                start_prefetch(st.session_state['titles'])
                 st.rerun()
         with cols[2]:
             if st.button("Proceed", key="proceed_step2"):
                 st.session_state['final_title'] = custom_title or selected
                 topic = st.session_state.get('topic','Topic')
-                default_sections = [
-                    f"Introduction to {topic}",
-                    f"Importance of {topic}",
-                    f"Key technologies in {topic}",
-                    "Case studies",
-                    "Conclusion & Recommendations"
-                ]
-                st.session_state['sections'] = default_sections[:st.session_state.get('slides_count', DEFAULT_SLIDES)]
+                with st.spinner("Drafting outline ..."):
+                    st.session_state['sections'], st.session_state['outline_parts'] = generate_outline(
+                        topic,
+                        st.session_state['final_title'],
+                        st.session_state.get('slides_count', DEFAULT_SLIDES),
+                        st.session_state.get('audience','Executive'),
+                        refresh=bypass_llm_cache,
+                        api_key=G_API_KEY,
+                    )
+                job = st.session_state.get('prefetch')
+                if job is not None and not job.matches(st.session_state['final_title'], st.session_state.get('audience','Executive')):
+                    cancel_prefetch()
                 go_next()
 
 
 # Step 3
 if st.session_state['step'] == 3:
     st.markdown("<h2 class='step-header'>Step 3 — Outline (Edit Sections)</h2>", unsafe_allow_html=True)
-    sections = st.session_state.get('sections', [])
-    if not sections:
-        st.warning("No sections configured. Go back to select a title.")
-        if st.button("Back"): go_back()
-    else:
-        edited = []
-        for i, s in enumerate(sections):
-            new_s = st.text_input(f"Section {i+1}", value=s, key=f"sec_{i}")
-            edited.append(new_s)
-        extra = st.text_input("Add an extra section (optional)")
-        if extra:
-            edited.append(extra)
-        st.session_state['edited_sections'] = edited
-        cols = st.columns([1,1])
-        with cols[0]:
-            if st.button("Back", key="back_step3"):
-                go_back()
-        with cols[1]:
-            if st.button("Generate Slide Content", key="gen_slides_step3"):
-                final_sections = edited[:st.session_state.get('slides_count', DEFAULT_SLIDES)]
-                slide_contents = []
-                with st.spinner("Generating slide content ..."):
-                    for sec in final_sections:
-                        slide = generate_slide_text(
-                            st.session_state.get('final_title','Presentation'),
-                            sec,
-                            st.session_state.get('audience','Executive'),
-                            include_image_keyword=True
+    if st.session_state.get('slides_job') and slides_job_panel():
+        pass
+    # (a slide job that just finished has moved the wizard on to Step 4)
+    elif st.session_state['step'] == 3:
+        sections = st.session_state.get('sections', [])
+        if not sections:
+            st.warning("No sections configured. Go back to select a title.")
+            if st.button("Back"): go_back()
+        else:
+            parts = st.session_state.get('outline_parts', [])
+            if len(sections) > SECTION_FIELDS_MAX:
+                st.caption("One section per line. Lines starting with '## ' name the part of the deck that follows.")
+                outline_text = st.text_area("Outline", value=outline_to_text(sections, parts), key="outline_text", height=480)
+                edited, parts = text_to_outline(outline_text)
+            else:
+                # Part headings of a multi-part outline, keyed by the index of their first section
+                part_starts, first = {}, 0
+                for p in parts if len(parts) > 1 else []:
+                    part_starts[first] = p['title']
+                    first += len(p['sections'])
+                edited = []
+                for i, s in enumerate(sections):
+                    if i in part_starts:
+                        st.markdown(f"**{part_starts[i]}**")
+                    new_s = st.text_input(f"Section {i+1}", value=s, key=f"sec_{i}")
+                    edited.append(new_s)
+            extra = st.text_input("Add an extra section (optional)")
+            if extra:
+                edited.append(extra)
+            st.session_state['edited_sections'] = edited
+            final_sections = edited[:st.session_state.get('slides_count', DEFAULT_SLIDES)]
+            # Only sections whose title (or the deck title/audience) changed since the
+            # last generation are dirty; everything else keeps its content and image.
+            planned, dirty = plan_slides(
+                st.session_state.get('slide_contents', []),
+                st.session_state.get('final_title','Presentation'),
+                final_sections,
+                st.session_state.get('audience','Executive'),
+            )
+            regenerate_all = False
+            if len(dirty) < len(final_sections):
+                st.caption(f"{len(dirty)} of {len(final_sections)} slides changed and will be generated; the rest are kept.")
+                regenerate_all = st.checkbox("Regenerate all slides", key="regen_all_step3")
+            cols = st.columns([1,1])
+            with cols[0]:
+                if st.button("Back", key="back_step3"):
+                    go_back()
+            with cols[1]:
+                if st.button("Generate Slide Content", key="gen_slides_step3"):
+                    if regenerate_all:
+                        dirty = list(range(len(final_sections)))
+                    # Reuse whatever the speculative run produced for sections still in the outline
+                    speculative = []
+                    job = st.session_state.pop('prefetch', None)
+                    if job is not None:
+                        if dirty and not regenerate_all and job.matches(
+                            st.session_state.get('final_title','Presentation'), st.session_state.get('audience','Executive')
+                        ):
+                            with st.spinner("Finishing background generation ..."):
+                                speculative = get_prefetcher().claim(job)
+                            planned, dirty = plan_slides(
+                                [*st.session_state.get('slide_contents', []), *speculative],
+                                st.session_state.get('final_title','Presentation'),
+                                final_sections,
+                                st.session_state.get('audience','Executive'),
+                            )
+                        else:
+                            job.cancel()
+                    title = st.session_state.get('final_title','Presentation')
+                    audience = st.session_state.get('audience','Executive')
+                    pexels_key = PEXELS_KEY if attach_images else None
+                    # Speculative slides come without pictures; those are fetched after generation
+                    missing_images = [i for i, s in enumerate(planned) if any(s is p for p in speculative)]
+                    if use_job_queue():
+                        # A worker process does the generation; the panel above polls it
+                        job_id = get_job_queue().submit("slides", {
+                            "title": title, "audience": audience, "sections": final_sections, "parts": parts,
+                            "slides": planned, "dirty": dirty, "missing_images": missing_images,
+                            "refresh": bypass_llm_cache or regenerate_all, "context": outline_context(parts),
+                            "stream": len(dirty) <= STREAM_MAX_SLIDES,
+                            "topic": st.session_state.get('topic'), "slides_count": st.session_state.get('slides_count'),
+                            "images": bool(pexels_key),
+                        })
+                        st.session_state['slides_job'] = job_id
+                        set_query_job(job_id)
+                        st.rerun()
+                    progress = st.progress(0.0, text="Generating slide content ...")
+                    # Slides being written appear here as their tokens stream in
+                    preview = st.empty()
+                    streaming = {}
+                    def show_partial(i, slide):
+                        streaming.pop(i, None)
+                        streaming[i] = slide
+                        preview.markdown(stream_preview_markdown(list(streaming.items())[-STREAM_PREVIEW_SLIDES:]))
+                    slide_contents, pipeline_stats = regenerate_slides(
+                        title,
+                        planned,
+                        final_sections,
+                        dirty,
+                        audience,
+                        pexels_key=pexels_key,
+                        refresh=bypass_llm_cache or regenerate_all,
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Generated {done}/{total} slides"),
+                        # Worker threads inherit the script context so core warnings still render
+                        initializer=add_script_run_ctx,
+                        initargs=(None, get_script_run_ctx()),
+                        context=outline_context(parts),
+                        stream=len(dirty) <= STREAM_MAX_SLIDES,
+                        on_partial=show_partial,
+                        api_key=G_API_KEY,
+                    )
+                    preview.empty()
+                    if pexels_key and missing_images:
+                        image_stats = attach_missing_images(
+                            [slide_contents[i] for i in missing_images], pexels_key,
+                            initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx()),
                         )
-                        slide['slide_title'] = sec
-                        slide['image_local_path'] = None
-                        # safe pexels flow
-                        if attach_images and slide.get('image_keyword'):
-                            img_url = fetch_image_url_safe(slide['image_keyword'], PEXELS_KEY)
-                            if img_url:
-                                local_path = download_image_to_path(img_url, slide['image_keyword'])
-                                if local_path:
-                                    slide['image_local_path'] = local_path
-                        slide_contents.append(slide)
-                st.session_state['slide_contents'] = slide_contents
-                go_next()
+                        if image_stats and not pipeline_stats:
+                            pipeline_stats = {"image": image_stats}
+                    progress.empty()
+                    apply_generated_slides(slide_contents, pipeline_stats, final_sections, parts)
 
 # Step 4
 if st.session_state['step'] == 4:
@@ -535,50 +753,58 @@ if st.session_state['step'] == 4:
         st.warning("No slide content found. Generate slides first.")
         if st.button("Back"): go_back()
     else:
-        for idx, s in enumerate(slide_contents):
-            st.markdown(f"### Slide {idx+1}")
-            title_in = st.text_input(f"Slide {idx+1} Title", value=s.get('slide_title',''), key=f"title_{idx}")
-            bullets = s.get('bullets', [])
-            new_bullets = []
-            st.write("Bullets:")
-            for j, b in enumerate(bullets):
-                nb = st.text_input(f"Slide {idx+1} - Bullet {j+1}", value=b, key=f"bullet_{idx}_{j}")
-                new_bullets.append(nb)
-            if st.button(f"Add bullet to slide {idx+1}", key=f"add_b_{idx}"):
-                updated = st.session_state['slide_contents']
-                updated[idx]['bullets'] = new_bullets + ["(New bullet)"]
-                st.session_state['slide_contents'] = updated
-                st.rerun()
-            notes = st.text_area(f"Speaker notes for slide {idx+1}", value=s.get('notes',''), key=f"notes_{idx}")
-            image_kw = s.get('image_keyword')
-            st.write(f"Image suggestion: **{image_kw if image_kw else 'No suggestion'}**")
-            if s.get('image_local_path') and os.path.exists(s.get('image_local_path')):
-                st.image(s.get('image_local_path'), width=320)
-            if word_count(" ".join(new_bullets)) > MAX_WORDS_PER_SLIDE:
-                st.warning(f"Slide {idx+1} exceeds recommended {MAX_WORDS_PER_SLIDE} words.")
-            st.session_state['slide_contents'][idx]['slide_title'] = title_in
-            st.session_state['slide_contents'][idx]['bullets'] = new_bullets
-            st.session_state['slide_contents'][idx]['notes'] = notes
+        pipeline_stats = st.session_state.get('pipeline_stats')
+        if pipeline_stats:
+            with st.expander("Generation pipeline stats"):
+                for stage, stats in pipeline_stats.items():
+                    st.caption(
+                        f"**{stage}**: {stats['jobs']} jobs · max queue depth {stats['max_queue_depth']} · "
+                        f"wait avg {stats['avg_wait_ms']} ms / max {stats['max_wait_ms']} ms · "
+                        f"run avg {stats['avg_run_ms']} ms"
+                    )
+        page_labels = [
+            f"Slides {start + 1}–{min(start + SLIDES_PER_PAGE, len(slide_contents))}"
+            for start in range(0, len(slide_contents), SLIDES_PER_PAGE)
+        ]
+        page = 0
+        if len(page_labels) > 1:
+            page = page_labels.index(st.selectbox("Page", page_labels, key="editor_page"))
+            st.caption("Save a slide before switching pages; unsaved edits are not kept.")
+        st.checkbox("Show layout previews", value=True, key="show_previews")
+        if page == 0 and st.session_state['show_previews']:
+            title_preview = slide_preview_path("title", st.session_state.get('final_title', 'Presentation'))
+            if title_preview:
+                st.image(title_preview, caption="Title slide", width=240)
+        for idx in range(page * SLIDES_PER_PAGE, min((page + 1) * SLIDES_PER_PAGE, len(slide_contents))):
+            slide_editor(idx)
 
         cols = st.columns([1,1,1])
         with cols[0]:
             if st.button("Back", key="back_step4"):
                 go_back()
         with cols[1]:
-            if st.button("Regenerate this slide (not implemented)", key="regen_slide_step4"):
-                st.info("Partial regeneration placeholder. You can edit bullets manually or regenerate whole flow.")
+            slide_labels = [f"{i+1}. {s.get('slide_title','')}" for i, s in enumerate(slide_contents)]
+            to_regen = st.multiselect("Slides to regenerate", slide_labels, key="regen_select_step4")
+            st.button(
+                "Regenerate selected", key="regen_slide_step4", disabled=not to_regen,
+                on_click=regenerate_selected, args=(slide_labels,),
+            )
         with cols[2]:
-            if st.button("Finalize & Create PPT", key="finalize_step4"):
+            if st.session_state.get('pptx_job'):
+                pptx_job_panel()
+            elif st.button("Finalize & Create PPT", key="finalize_step4"):
                 ppt_title = st.session_state.get('final_title','AI_Presentation')
-                bio = create_pptx_bytes(ppt_title, st.session_state['slide_contents'], attach_images=attach_images)
-                filename = safe_filename(ppt_title) + ".pptx"
-                st.success("PPT created!")
-                st.download_button(
-                    "Download PPT",
-                    data=bio,
-                    file_name=filename,
-                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                )
+                if use_job_queue(needs_keys=False):
+                    st.session_state['pptx_job'] = get_job_queue().submit("pptx", {
+                        "title": ppt_title, "slides": st.session_state['slide_contents'],
+                        "attach_images": attach_images, "base_job": st.session_state.get('pptx_base_job'),
+                    })
+                    st.rerun()
+                deck_stats = {}
+                # Re-exports after small edits only rewrite the slides that changed
+                deck_builder = st.session_state.setdefault('deck_builder', IncrementalDeck(session_artifacts()))
+                bio = deck_builder.build(ppt_title, st.session_state['slide_contents'], attach_images=attach_images, stats=deck_stats)
+                show_deck_ready(bio, deck_stats, ppt_title)
                 st.session_state['step'] = 5
 
 
@@ -588,13 +814,36 @@ if st.session_state['step'] == 5:
     st.success("Presentation generated — check your downloads.")
     st.write("You can go back and tweak slides or start a new presentation.")
     if st.button("Start New Presentation", key="restart_step5"):
+        cancel_prefetch()
         keys = [
             'topic','audience','slides_count','titles',
-            'final_title','sections','edited_sections','slide_contents'
+            'final_title','sections','edited_sections','slide_contents','pipeline_stats','editor_page',
+            'deck_builder','outline_parts','outline_text','slides_job','pptx_job','pptx_base_job'
         ]
+        session_artifacts().drop("deck.pptx")
         for k in keys:
             if k in st.session_state:
                 del st.session_state[k]
         st.session_state['step'] = 1
         st.rerun()
 
+
+# ---------- RERUN LATENCY ----------
+# The first run of a session also pays imports and resource setup, so it is kept
+# apart from the rolling window of interactive reruns shown in the sidebar.
+rerun_ms = (time.perf_counter() - _rerun_started) * 1000
+if 'first_run_ms' not in st.session_state:
+    st.session_state['first_run_ms'] = rerun_ms
+else:
+    st.session_state.setdefault('rerun_ms', []).append(rerun_ms)
+    del st.session_state['rerun_ms'][:-50]
+if rerun_ms > RERUN_BUDGET_MS:
+    logging.getLogger("ppt_wizard").info("Rerun took %.0f ms (budget %d ms) at step %s",
+                                         rerun_ms, RERUN_BUDGET_MS, st.session_state.get('step'))
+
+
+# ---------- JOB POLLING ----------
+# While a background job runs, rerun every JOB_POLL_SECONDS to refresh its progress
+if st.session_state.get('slides_job') or st.session_state.get('pptx_job'):
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# ppt_core reads its configuration at import: keep every store in a scratch
+# directory and use the offline template backend
+_scratch = tempfile.mkdtemp(prefix="ppt_tests_")
+os.environ["LLM_BACKEND"] = "template"
+os.environ.pop("LLM_TITLE_BACKEND", None)
+os.environ["LLM_CACHE_PATH"] = os.path.join(_scratch, "llm_cache.sqlite3")
+os.environ["IMAGE_STORE_DIR"] = os.path.join(_scratch, "images")
+os.environ["JOB_QUEUE_DIR"] = os.path.join(_scratch, "jobs")
+os.environ["SESSION_ARTIFACT_DIR"] = os.path.join(_scratch, "sessions")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# A few distinct JPEGs large enough to be downscaled before embedding
+@pytest.fixture(scope="session")
+def photos(tmp_path_factory):
+    from PIL import Image
+
+    root = tmp_path_factory.mktemp("photos")
+    paths = []
+    for i in range(3):
+        path = str(root / f"photo{i}.jpg")
+        Image.effect_noise((1200, 800), 30 + 10 * i).convert("RGB").save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def slides(photos):
+    return [
+        {"slide_title": f"Slide {i}", "bullets": [f"Point {i} & <more>", "Second point"],
+         "notes": f"Notes {i}", "image_local_path": photos[i % 2]}
+        for i in range(12)
+    ]
@@ -0,0 +1,94 @@
+import io
+import zipfile
+
+import pytest
+
+import ppt_core
+from incremental_deck import IncrementalDeck
+
+
+def _parts(package):
+    z = zipfile.ZipFile(io.BytesIO(package))
+    assert z.testzip() is None
+    return {name: z.read(name) for name in z.namelist()}
+
+
+# Media part a slide's relationships point at, by slide part name
+def _slide_media(parts):
+    import posixpath
+    import xml.etree.ElementTree as ET
+
+    media = {}
+    for name, data in parts.items():
+        if name.startswith("ppt/slides/_rels/"):
+            slide = "ppt/slides/" + posixpath.basename(name)[:-len(".rels")]
+            for rel in ET.fromstring(data):
+                if rel.get("Type").endswith("/image"):
+                    target = posixpath.normpath(posixpath.join("ppt/slides", rel.get("Target")))
+                    media[slide] = parts[target]
+    return media
+
+
+# A patched deck must carry the same slides, notes and pictures as a full
+# build of the same content; only relationship files (media names) may differ
+def _assert_equivalent(patched, full):
+    a, b = _parts(patched), _parts(full)
+    content = lambda parts: {n for n in parts if not n.startswith("ppt/media/") and not n.endswith(".rels")}
+    assert content(a) == content(b)
+    for name in content(a):
+        assert a[name] == b[name], name
+    assert _slide_media(a) == _slide_media(b)
+    # No orphaned pictures are carried along
+    assert sum(n.startswith("ppt/media/") for n in a) == len(set(_slide_media(a).values()))
+
+
+@pytest.mark.parametrize("engine", ["fast", "pptx"])
+def test_patch_matches_full_build(engine, slides, photos):
+    deck = IncrementalDeck(engine=engine)
+    deck.build("Deck", slides, attach_images=True)
+
+    slides[3] = dict(slides[3], bullets=["Edited"], image_local_path=photos[2])
+    slides[7] = dict(slides[7], notes="New notes", image_local_path=None)
+    stats = {}
+    patched = deck.build("Deck", slides, attach_images=True, stats=stats)
+    assert stats["build_mode"] == "patch"
+    assert stats["patched_slides"] == 2
+
+    full, _ = ppt_core.assemble_deck(ppt_core.deck_slide_specs("Deck", slides), True, engine)
+    _assert_equivalent(patched.getvalue(), full)
+
+
+def test_repeated_patches_and_reuse(slides, photos):
+    deck = IncrementalDeck(engine="fast")
+    deck.build("Deck", slides, attach_images=True)
+    for n in range(3):
+        slides[5] = dict(slides[5], bullets=[f"Edit {n}"], image_local_path=photos[n % 3])
+        patched = deck.build("Deck", slides, attach_images=True)
+
+    stats = {}
+    reused = deck.build("Deck", slides, attach_images=True, stats=stats)
+    assert stats["build_mode"] == "reuse"
+    assert reused.getvalue() == patched.getvalue()
+    full, _ = ppt_core.assemble_deck(ppt_core.deck_slide_specs("Deck", slides), True, "fast")
+    _assert_equivalent(patched.getvalue(), full)
+
+
+def test_slide_count_change_is_a_full_build(slides):
+    deck = IncrementalDeck()
+    deck.build("Deck", slides)
+    stats = {}
+    deck.build("Deck", slides[:-1], stats=stats)
+    assert stats["build_mode"] == "full"
+
+
+def test_from_state_patches_another_builds_package(slides):
+    first = IncrementalDeck()
+    package = first.build("Deck", slides, attach_images=True).getvalue()
+    deck = IncrementalDeck.from_state(package, first.fingerprints, first.images, first.media_index)
+
+    slides[0] = dict(slides[0], slide_title="Renamed")
+    stats = {}
+    patched = deck.build("Deck", slides, attach_images=True, stats=stats)
+    assert stats["build_mode"] == "patch"
+    full, _ = ppt_core.assemble_deck(ppt_core.deck_slide_specs("Deck", slides), True)
+    _assert_equivalent(patched.getvalue(), full)
@@ -0,0 +1,87 @@
+import os
+import stat
+import threading
+import time
+
+import ppt_core
+import ppt_worker
+from job_queue import JobQueue
+
+
+def _slides_payload(count=3):
+    sections = [f"Section {i}" for i in range(count)]
+    return {"title": "Deck", "slides": [None] * count, "sections": sections,
+            "dirty": list(range(count)), "audience": "General", "images": False}
+
+
+def test_worker_that_lost_its_job_cannot_touch_it(tmp_path):
+    queue = JobQueue(str(tmp_path), stale_seconds=0.05)
+    job_id = queue.submit("slides", {"n": 1})
+    assert queue.claim("worker-a")[0] == job_id
+
+    # worker-a misses its heartbeats; the job is requeued and worker-b takes it
+    time.sleep(0.1)
+    assert queue.claim("worker-b")[0] == job_id
+
+    assert not queue.progress(job_id, "worker-a", 1, 2)
+    assert not queue.heartbeat_worker("worker-a", job_id)
+    assert not queue.complete(job_id, "worker-a", {"from": "a"})
+    assert not queue.fail(job_id, "worker-a", "late failure")
+    assert queue.get(job_id)["status"] == "running"
+
+    assert queue.progress(job_id, "worker-b", 1, 2)
+    assert queue.complete(job_id, "worker-b", {"from": "b"})
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"from": "b"}
+
+
+def test_cancelled_job_stays_cancelled(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    job_id = queue.submit("slides", {})
+    queue.claim("worker-a")
+    assert queue.cancel(job_id)
+    assert not queue.progress(job_id, "worker-a", 1, 1)
+    assert not queue.complete(job_id, "worker-a", {})
+    assert queue.get(job_id)["status"] == "cancelled"
+
+
+def test_queue_files_are_private(tmp_path):
+    root = tmp_path / "jobs"
+    queue = JobQueue(str(root))
+    queue.submit("slides", {"title": "Deck"})
+    assert stat.S_IMODE(os.stat(root).st_mode) == 0o700
+    for name in ("jobs.sqlite3", "jobs.sqlite3-wal"):
+        if (root / name).exists():
+            assert stat.S_IMODE(os.stat(root / name).st_mode) == 0o600
+
+
+def test_regenerate_slides_keeps_old_slides_when_cancelled():
+    old = [{"slide_title": "A", "rev": 3}, {"slide_title": "B", "rev": 1}]
+    cancel = threading.Event()
+    cancel.set()
+    merged, _ = ppt_core.regenerate_slides("Deck", old, ["A", "B"], [0, 1], "General", cancel_event=cancel)
+    assert merged == old
+
+    merged, _ = ppt_core.regenerate_slides("Deck", old, ["A", "B"], [1], "General")
+    assert merged[0] is old[0]
+    assert merged[1]["rev"] == 2 and merged[1]["bullets"]
+
+
+def test_cancelled_slides_job_is_not_failed(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    job_id = queue.submit("slides", _slides_payload())
+    job = queue.claim("worker-a")
+    queue.cancel(job_id)
+
+    ppt_worker.run_job(queue, "worker-a", job)
+    job = queue.get(job_id)
+    assert job["status"] == "cancelled" and job["error"] is None
+
+
+def test_slides_job_completes(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    job_id = queue.submit("slides", _slides_payload())
+    ppt_worker.run_job(queue, "worker-a", queue.claim("worker-a"))
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert [s["slide_title"] for s in job["result"]["slides"]] == ["Section 0", "Section 1", "Section 2"]
@@ -0,0 +1,59 @@
+import pytest
+
+import ppt_core
+from llm_backends import LLMBackend, LLMResponse, TemplateBackend
+
+
+# Replies with `bad` until told otherwise, then like the template backend
+class FlakyBackend(LLMBackend):
+    name = "flaky"
+
+    def __init__(self, model_name, bad):
+        self.model_name = model_name
+        self.bad = bad
+        self.calls = 0
+        self.template = TemplateBackend()
+
+    def generate(self, parts, generation_config=None):
+        self.calls += 1
+        return LLMResponse(self.bad if self.bad is not None else self.template.reply("\n".join(parts)))
+
+
+@pytest.fixture
+def flaky(request):
+    backend = FlakyBackend(f"flaky-{request.node.name}", bad='{"slides": "not a list"')
+    ppt_core.set_backend("template", backend)
+    yield backend
+    ppt_core.set_backend("template", None)
+
+
+def test_rejected_batch_reply_is_not_cached(flaky):
+    titles = ["Intro", "Details"]
+    assert ppt_core.generate_slide_batch("Deck", titles, "General") == [None, None]
+    assert ppt_core.generate_slide_batch("Deck", titles, "General") == [None, None]
+    assert flaky.calls == 2
+
+    flaky.bad = None
+    slides = ppt_core.generate_slide_batch("Deck", titles, "General")
+    assert all(slides)
+    assert ppt_core.generate_slide_batch("Deck", titles, "General") == slides
+    assert flaky.calls == 3
+
+
+def test_rejected_outline_reply_is_not_cached(flaky):
+    sections, parts = ppt_core.generate_outline("Topic", "Deck", 5, "General")
+    assert parts == [] and len(sections) == 5
+    flaky.bad = None
+    sections, parts = ppt_core.generate_outline("Topic", "Deck", 5, "General")
+    assert parts and flaky.calls == 2
+
+
+def test_unusable_cached_entry_is_replaced(flaky):
+    flaky.bad = None
+    parts = ["Write exactly 3 slide titles for part 1"]
+    key = ppt_core.LLMCache.make_key(flaky.model_name, parts, None)
+    ppt_core.get_llm_cache().put(key, "not json", model=flaky.model_name)
+
+    text = ppt_core.generate_cached(parts, validate=ppt_core.parse_part_sections)
+    assert text != "not json" and flaky.calls == 1
+    assert ppt_core.get_llm_cache().get(key) == text
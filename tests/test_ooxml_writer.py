@@ -0,0 +1,81 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import ppt_core
+
+PRES_NS = {"p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+           "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"}
+# Parts the engines write in a different order or with other relationship ids
+REORDERED = ("[Content_Types].xml", "ppt/presentation.xml", "ppt/_rels/presentation.xml.rels")
+
+
+def _build(specs, engine, attach_images=True):
+    package, images = ppt_core.assemble_deck(specs, attach_images, engine)
+    return zipfile.ZipFile(io.BytesIO(package)), images
+
+
+def _slide_order(z):
+    rels = {rel.get("Id"): rel.get("Target") for rel in ET.fromstring(z.read("ppt/_rels/presentation.xml.rels"))}
+    pres = ET.fromstring(z.read("ppt/presentation.xml"))
+    return [rels[s.get("{%s}id" % PRES_NS["r"])] for s in pres.find("p:sldIdLst", PRES_NS)]
+
+
+def _rel_targets(z):
+    return sorted((rel.get("Type"), rel.get("Target")) for rel in ET.fromstring(z.read("ppt/_rels/presentation.xml.rels")))
+
+
+def _content_types(z):
+    return sorted(tuple(sorted(e.attrib.items())) for e in ET.fromstring(z.read("[Content_Types].xml")))
+
+
+@pytest.mark.parametrize("count", [1, 7])
+def test_fast_engine_writes_what_python_pptx_writes(count, photos):
+    slides = [
+        {"slide_title": f"Slide {i} <{i}>", "bullets": [f"Bullet & {i}", "Another"] if i % 3 else [],
+         "notes": f"Notes\nline {i}" if i % 2 else "", "image_local_path": photos[i % 3] if i % 2 else None}
+        for i in range(count)
+    ]
+    specs = ppt_core.deck_slide_specs("Deck & title", slides)
+    fast, fast_images = _build(specs, "fast")
+    pptx, pptx_images = _build(specs, "pptx")
+
+    assert sorted(fast.namelist()) == sorted(pptx.namelist())
+    for name in fast.namelist():
+        if name not in REORDERED:
+            assert fast.read(name) == pptx.read(name), name
+    assert _slide_order(fast) == _slide_order(pptx)
+    assert _rel_targets(fast) == _rel_targets(pptx)
+    assert _content_types(fast) == _content_types(pptx)
+    assert fast_images == pptx_images
+
+
+# Without content slides python-pptx never adds the notes master the fast
+# template always carries; the deck is still the same two slides
+def test_deck_without_content_slides():
+    from pptx import Presentation
+
+    for engine in ("fast", "pptx"):
+        package, _ = ppt_core.assemble_deck(ppt_core.deck_slide_specs("Deck", []), False, engine)
+        prs = Presentation(io.BytesIO(package))
+        assert [slide.shapes.title.text if slide.shapes.title else None for slide in prs.slides][0] == "Deck"
+        assert len(prs.slides) == 2
+
+
+def test_fast_deck_opens_with_the_same_slides(slides):
+    from pptx import Presentation
+
+    specs = ppt_core.deck_slide_specs("Deck", slides)
+    texts = []
+    for engine in ("fast", "pptx"):
+        package, _ = ppt_core.assemble_deck(specs, True, engine)
+        prs = Presentation(io.BytesIO(package))
+        texts.append([
+            ([shape.text_frame.text for shape in slide.shapes if shape.has_text_frame],
+             slide.notes_slide.notes_text_frame.text if slide.has_notes_slide else None)
+            for slide in prs.slides
+        ])
+    assert texts[0] == texts[1]
+    assert len(texts[0]) == len(slides) + 2
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from rate_control import AdaptiveLimiter, RateController, RateLimited, TokenBucket, QuotaWaitExceeded
+
+
+def test_limit_grows_additively_on_fast_successes():
+    limiter = AdaptiveLimiter(4, max_limit=6, latency_target=1.0)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(latency=0.01)
+    # +1/limit per success: about one slot per window of `limit` successes
+    assert limiter.limit == pytest.approx(5.0, abs=0.1)
+    for _ in range(50):
+        limiter.acquire()
+        limiter.release(latency=0.01)
+    assert limiter.limit == 6
+
+
+def test_limit_halves_once_per_interval_on_throttling():
+    limiter = AdaptiveLimiter(8, min_limit=1, decrease_interval=60)
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(latency=0.01, throttled=True)
+    # Requests in flight together report the same congestion: one decrease
+    assert limiter.limit == 4
+    limiter._last_decrease -= 60
+    limiter.acquire()
+    limiter.release(latency=0.01, throttled=True)
+    assert limiter.limit == 2
+
+
+def test_slow_responses_shrink_the_limit_gently():
+    limiter = AdaptiveLimiter(10, latency_target=0.5, latency_backoff=0.9, decrease_interval=0)
+    limiter.acquire()
+    limiter.release(latency=2.0)
+    assert limiter.limit == pytest.approx(9.0)
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = AdaptiveLimiter(2, min_limit=1, decrease_interval=0)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(latency=0.01, throttled=True)
+    assert limiter.limit == 1
+
+
+def test_bucket_refuses_waits_longer_than_max_wait():
+    bucket = TokenBucket(rate_per_second=0.01, burst=1)
+    bucket.acquire()
+    with pytest.raises(QuotaWaitExceeded):
+        bucket.acquire(max_wait=0.1)
+
+
+def test_throttled_calls_are_retried_and_counted():
+    rc = RateController("test", rate_per_second=1000, burst=100, concurrency=4, base_delay=0.001, max_delay=0.01)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise RateLimited("slow down", retry_after=0)
+        return "ok"
+
+    assert rc.call(flaky) == "ok"
+    stats = rc.stats()
+    assert stats["retries"] == 2 and stats["throttled"] == 2 and stats["failures"] == 0
+    assert stats["concurrency_limit"] < 4
+
+
+def test_other_errors_are_not_retried():
+    rc = RateController("test", rate_per_second=1000, burst=100, concurrency=4)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        rc.call(broken)
+    assert len(calls) == 1 and rc.stats()["failures"] == 1
+
+
+def test_failures_never_raise_the_limit():
+    rc = RateController("test", rate_per_second=1000, burst=100, concurrency=4, max_attempts=1)
+    rc.limiter.decrease_interval = 0
+
+    def fail(error):
+        raise error
+
+    with pytest.raises(ConnectionError):
+        rc.call(fail, ConnectionError("reset"))
+    assert rc.limiter.limit == 4
+
+    # A retryable 5xx is congestion, like a 429, but is not counted as throttling
+    with pytest.raises(RateLimited):
+        rc.call(fail, RateLimited("unavailable", status=503))
+    assert rc.limiter.limit == 2
+    assert rc.stats()["throttled"] == 0
@@ -0,0 +1,182 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import FlightAbandoned, FlightCancelled, FlightTimeout, SingleFlight
+
+
+# Starts `n` threads running call() together; returns their outcomes
+def _race(call, n=8):
+    outcomes = [None] * n
+    barrier = threading.Barrier(n)
+
+    def run(i):
+        barrier.wait()
+        try:
+            outcomes[i] = ("ok", call())
+        except Exception as e:
+            outcomes[i] = ("error", e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return outcomes
+
+
+def _slow(calls, result=None, error=None, delay=0.2):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return fn
+
+
+def test_identical_calls_run_once():
+    flight, calls = SingleFlight("test"), []
+    fn = _slow(calls, result={"v": 1})
+    outcomes = _race(lambda: flight.do("k", fn))
+    assert len(calls) == 1
+    assert all(outcome == ("ok", {"v": 1}) for outcome in outcomes)
+    assert flight.stats() == {"leader": 1, "coalesced": 7, "timeout": 0, "cancelled": 0, "abandoned": 0, "in_flight": 0}
+
+
+def test_every_waiter_gets_the_leaders_exception():
+    flight, calls = SingleFlight("test"), []
+    error = ValueError("quota")
+    fn = _slow(calls, error=error)
+    outcomes = _race(lambda: flight.do("k", fn))
+    assert len(calls) == 1
+    assert all(kind == "error" and e is error for kind, e in outcomes)
+    # The next call starts a new flight instead of reusing the failure
+    assert flight.do("k", lambda: "fresh") == "fresh"
+
+
+def test_different_keys_do_not_coalesce():
+    flight, calls = SingleFlight("test"), []
+    threads = [threading.Thread(target=flight.do, args=(k, _slow(calls, delay=0.05))) for k in "abc"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 3
+
+
+def _waiter_during(flight, calls, **wait_kwargs):
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "leader"
+
+    leader = threading.Thread(target=flight.do, args=("k", leader_fn))
+    leader.start()
+    started.wait(5)
+    try:
+        return flight.do("k", lambda: "own call", **wait_kwargs)
+    finally:
+        release.set()
+        leader.join()
+
+
+def test_waiter_timeout_and_cancel_only_affect_that_waiter():
+    flight, calls = SingleFlight("test"), []
+    with pytest.raises(FlightTimeout):
+        _waiter_during(flight, calls, timeout=0.05)
+
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    with pytest.raises(FlightCancelled):
+        _waiter_during(flight, calls, cancel_event=cancel)
+    assert len(calls) == 2
+    assert flight.stats()["timeout"] == 1 and flight.stats()["cancelled"] == 1
+
+
+def test_abandoned_leader_releases_waiters():
+    flight = SingleFlight("test")
+    key_flight, leader = flight.begin("k")
+    assert leader
+    outcome = []
+
+    def wait():
+        try:
+            flight.do("k", lambda: "own call")
+        except FlightAbandoned as e:
+            outcome.append(e)
+
+    t = threading.Thread(target=wait)
+    t.start()
+    time.sleep(0.05)
+    flight.finish("k", key_flight, abandoned=True)
+    t.join(5)
+    assert len(outcome) == 1
+
+
+# ppt_core's wrapper: one call per burst of identical requests, and the same
+# exception for everyone when it fails
+def test_ppt_core_coalesced_calls_run_once():
+    import ppt_core
+
+    calls, error = [], RuntimeError("boom")
+    fn = _slow(calls, error=error)
+    outcomes = _race(lambda: ppt_core.coalesced("llm", "test-key", fn), n=6)
+    assert len(calls) == 1
+    assert all(kind == "error" and e is error for kind, e in outcomes)
+
+
+class _SlowModel:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def generate_content(self, parts, generation_config=None):
+        from llm_backends import LLMResponse
+
+        self.calls.append(1)
+        time.sleep(0.2)
+        return LLMResponse("reply")
+
+
+# Identical requests made with different API keys must not share a call (nor
+# its auth/quota error); with the same key they still do
+def test_different_api_keys_do_not_coalesce(monkeypatch):
+    import ppt_core
+    from llm_backends import GeminiBackend
+
+    searches = []
+
+    def search(query, api_key):
+        searches.append(api_key)
+        time.sleep(0.2)
+        return [{"url": api_key}]
+
+    monkeypatch.setattr(ppt_core, "_search_candidates", search)
+    keys = iter(["key-a", "key-b", "key-a", "key-b"])
+    lock = threading.Lock()
+
+    def candidates():
+        with lock:
+            key = next(keys)
+        return ppt_core.image_candidates("same query", key, refresh=True)
+
+    outcomes = _race(candidates, n=4)
+    assert sorted(searches) == ["key-a", "key-b"]
+    assert sorted(result[0]["url"] for _, result in outcomes) == ["key-a", "key-a", "key-b", "key-b"]
+
+    calls = []
+    backends = [GeminiBackend(key, "fake-model", model=_SlowModel(calls)) for key in ("key-a", "key-b")]
+    backends = backends + backends
+    key = ppt_core.LLMCache.make_key("fake-model", ["same prompt"], None)
+
+    def generate():
+        with lock:
+            backend = backends.pop()
+        return ppt_core._call_backend_once(backend, key, ["same prompt"], None).text
+
+    assert all(result == ("ok", "reply") for result in _race(generate, n=4))
+    assert len(calls) == 2